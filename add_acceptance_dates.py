@@ -24,14 +24,14 @@ def add_date_columns_to_acceptance(conn):
             # exam_date 列を追加 (存在しない場合のみ)
             cur.execute('''
                 ALTER TABLE university_acceptance
-                ADD COLUMN IF NOT EXISTS exam_date TEXT;
+                ADD COLUMN IF NOT EXISTS exam_date DATE;
             ''')
             print("  - exam_date 列を追加（または確認）しました。")
 
             # announcement_date 列を追加 (存在しない場合のみ)
             cur.execute('''
                 ALTER TABLE university_acceptance
-                ADD COLUMN IF NOT EXISTS announcement_date TEXT;
+                ADD COLUMN IF NOT EXISTS announcement_date DATE;
             ''')
             print("  - announcement_date 列を追加（または確認）しました。")
         conn.commit()
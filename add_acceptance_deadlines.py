@@ -26,14 +26,14 @@ def add_deadline_columns_to_acceptance(conn):
             # application_deadline 列を追加 (存在しない場合のみ)
             cur.execute('''
                 ALTER TABLE university_acceptance
-                ADD COLUMN IF NOT EXISTS application_deadline TEXT;
+                ADD COLUMN IF NOT EXISTS application_deadline DATE;
             ''')
             print("  - application_deadline 列を追加（または確認）しました。")
 
             # procedure_deadline 列を追加 (存在しない場合のみ)
             cur.execute('''
                 ALTER TABLE university_acceptance
-                ADD COLUMN IF NOT EXISTS procedure_deadline TEXT;
+                ADD COLUMN IF NOT EXISTS procedure_deadline DATE;
             ''')
             print("  - procedure_deadline 列を追加（または確認）しました。")
         conn.commit()
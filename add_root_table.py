@@ -15,17 +15,28 @@ def create_root_tables_table():
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
+            # ファイル本体は内容アドレス (SHA-256) の root_table_blobs に保存する (マイグレーション v0006 と同じ構成)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS root_table_blobs (
+                    content_sha256 TEXT PRIMARY KEY,
+                    content BYTEA NOT NULL,
+                    file_size BIGINT NOT NULL,
+                    ref_count INTEGER NOT NULL DEFAULT 0,
+                    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+                );
+            """)
+            cur.execute("ALTER TABLE root_table_blobs ALTER COLUMN content SET STORAGE EXTERNAL")
             # テーブル作成のSQL実行
             # 科目(subject)、レベル(level)、年度(academic_year)のカラムを含みます
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS root_tables (
                     id SERIAL PRIMARY KEY,
                     filename TEXT NOT NULL,
-                    file_content BYTEA NOT NULL,
                     subject TEXT,
                     level TEXT,
                     academic_year INT,
-                    uploaded_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                    uploaded_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    content_sha256 TEXT NOT NULL REFERENCES root_table_blobs (content_sha256)
                 );
             """)
             print("Success: 'root_tables' テーブルが正常に作成または確認されました。")
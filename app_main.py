@@ -11,12 +11,13 @@ import dash
 import dash_bootstrap_components as dbc
 from dash import dcc, html, Input, Output, no_update # ★ no_update をインポート
 import plotly.io as pio
-from flask import request, jsonify # Flaskのrequestとjsonifyを追加
+from flask import request, jsonify, Response, stream_with_context, make_response # Flaskのrequestとjsonifyを追加
+import functools
+from urllib.parse import quote
+import mimetypes
 import json # jsonを追加
-from data.nested_json_processor import get_db_connection
 import psycopg2
-from psycopg2.extras import DictCursor
-from datetime import datetime, date # date をインポート
+from datetime import date # date をインポート
 
 # --- グラフ描画の安定化のため、デフォルトテンプレートを設定 ---
 pio.templates.default = "plotly_white"
@@ -32,7 +33,19 @@ from data.nested_json_processor import (
     get_all_subjects, get_student_info_by_id,
     get_student_count_by_school, get_textbook_count_by_subject,
     add_past_exam_result, add_acceptance_result,
-    add_mock_exam_result # ★★★ add_mock_exam_result をインポート ★★★
+    add_mock_exam_result, # ★★★ add_mock_exam_result をインポート ★★★
+    get_root_table_metadata, iter_root_table_content
+)
+from utils.download_tokens import verify_root_table_token
+from data.batch_ingest import (
+    parse_past_exam_submission, parse_acceptance_submission, parse_mock_exam_submission,
+    iter_ndjson, ingest_batch, summarize_batch_results
+)
+from data import idempotency
+from data.student_lookup import find_student_id
+from data.submission_queue import (
+    is_async_enabled, enqueue, enqueue_batch, get_job_statuses,
+    start_worker as start_submission_queue_worker
 )
 from components.main_layout import create_main_layout, create_navbar
 from components.homework_layout import create_homework_layout
@@ -71,6 +84,12 @@ from components.statistics_layout import create_statistics_layout
 from callbacks.statistics_callbacks import register_statistics_callbacks
 from components.root_table_layout import create_root_table_layout
 from callbacks.root_table_callbacks import register_root_table_callbacks
+from components.callback_profile_layout import create_callback_profile_layout
+from callbacks.callback_profile_callbacks import register_callback_profile_callbacks
+from utils.callback_profiler import DASH_UPDATE_PATH, init_callback_profiler
+from utils.metrics import init_metrics, count_batch_records
+from data.db_pool import init_request_connection_scope
+from data.invalidation import start_listener as start_cache_invalidation_listener
 
 
 
@@ -89,6 +108,12 @@ app.index_string = APP_INDEX_STRING
 # 環境変数から取得するか、なければデフォルト値を設定
 app.server.secret_key = os.getenv('SECRET_KEY', APP_CONFIG['server']['secret_key'])
 server = app.server # Flaskサーバーインスタンスを取得
+# コールバックごとの所要時間・応答サイズを計測 (管理者ページ /admin/callback-profile で確認)
+init_callback_profiler(server)
+# Prometheus 形式の /metrics (gunicorn では gunicorn.conf.py の設定で全ワーカー分を集計)
+init_metrics(server)
+# コールバック1回の間、データ層の関数で1本の接続を共有する (リクエストの終了時にプールへ返却)
+init_request_connection_scope(server, [DASH_UPDATE_PATH])
 
 # --- メインレイアウト ---
 app.layout = html.Div([
@@ -183,6 +208,11 @@ def display_page(pathname, auth_store_data):
         page_content = create_bug_report_layout(user_info)
     elif pathname == '/changelog':
         page_content = create_changelog_layout()
+    elif pathname == '/admin/callback-profile':
+        if user_info.get('role') != 'admin':
+            page_content = create_access_denied_layout()
+        else:
+            page_content = create_callback_profile_layout()
     elif pathname == '/admin':
         # 管理者権限チェック
         if user_info.get('role') != 'admin':
@@ -247,6 +277,12 @@ def display_page(pathname, auth_store_data):
                             html.P("校舎全体の模試結果を一覧表示・検索します。", className="card-text small text-muted"),
                             dbc.Button("模試結果一覧を表示", id="open-mock-exam-list-modal-btn", color="primary")
                         ])], className="mb-3"),
+
+                        dbc.Card([dbc.CardBody([
+                            html.H5("⏱ コールバック計測", className="card-title"),
+                            html.P("画面の更新 (コールバック) とデータ取得の所要時間・応答サイズの上位を表示します。", className="card-text small text-muted"),
+                            dbc.Button("計測結果を表示", href="/admin/callback-profile", color="dark")
+                        ])], className="mb-3"),
                     ], md=6),
                 ]),
 
@@ -301,10 +337,17 @@ register_past_exam_callbacks(app) # 過去問・入試・模試コールバッ
 register_bug_report_callbacks(app)
 register_statistics_callbacks(app)
 register_root_table_callbacks(app)
+register_callback_profile_callbacks(app)
+
+# --- ワーカー間のキャッシュ無効化 (LISTEN/NOTIFY) の受信を開始 ---
+# gunicornでは各ワーカーがこのモジュールを読み込むため、ワーカーごとにリスナースレッドが1本起動する
+start_cache_invalidation_listener()
+# 非同期モード (API_ASYNC_SUBMISSIONS=true) の場合、フォーム連携APIのキューを処理するスレッドを起動
+start_submission_queue_worker()
 
 # === APIエンドポイント ===
 
-# --- 生徒ID取得API (変更なし) ---
+# --- 生徒ID取得API ---
 @server.route('/api/get-student-id', methods=['GET'])
 def get_student_id_by_name():
     auth_key = request.headers.get('X-API-KEY')
@@ -314,22 +357,80 @@ def get_student_id_by_name():
     name = request.args.get('name')
     if not school or not name:
         return jsonify({"success": False, "message": "Missing 'school' or 'name' query parameter"}), 400
-    conn = None
     try:
-        conn = get_db_connection()
-        with conn.cursor(cursor_factory=DictCursor) as cur:
-            cur.execute("SELECT id FROM students WHERE school = %s AND name = %s", (school, name))
-            student = cur.fetchone()
-        if student: return jsonify({"success": True, "student_id": student['id']}), 200
+        # 表記揺れ (全角/半角スペース・カタカナ/ひらがな) を吸収した索引から引く (DBには問い合わせない)
+        student_id, error = find_student_id(school, name)
+        if student_id is not None: return jsonify({"success": True, "student_id": student_id}), 200
+        elif error == 'ambiguous': return jsonify({"success": False, "message": "Multiple students match the name"}), 409
         else: return jsonify({"success": False, "message": "Student not found"}), 404
-    except (Exception, psycopg2.Error) as e:
+    except Exception as e:
         print(f"Error processing /api/get-student-id: {e}")
         return jsonify({"success": False, "message": "An internal error occurred"}), 500
-    finally:
-        if conn: conn.close()
 
-# --- 過去問結果送信API (変更なし) ---
+# --- 再送による重複登録の防止 ---
+def idempotent(endpoint, hash_body=True):
+    """
+    フォーム連携APIを Idempotency-Key (無ければ本文のハッシュ) で冪等にするデコレーター。
+    処理済みのキーには登録せずに最初の応答を返す (Idempotent-Replayed: true)。
+    hash_body=False (NDJSON を受ける一括API) はヘッダーのキーがある場合のみ対象にする。
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            header_key = request.headers.get('Idempotency-Key')
+            # 認証前のリクエストでキーを消費しないよう、APIキーが正しい場合のみ対象にする
+            if request.headers.get('X-API-KEY') != API_KEY or (not hash_body and not header_key):
+                return view(*args, **kwargs)
+
+            if hash_body:
+                request_hash = idempotency.make_request_hash(endpoint, request.get_json(silent=True))
+            else:
+                request_hash = idempotency.make_request_hash(endpoint, header_key)
+            key = idempotency.make_idempotency_key(endpoint, header_key, request_hash)
+            try:
+                state, stored = idempotency.begin_request(key, endpoint, request_hash)
+            except psycopg2.Error as e:
+                print(f"データベースエラー (idempotency {endpoint}): {e}")
+                return jsonify({"success": False, "message": "An internal error occurred"}), 500
+
+            if state == idempotency.BEGIN_REPLAY:
+                response = make_response(jsonify(stored[1]), stored[0])
+                response.headers['Idempotent-Replayed'] = 'true'
+                return response
+            if state == idempotency.BEGIN_PROCESSING:
+                response = make_response(jsonify({"success": False, "message": "A request with the same key is being processed"}), 409)
+                response.headers['Retry-After'] = '5'
+                return response
+            if state == idempotency.BEGIN_MISMATCH:
+                return jsonify({"success": False, "message": "Idempotency-Key was reused with a different request body"}), 422
+
+            try:
+                response = make_response(view(*args, **kwargs))
+            except Exception:
+                idempotency.release_request(key)
+                raise
+            if response.status_code >= 500:
+                idempotency.release_request(key)
+            else:
+                idempotency.complete_request(key, response.status_code, response.get_json(silent=True))
+            return response
+        return wrapper
+    return decorator
+
+# --- 非同期モード ---
+def _queued_response(target, data):
+    """検証済みの入力をキューに積み、202 とジョブの状態確認用URLを返す"""
+    job_id = enqueue(target, [data])[0]
+    return jsonify({
+        "success": True,
+        "message": "Accepted",
+        "job_id": job_id,
+        "status_url": f"/api/submission-jobs/{job_id}"
+    }), 202
+
+# --- 過去問結果送信API ---
 @server.route('/api/submit-past-exam', methods=['POST'])
+@idempotent('submit-past-exam')
 def submit_past_exam_result():
     auth_key = request.headers.get('X-API-KEY')
     if auth_key != API_KEY:
@@ -337,51 +438,32 @@ def submit_past_exam_result():
     try:
         data = request.get_json()
         print(f"Received past exam data via API: {data}") # ログ出力
-        required_fields = ['student_id', 'date', 'university_name', 'year', 'subject', 'total_questions']
-        if not all(field in data for field in required_fields):
-            print(f"Missing required fields in past exam data: { {f for f in required_fields if f not in data} }")
-            return jsonify({"success": False, "message": "Missing required fields"}), 400
-        try:
-            student_id = int(data['student_id'])
-            year = int(data['year'])
-            total_questions = int(data['total_questions']) if data.get('total_questions') is not None else None
-            correct_answers = int(data['correct_answers']) if data.get('correct_answers') is not None else None
-            time_required = int(data['time_required']) if data.get('time_required') is not None else None
-            total_time_allowed = int(data['total_time_allowed']) if data.get('total_time_allowed') is not None else None
-            date_val = datetime.strptime(str(data['date']), '%Y-%m-%d').date() # dateオブジェクトに
-        except (ValueError, TypeError) as e:
-            print(f"Data conversion error in past exam API: {e}")
-            return jsonify({"success": False, "message": f"Invalid data format: {e}"}), 400
-        result_data = {
-            'date': date_val, 'university_name': data['university_name'],
-            'faculty_name': data.get('faculty_name'), 'exam_system': data.get('exam_system'),
-            'year': year, 'subject': data['subject'], 'time_required': time_required,
-            'total_time_allowed': total_time_allowed, 'correct_answers': correct_answers,
-            'total_questions': total_questions }
-        success, message = add_past_exam_result(student_id, result_data)
+        record, error = parse_past_exam_submission(data)
+        if error:
+            print(f"Invalid past exam data: {error}")
+            return jsonify({"success": False, "message": error}), 400
+        if is_async_enabled():
+            return _queued_response('past_exam', data)
+        student_id = record.pop('student_id')
+        success, message = add_past_exam_result(student_id, record)
         if success: return jsonify({"success": True, "message": message}), 200
         else: return jsonify({"success": False, "message": message}), 500
     except json.JSONDecodeError: return jsonify({"success": False, "message": "Invalid JSON data"}), 400
     except Exception as e: print(f"Error processing /api/submit-past-exam: {e}"); return jsonify({"success": False, "message": "An internal error occurred"}), 500
 
-# --- 入試結果送信API (変更なし) ---
+# --- 入試結果送信API ---
 @server.route('/api/submit-acceptance', methods=['POST'])
+@idempotent('submit-acceptance')
 def submit_acceptance_result():
     auth_key = request.headers.get('X-API-KEY')
     if auth_key != API_KEY: return jsonify({"success": False, "message": "Unauthorized"}), 401
     try:
         data = request.get_json(); print(f"Received acceptance data via API: {data}")
-        required_fields = ['student_id', 'university_name', 'faculty_name']
-        if not all(field in data for field in required_fields): print(f"Missing required fields in acceptance data: { {f for f in required_fields if f not in data} }"); return jsonify({"success": False, "message": "Missing required fields"}), 400
-        try:
-            student_id = int(data['student_id'])
-            date_fields = ['application_deadline', 'exam_date', 'announcement_date', 'procedure_deadline']
-            result_data = { 'university_name': data['university_name'], 'faculty_name': data['faculty_name'], 'department_name': data.get('department_name'), 'exam_system': data.get('exam_system'), 'result': data.get('result') }
-            for field in date_fields:
-                if data.get(field): result_data[field] = datetime.strptime(str(data[field]), '%Y-%m-%d').date() # dateオブジェクトに
-                else: result_data[field] = None
-        except (ValueError, TypeError) as e: print(f"Data conversion error in acceptance API: {e}"); return jsonify({"success": False, "message": f"Invalid data format: {e}"}), 400
-        success, message = add_acceptance_result(student_id, result_data)
+        record, error = parse_acceptance_submission(data)
+        if error: print(f"Invalid acceptance data: {error}"); return jsonify({"success": False, "message": error}), 400
+        if is_async_enabled(): return _queued_response('acceptance', data)
+        student_id = record.pop('student_id')
+        success, message = add_acceptance_result(student_id, record)
         if success: return jsonify({"success": True, "message": message}), 200
         else: return jsonify({"success": False, "message": message}), 500
     except json.JSONDecodeError: return jsonify({"success": False, "message": "Invalid JSON data"}), 400
@@ -389,6 +471,7 @@ def submit_acceptance_result():
 
 # ★★★ 模試結果送信APIを追加 ★★★
 @server.route('/api/submit-mock-exam', methods=['POST'])
+@idempotent('submit-mock-exam')
 def submit_mock_exam_result():
     # APIキーの検証
     auth_key = request.headers.get('X-API-KEY')
@@ -399,36 +482,18 @@ def submit_mock_exam_result():
         data = request.get_json()
         print(f"Received mock exam data via API: {data}") # ログ出力
 
-        # --- 必須項目の検証 ---
+        # --- 必須項目・student_id・日付形式の検証 (一括APIと共通) ---
         # Googleフォームからの項目名に合わせて調整が必要な場合がある
         # ここでは、キーがDBカラム名と（ほぼ）一致すると仮定
-        required_fields = ['student_id', 'result_type', 'mock_exam_name', 'mock_exam_format', 'grade', 'round']
-        missing_fields = [f for f in required_fields if f not in data or not data[f]]
-        if missing_fields:
-             print(f"Missing required fields in mock exam data: {missing_fields}")
-             return jsonify({"success": False, "message": f"Missing required fields: {', '.join(missing_fields)}"}), 400
-
-        # --- student_id の数値変換 ---
-        try:
-            student_id = int(data['student_id'])
-        except (ValueError, TypeError):
-             print(f"Invalid student_id format: {data.get('student_id')}")
-             return jsonify({"success": False, "message": "Invalid student_id format"}), 400
-
-        # --- データ整形 ---
-        # add_mock_exam_result 関数内で型変換やNone処理を行うため、ここでは必須項目の存在確認のみ
-        # 必要であれば、ここでさらに詳細なバリデーションや整形を行う
-        # 例：日付形式の事前チェックなど
-        if data.get('exam_date'):
-            try:
-                datetime.strptime(str(data['exam_date']), '%Y-%m-%d')
-            except (ValueError, TypeError):
-                 print(f"Invalid exam_date format: {data.get('exam_date')}")
-                 return jsonify({"success": False, "message": "Invalid exam_date format (YYYY-MM-DD expected)"}), 400
+        record, error = parse_mock_exam_submission(data)
+        if error:
+            print(f"Invalid mock exam data: {error}")
+            return jsonify({"success": False, "message": error}), 400
+        if is_async_enabled():
+            return _queued_response('mock_exam', data)
 
         # --- データベースへの保存 ---
-        # data 辞書をそのまま渡す (add_mock_exam_result内で処理)
-        success, message = add_mock_exam_result(student_id, data)
+        success, message = add_mock_exam_result(record['student_id'], record)
 
         if success:
             return jsonify({"success": True, "message": message}), 200
@@ -444,6 +509,131 @@ def submit_mock_exam_result():
         return jsonify({"success": False, "message": "An internal error occurred"}), 500
 # ★★★ ここまで追加 ★★★
 
+# --- 一括送信API (過去問・入試・模試) ---
+# 本文は JSON配列、または Content-Type: application/x-ndjson の NDJSON (1行1件)。
+# 全行を検証し、正しい行をまとめて登録したうえで行ごとの結果を返す (一部の行が失敗しても 200)。
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/jsonl', 'application/json-seq')
+
+def _batch_records_from_request():
+    """リクエスト本文から1件ずつ返すイテラブルを作る。本文が不正な場合は None"""
+    if request.mimetype in NDJSON_MIMETYPES:
+        # 本文全体を読み込まず、行ごとに読みながら登録する
+        return iter_ndjson(request.stream)
+    data = request.get_json(silent=True)
+    return data if isinstance(data, list) else None
+
+def _handle_batch_submission(target):
+    auth_key = request.headers.get('X-API-KEY')
+    if auth_key != API_KEY:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+    records = _batch_records_from_request()
+    if records is None:
+        return jsonify({"success": False, "message": "Request body must be a JSON array or NDJSON"}), 400
+    try:
+        results = enqueue_batch(target, records) if is_async_enabled() else ingest_batch(target, records)
+    except Exception as e:
+        print(f"Error processing batch submission ({target}): {e}")
+        return jsonify({"success": False, "message": "An internal error occurred"}), 500
+    summary = summarize_batch_results(results)
+    print(f"Batch submission ({target}): {summary}")
+    count_batch_records(request.url_rule.rule, summary)
+    return jsonify({
+        "success": summary['created'] + summary['queued'] == summary['total'],
+        "summary": summary,
+        "results": results
+    }), 202 if summary['queued'] else 200
+
+@server.route('/api/submit-past-exam/batch', methods=['POST'])
+@idempotent('submit-past-exam/batch', hash_body=False)
+def submit_past_exam_results_batch():
+    return _handle_batch_submission('past_exam')
+
+@server.route('/api/submit-acceptance/batch', methods=['POST'])
+@idempotent('submit-acceptance/batch', hash_body=False)
+def submit_acceptance_results_batch():
+    return _handle_batch_submission('acceptance')
+
+@server.route('/api/submit-mock-exam/batch', methods=['POST'])
+@idempotent('submit-mock-exam/batch', hash_body=False)
+def submit_mock_exam_results_batch():
+    return _handle_batch_submission('mock_exam')
+
+# --- 非同期登録のジョブ状態 ---
+# /api/submission-jobs/<job_id> または /api/submission-jobs?ids=1,2,3
+# state: queued (未処理) / done (登録済み。result_id は登録された行のID) / failed (message に理由)
+@server.route('/api/submission-jobs', methods=['GET'])
+@server.route('/api/submission-jobs/<int:job_id>', methods=['GET'])
+def get_submission_job_status(job_id=None):
+    auth_key = request.headers.get('X-API-KEY')
+    if auth_key != API_KEY:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+    try:
+        job_ids = [job_id] if job_id is not None else [int(i) for i in request.args.get('ids', '').split(',') if i.strip()]
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid 'ids' query parameter"}), 400
+    if not job_ids:
+        return jsonify({"success": False, "message": "Missing 'ids' query parameter"}), 400
+    try:
+        jobs = get_job_statuses(job_ids)
+    except (Exception, psycopg2.Error) as e:
+        print(f"Error processing /api/submission-jobs: {e}")
+        return jsonify({"success": False, "message": "An internal error occurred"}), 500
+    if job_id is not None:
+        if not jobs:
+            return jsonify({"success": False, "message": "Job not found"}), 404
+        return jsonify({"success": True, **jobs[0]}), 200
+    return jsonify({"success": True, "jobs": jobs}), 200
+
+# --- ルート表 (PDF) ダウンロード ---
+# ファイル全体をワーカーのメモリに載せず、DBから分割して読みながら送信する。
+# Range (再開・PDFビューアーの部分読み込み) と ETag (内容のSHA-256) による再検証に対応。
+@server.route('/download/root-table/<int:table_id>', methods=['GET'])
+def download_root_table(table_id):
+    if not verify_root_table_token(request.args.get('token'), table_id):
+        return jsonify({"success": False, "message": "Forbidden"}), 403
+    file_info = get_root_table_metadata(table_id)
+    if not file_info:
+        return jsonify({"success": False, "message": "Root table not found"}), 404
+
+    etag = file_info['content_sha256']
+    size = file_info['file_size']
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'private, no-cache', # 毎回 ETag で再検証する
+        'Content-Disposition': f"attachment; filename*=UTF-8''{quote(file_info['filename'])}",
+    }
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304, headers=headers)
+        response.set_etag(etag)
+        return response
+
+    start, end, status = 0, size, 200
+    # If-Range が現在の内容と一致しない場合は Range を無視して全体を返す
+    range_header = request.range
+    if range_header is not None and range_header.units == 'bytes' and \
+            (request.if_range.etag is None or request.if_range.etag == etag):
+        byte_range = range_header.range_for_length(size) # 複数範囲の指定は None (全体を返す)
+        if byte_range is None and len(range_header.ranges) == 1:
+            response = Response(status=416, headers={**headers, 'Content-Range': f"bytes */{size}"})
+            response.set_etag(etag)
+            return response
+        if byte_range is not None:
+            start, end = byte_range
+            status = 206
+            headers['Content-Range'] = f"bytes {start}-{end - 1}/{size}"
+
+    headers['Content-Length'] = str(end - start)
+    response = Response(
+        stream_with_context(iter_root_table_content(etag, start, end)),
+        status=status,
+        headers=headers,
+        mimetype=mimetypes.guess_type(file_info['filename'])[0] or 'application/octet-stream',
+        direct_passthrough=True
+    )
+    response.set_etag(etag)
+    return response
+
 
 # --- アプリケーションの実行 ---
 if __name__ == '__main__':
@@ -3,14 +3,7 @@
 import psycopg2
 from psycopg2.extras import DictCursor
 from werkzeug.security import generate_password_hash, check_password_hash
-from config.settings import APP_CONFIG
-
-DATABASE_URL = APP_CONFIG['data']['database_url']
-
-def get_db_connection():
-    """PostgreSQLデータベース接続を取得します。"""
-    conn = psycopg2.connect(DATABASE_URL)
-    return conn
+from data.db_pool import get_db_connection # 接続はプロセス共有のプールから借りる
 
 def get_user(username):
     """ユーザー名でユーザー情報をデータベースから取得する"""
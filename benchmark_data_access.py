@@ -0,0 +1,316 @@
+# benchmark_data_access.py
+
+"""
+データ層の主要な関数のベンチマーク
+
+generate_synthetic_data.py の合成データを規模 (--scales) ごとに投入し直し、主要な関数を繰り返し呼び出して
+p50 / p95 の所要時間と1回あたりのクエリ数 (data/instrumentation.py の計測) を JSON に保存する。
+--compare で以前の結果と比べ、遅くなった・クエリが増えたケースを回帰として表示する (終了コード 1)。
+
+    # 1/20・1/5・本番規模で計測して benchmark_results/ に保存
+    python benchmark_data_access.py --scales 0.05,0.2,1
+    # 現在のDBのまま計測し、基準の結果と比較する (件数が同じ規模の結果と比べる)
+    python benchmark_data_access.py --no-generate --compare benchmark_results/baseline.json
+    # 保存済みの2つの結果を比較するだけ
+    python benchmark_data_access.py --input benchmark_results/new.json --compare benchmark_results/baseline.json
+
+add_or_update_student_progress のケースは合成データの進捗を書き換える。本番のDBでは実行しないこと。
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import psycopg2
+
+import generate_synthetic_data
+from data import instrumentation
+from data.db_pool import db_connection
+from data.nested_json_processor import (
+    PROGRESS_CACHE,
+    get_student_progress_by_id, get_students_for_user, get_student_level_statistics,
+    get_all_mock_exam_details_for_school, get_all_homework_for_student, add_or_update_student_progress
+)
+
+RESULTS_DIR = 'benchmark_results'
+
+# 回帰とみなす p95 の悪化率と、誤差として無視する差 (ミリ秒)
+DEFAULT_THRESHOLD = 0.20
+MIN_REGRESSION_MS = 1.0
+
+
+class BenchmarkSample:
+    """ベンチマークの入力 (合成データの校舎から決まった順で選んだ生徒・講師)"""
+
+    def __init__(self, school_prefix, seed, size=50):
+        rng = random.Random(seed)
+        pattern = school_prefix.replace('%', r'\%').replace('_', r'\_') + '%'
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT id, school FROM students WHERE school LIKE %s ORDER BY id", (pattern,))
+            students = cur.fetchall()
+            if not students:
+                raise ValueError(f"'{school_prefix}' で始まる校舎の生徒がいません。先に合成データを投入してください。")
+            self.student_ids = [row[0] for row in rng.sample(students, min(size, len(students)))]
+            self.school = students[0][1]
+
+            cur.execute(
+                "SELECT id, username, role, school FROM users WHERE school = %s ORDER BY id", (self.school,)
+            )
+            users = [dict(zip(('id', 'username', 'role', 'school'), row)) for row in cur.fetchall()]
+            self.admin_user = next(u for u in users if u['role'] == 'admin')
+            self.instructor_user = next((u for u in users if u['role'] != 'admin'), self.admin_user)
+
+            # 進捗の更新は各生徒の既存の進捗から5冊を選び、完了数を書き換える
+            cur.execute(
+                """
+                SELECT student_id, subject, level, book_name, total_units
+                FROM progress WHERE student_id = ANY(%s) AND master_textbook_id IS NOT NULL
+                ORDER BY student_id, id
+                """,
+                (self.student_ids,)
+            )
+            self.progress_rows = {}
+            for student_id, subject, level, book_name, total_units in cur.fetchall():
+                rows = self.progress_rows.setdefault(student_id, [])
+                if len(rows) < 5:
+                    rows.append({'subject': subject, 'level': level, 'book_name': book_name, 'total_units': total_units})
+
+    def student(self, i):
+        return self.student_ids[i % len(self.student_ids)]
+
+    def progress_updates(self, i):
+        return [
+            {**row, 'is_planned': True, 'completed_units': (i + n) % (row['total_units'] + 1)}
+            for n, row in enumerate(self.progress_rows.get(self.student(i), []))
+        ]
+
+
+def build_cases(sample):
+    """(ケース名, クエリ数を数える関数名, 呼び出し, 毎回の前処理) のリスト"""
+    return [
+        ('get_student_progress_by_id', 'get_student_progress_by_id',
+         lambda i: get_student_progress_by_id(sample.student(i)), lambda i: PROGRESS_CACHE.invalidate()),
+        ('get_student_progress_by_id[cached]', 'get_student_progress_by_id',
+         lambda i: get_student_progress_by_id(sample.student(0)), None),
+        ('get_students_for_user[admin]', 'get_students_for_user',
+         lambda i: get_students_for_user(sample.admin_user), None),
+        ('get_students_for_user[user]', 'get_students_for_user',
+         lambda i: get_students_for_user(sample.instructor_user), None),
+        ('get_student_level_statistics[school]', 'get_student_level_statistics',
+         lambda i: get_student_level_statistics(sample.school), None),
+        ('get_student_level_statistics[all]', 'get_student_level_statistics',
+         lambda i: get_student_level_statistics(None), None),
+        ('get_all_mock_exam_details_for_school', 'get_all_mock_exam_details_for_school',
+         lambda i: get_all_mock_exam_details_for_school(sample.school), None),
+        ('get_all_homework_for_student', 'get_all_homework_for_student',
+         lambda i: get_all_homework_for_student(sample.student(i)), None),
+        ('add_or_update_student_progress', 'add_or_update_student_progress',
+         lambda i: add_or_update_student_progress(sample.student(i), sample.progress_updates(i)), None),
+    ]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def run_case(call, before, function_name, iterations, warmup):
+    """1ケースを warmup 回空回ししてから iterations 回計測する"""
+    for i in range(warmup):
+        if before:
+            before(i)
+        call(i)
+
+    instrumentation.reset_stats()
+    samples = []
+    for i in range(iterations):
+        if before:
+            before(i)
+        start = time.perf_counter()
+        call(i)
+        samples.append((time.perf_counter() - start) * 1000)
+
+    samples.sort()
+    function_stats = next((s for s in instrumentation.get_function_stats() if s['name'] == function_name), None)
+    return {
+        'iterations': iterations,
+        'p50_ms': percentile(samples, 0.50),
+        'p95_ms': percentile(samples, 0.95),
+        'mean_ms': statistics.fmean(samples),
+        'min_ms': samples[0],
+        'max_ms': samples[-1],
+        # QUERY_INSTRUMENTATION=false の場合は計測できないため None
+        'queries_per_call': function_stats['queries'] / function_stats['calls'] if function_stats else None,
+        'rows_per_call': function_stats['rows'] / function_stats['calls'] if function_stats else None,
+    }
+
+
+def dataset_counts():
+    with db_connection() as conn, conn.cursor() as cur:
+        counts = {}
+        for table in ('students', 'progress', 'homework', 'past_exam_results', 'mock_exam_results', 'university_acceptance'):
+            cur.execute(f"SELECT COUNT(*) FROM {table}")
+            counts[table] = cur.fetchone()[0]
+        return counts
+
+
+def run_benchmarks(args):
+    results = {}
+    for scale in args.scales:
+        label = 'current' if scale is None else f"scale={scale:g}"
+        if scale is not None:
+            print(f"--- 合成データを投入します ({label}) ---")
+            success, message = generate_synthetic_data.generate(generate_synthetic_data.parse_args([
+                '--scale', str(scale), '--seed', str(args.seed), '--school-prefix', args.school_prefix, '--replace'
+            ]))
+            print(message)
+            if not success:
+                raise RuntimeError(message)
+
+        sample = BenchmarkSample(args.school_prefix, args.seed)
+        print(f"--- 計測 ({label}) ---")
+        cases = {}
+        for name, function_name, call, before in build_cases(sample):
+            if args.cases and name.split('[')[0] not in args.cases:
+                continue
+            cases[name] = run_case(call, before, function_name, args.iterations, args.warmup)
+            queries = cases[name]['queries_per_call']
+            print(f"  {name:<42} p50 {cases[name]['p50_ms']:8.2f}ms  p95 {cases[name]['p95_ms']:8.2f}ms  "
+                  f"クエリ/回 {queries if queries is not None else '-'}")
+        results[label] = {'dataset': dataset_counts(), 'cases': cases}
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def match_results(current, baseline):
+    """
+    current の結果ごとに、比較する baseline の結果のラベルを返す。
+    同じラベル (規模) の結果がなければ、データの件数 (dataset) が同じ結果と比べる
+    (--no-generate で計測した 'current' を、同じ合成データで計測した 'scale=…' と比べられるようにする)。
+    """
+    pairs = {}
+    for label, scale_result in current['results'].items():
+        if label in baseline['results']:
+            pairs[label] = label
+            continue
+        for base_label, base_result in baseline['results'].items():
+            if base_result.get('dataset') == scale_result.get('dataset'):
+                pairs[label] = base_label
+                break
+    return pairs
+
+
+def compare_results(current, baseline, threshold, pairs):
+    """baseline と比べた回帰 (p95 の悪化・1回あたりのクエリ数の増加) のメッセージのリストを返す"""
+    regressions = []
+    for label, base_label in pairs.items():
+        scale_result = current['results'][label]
+        base_cases = baseline['results'][base_label]['cases']
+        for name, result in scale_result['cases'].items():
+            base = base_cases.get(name)
+            if base is None:
+                continue
+            change = (result['p95_ms'] - base['p95_ms']) / base['p95_ms'] if base['p95_ms'] else 0.0
+            mark = ''
+            if change > threshold and result['p95_ms'] - base['p95_ms'] >= MIN_REGRESSION_MS:
+                mark = '  <-- 回帰'
+                regressions.append(f"{label} {name}: p95 {base['p95_ms']:.2f}ms -> {result['p95_ms']:.2f}ms ({change:+.0%})")
+            if result['queries_per_call'] is not None and base['queries_per_call'] is not None \
+                    and result['queries_per_call'] > base['queries_per_call']:
+                mark = '  <-- 回帰'
+                regressions.append(
+                    f"{label} {name}: クエリ/回 {base['queries_per_call']:g} -> {result['queries_per_call']:g}"
+                )
+            print(f"  {label:<12} {name:<42} p95 {base['p95_ms']:8.2f} -> {result['p95_ms']:8.2f}ms ({change:+.0%}){mark}")
+    return regressions
+
+
+def parse_scales(value):
+    return [float(s) for s in value.split(',') if s.strip()]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="データ層の主要な関数のベンチマークを実行します。")
+    parser.add_argument('--scales', type=parse_scales, default=[0.05, 0.2],
+                        help="合成データの規模 (カンマ区切り。generate_synthetic_data.py の --scale)")
+    parser.add_argument('--no-generate', action='store_true', help="合成データを投入し直さず、現在のDBで計測する")
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--school-prefix', default='合成校')
+    parser.add_argument('--cases', type=lambda v: [c.strip() for c in v.split(',') if c.strip()],
+                        help="計測する関数名 (カンマ区切り。省略時はすべて)")
+    parser.add_argument('--output', help=f"結果の保存先 (省略時は {RESULTS_DIR}/bench_<日時>.json)")
+    parser.add_argument('--input', help="計測せず、保存済みの結果を --compare と比較する")
+    parser.add_argument('--compare', help="比較する基準の結果 (JSON)")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help="回帰とみなす p95 の悪化率")
+    args = parser.parse_args(argv)
+    if args.no_generate:
+        args.scales = [None]
+    if args.input and not args.compare:
+        parser.error("--input は --compare と一緒に指定してください。")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.input:
+        with open(args.input, encoding='utf-8') as f:
+            current = json.load(f)
+    else:
+        try:
+            results = run_benchmarks(args)
+        except (Exception, psycopg2.Error) as e:
+            print(f"ベンチマークの実行中にエラーが発生しました: {e}")
+            return 1
+        current = {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': git_revision(),
+            'settings': {'iterations': args.iterations, 'warmup': args.warmup, 'seed': args.seed},
+            'results': results,
+        }
+        output = args.output or os.path.join(RESULTS_DIR, f"bench_{datetime.now():%Y%m%d_%H%M%S}.json")
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(current, f, ensure_ascii=False, indent=2)
+        print(f"結果を保存しました: {output}")
+
+    if not args.compare:
+        return 0
+    with open(args.compare, encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"--- 比較: {args.compare} ({baseline.get('git_revision')}) -> {current.get('git_revision')} ---")
+    pairs = match_results(current, baseline)
+    if not pairs:
+        print("同じ規模の結果がないため比較できません (--scales または現在のDBのデータを基準の結果と揃えてください)。")
+        return 1
+    for label, base_label in pairs.items():
+        if label != base_label:
+            print(f"  {label} は件数が同じ {base_label} の結果と比較します。")
+    regressions = compare_results(current, baseline, args.threshold, pairs)
+    if regressions:
+        print(f"{len(regressions)} 件の回帰が見つかりました:")
+        for message in regressions:
+            print(f"  - {message}")
+        return 1
+    print("回帰は見つかりませんでした。")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,6 +3,8 @@ import os
 import psycopg2
 from dotenv import load_dotenv
 
+from data.invalidation import notify, TOPIC_STUDENT
+
 # .envファイルから環境変数を読み込む
 # このスクリプトを実行する場所に .env ファイルが存在し、
 # DATABASE_URL が設定されている必要があります。
@@ -45,6 +47,24 @@ def bulk_update_student_school(old_school_name, new_school_name):
             # 更新された行数を取得
             updated_count = cur.rowcount
 
+            # レベル達成人数の集計も新しい校舎へ移す (同じトランザクション内)
+            if new_school_name != old_school_name:
+                cur.execute(
+                    """
+                    INSERT INTO level_achievement_stats (school, grade, subject, level, student_count)
+                    SELECT %s, grade, subject, level, student_count
+                    FROM level_achievement_stats WHERE school = %s
+                    ON CONFLICT (school, grade, subject, level) DO UPDATE SET
+                        student_count = level_achievement_stats.student_count + EXCLUDED.student_count
+                    """,
+                    (new_school_name, old_school_name)
+                )
+                cur.execute("DELETE FROM level_achievement_stats WHERE school = %s", (old_school_name,))
+
+            # 稼働中のワーカーの生徒情報のキャッシュ (校舎・名前の索引を含む) を破棄させる
+            if updated_count > 0:
+                notify(conn, TOPIC_STUDENT)
+
         conn.commit()
         if updated_count > 0:
             return True, f"{updated_count}人の生徒の校舎を「{old_school_name}」から「{new_school_name}」に変更しました。"
@@ -20,57 +20,42 @@ from data.nested_json_processor import (
     get_all_instructors_for_school,
     get_all_presets_with_books, add_preset, update_preset, delete_preset,
     add_changelog_entry,
-    get_all_mock_exam_details_for_school, get_mock_exam_filter_options,
+    get_mock_exam_details_page, get_mock_exam_filter_options, MOCK_EXAM_LIST_SCORE_COLUMNS,
     get_student_count_by_school, get_textbook_count_by_subject,
-    get_all_root_tables, add_root_table, update_root_table, delete_root_table, get_root_table_by_id
+    get_all_root_tables, add_root_table, update_root_table, delete_root_table, get_root_table_metadata
 )
+from utils.pagination import first_page_state, turn_page, page_controls
 # configからDATABASE_URLを読み込むように変更
 from config.settings import APP_CONFIG
 
 DATABASE_URL = APP_CONFIG['data']['database_url']
 
+# 校舎の模試結果一覧の1ページの行数と、タブ (ID の接尾辞) ごとの形式
+MOCK_EXAM_LIST_PAGE_SIZE = 100
+MOCK_EXAM_LIST_FORMATS = {'mark': 'マーク', 'descriptive': '記述'}
+
 # BASE_DIR, RENDER_DATA_DIR, DATABASE_FILE の定義は不要なので削除
 
 
 # ★★★ 新しいヘルパー関数: 管理者モーダル用の模試結果テーブル生成 ★★★
-def _create_admin_mock_exam_table(df, table_type):
-    """管理者モーダル用の模試結果テーブル(マークまたは記述)を生成する"""
-    if df.empty:
-        type_jp = "マーク" if table_type == "mark" else "記述"
-        return dbc.Alert(f"フィルター条件に一致する{type_jp}模試の結果はありません。", color="warning", className="mt-3")
+def _create_admin_mock_exam_table(rows, exam_format):
+    """管理者モーダル用の模試結果テーブル(マークまたは記述)を、get_mock_exam_details_page の1ページ分の行から生成する"""
+    if not rows:
+        return dbc.Alert(f"フィルター条件に一致する{exam_format}模試の結果はありません。", color="warning", className="mt-3")
 
-    # 表示するカラムを選択
     base_cols = ['student_name', 'result_type', 'mock_exam_name', 'grade', 'round', 'exam_date']
-    base_headers_jp = ["生徒名", "種類", "模試名", "学年", "回", "受験日"]
     # ★ 点数カラムのスタイル (固定幅)
     score_col_style = {'width': '60px', 'minWidth': '60px', 'textAlign': 'center', 'fontSize': '0.85rem'}
     # ★ 基本情報カラムのスタイル (最小幅)
-    base_col_style = {'minWidth': '100px', 'verticalAlign': 'middle'}
     base_col_style_narrow = {'minWidth': '80px', 'verticalAlign': 'middle'} # 種類、学年、回など
 
-    if table_type == "mark":
-        score_cols = [
-            'subject_kokugo_mark', 'subject_math1a_mark', 'subject_math2bc_mark',
-            'subject_english_r_mark', 'subject_english_l_mark', 'subject_rika1_mark', 'subject_rika2_mark',
-            'subject_shakai1_mark', 'subject_shakai2_mark', 'subject_rika_kiso1_mark',
-            'subject_rika_kiso2_mark', 'subject_info_mark'
-        ]
+    # 点数の列は MOCK_EXAM_LIST_SCORE_COLUMNS と同じ順
+    score_cols = MOCK_EXAM_LIST_SCORE_COLUMNS[exam_format]
+    if exam_format == 'マーク':
         col_headers_jp = ["国", "数IA", "数IIBC", "英R", "英L", "理①", "理②", "社①", "社②", "理基①", "理基②", "情報"]
-    else: # descriptive
-        score_cols = [
-            'subject_kokugo_desc', 'subject_math_desc', 'subject_english_desc',
-            'subject_rika1_desc', 'subject_rika2_desc', 'subject_shakai1_desc', 'subject_shakai2_desc'
-        ]
+    else: # 記述
         col_headers_jp = ["国", "数", "英", "理①", "理②", "社①", "社②"]
 
-    # DataFrameに必要なカラムが存在するか確認し、なければNaNで埋める
-    # (get_all_mock_exam_details_for_school で全カラム取得する前提なら不要だが念のため)
-    for col in base_cols + score_cols:
-        if col not in df.columns:
-            df[col] = pd.NA
-
-    df_display = df[base_cols + score_cols].copy()
-
     # ヘッダー生成 (スタイルを適用)
     header_cells = [
         html.Th("生徒名", style={'minWidth': '120px', 'verticalAlign': 'middle'}),
@@ -82,29 +67,14 @@ def _create_admin_mock_exam_table(df, table_type):
     ] + [html.Th(jp, style=score_col_style) for jp in col_headers_jp]
     table_header = [html.Thead(html.Tr(header_cells))]
 
-    # ボディ生成
-    table_body_rows = []
-    for _, row in df_display.iterrows():
-        cells = []
-        # 基本情報セル
-        for col in base_cols:
-            value = row[col]
-            if col == 'exam_date':
-                # exam_date は callback 側でフォーマット済みの想定だが、ここでも処理
-                display_val = value if pd.notna(value) else '-'
-                if isinstance(value, date): # dateオブジェクトの場合
-                    display_val = value.strftime('%Y-%m-%d')
-            else:
-                display_val = '-' if pd.isna(value) else value
-            cells.append(html.Td(display_val))
-
-        # 点数セル
-        for col in score_cols:
-            score = row[col]
-            display_score = '-' if pd.isna(score) else int(score)
-            cells.append(html.Td(display_score, style=score_col_style))
-
-        table_body_rows.append(html.Tr(cells))
+    # ボディ生成 (受験日は SQL で文字列に整形済み)
+    table_body_rows = [
+        html.Tr(
+            [html.Td('-' if row[col] is None else row[col]) for col in base_cols]
+            + [html.Td('-' if row[col] is None else row[col], style=score_col_style) for col in score_cols]
+        )
+        for row in rows
+    ]
 
     table_body = [html.Tbody(table_body_rows)]
     return dbc.Table(table_header + table_body, striped=True, bordered=True, hover=True, responsive=True, size="sm")
@@ -223,9 +193,8 @@ def register_admin_callbacks(app):
 
         if isinstance(ctx.triggered_id, dict) and ctx.triggered_id.get('type') == 'edit-rt-btn':
             rt_id = ctx.triggered_id['index']
-            rt_data = get_root_table_by_id(rt_id) # ファイル名等のメタデータ取得
+            rt_data = get_root_table_metadata(rt_id) # ファイル本体は読まずにメタデータのみ取得
             if rt_data:
-                # 注: get_root_table_by_idはファイル本体も取得するため、別途メタデータのみの取得関数があると効率的です
                 return True, "ルート表を編集", rt_id, subject_options, rt_data.get('subject'), rt_data.get('level'), rt_data.get('academic_year'), rt_data.get('filename')
 
         return [no_update] * 8
@@ -743,9 +712,7 @@ def register_admin_callbacks(app):
             presets = get_all_presets_with_books()
             preset_to_edit = next((p for p in presets if p['id'] == preset_id), None)
             if preset_to_edit:
-                all_textbooks = get_all_master_textbooks()
-                book_name_to_id = {b['book_name']: b['id'] for b in all_textbooks}
-                selected_book_ids = [book_name_to_id[name] for name in preset_to_edit.get('books', []) if name in book_name_to_id]
+                selected_book_ids = preset_to_edit.get('book_ids', [])
 
                 return (True, f"編集: {preset_to_edit['preset_name']}", preset_id,
                         subject_options, preset_to_edit['subject'], preset_to_edit['preset_name'],
@@ -1122,83 +1089,89 @@ def register_admin_callbacks(app):
         options = get_mock_exam_filter_options(school_name)
         return options.get('names', []), options.get('grades', [])
 
-    # ★★★ 模試結果一覧テーブルコールバックを修正 ★★★
+    # ★★★ 模試結果一覧テーブル: 絞り込み・ページ送りは SQL で行い、形式ごとに1ページ分だけ描画する ★★★
     @app.callback(
         [Output('mock-exam-list-table-container-mark', 'children'),
-         Output('mock-exam-list-table-container-descriptive', 'children')],
+         Output('mock-exam-list-table-container-descriptive', 'children'),
+         Output('mock-exam-list-page-store', 'data'),
+         Output('mock-exam-list-prev-btn-mark', 'disabled'),
+         Output('mock-exam-list-next-btn-mark', 'disabled'),
+         Output('mock-exam-list-page-info-mark', 'children'),
+         Output('mock-exam-list-prev-btn-descriptive', 'disabled'),
+         Output('mock-exam-list-next-btn-descriptive', 'disabled'),
+         Output('mock-exam-list-page-info-descriptive', 'children')],
         [Input('mock-exam-list-modal', 'is_open'), # モーダルが開いた時もトリガー
          Input('mock-exam-list-filter-type', 'value'),
          Input('mock-exam-list-filter-name', 'value'),
          Input('mock-exam-list-filter-format', 'value'),
-         Input('mock-exam-list-filter-grade', 'value')],
-        State('auth-store', 'data'),
+         Input('mock-exam-list-filter-grade', 'value'),
+         Input('mock-exam-list-prev-btn-mark', 'n_clicks'),
+         Input('mock-exam-list-next-btn-mark', 'n_clicks'),
+         Input('mock-exam-list-prev-btn-descriptive', 'n_clicks'),
+         Input('mock-exam-list-next-btn-descriptive', 'n_clicks')],
+        [State('auth-store', 'data'),
+         State('mock-exam-list-page-store', 'data')],
         prevent_initial_call=True
     )
     def update_mock_exam_list_table(
         is_open, filter_type, filter_name, filter_format, filter_grade,
-        user_info):
-        """フィルターの値に基づいて模試結果一覧テーブルを更新する"""
+        prev_mark, next_mark, prev_desc, next_desc,
+        user_info, page_store):
+        """フィルターの値とページ送りに基づいて模試結果一覧テーブルを更新する"""
 
-        ctx = callback_context
-        triggered_id = ctx.triggered_id
+        triggered_id = callback_context.triggered_id
 
         # モーダルが閉じている場合は更新しない
         if not is_open:
-            return no_update, no_update
+            return (no_update,) * 9
 
-        if not user_info:
-            alert = dbc.Alert("ユーザー情報が見つかりません。", color="danger")
-            return alert, alert
-
-        school_name = user_info.get('school')
+        school_name = user_info.get('school') if user_info else None
         if not school_name:
-            alert = dbc.Alert("所属校舎が設定されていません。", color="danger")
-            return alert, alert
-
-        # データを取得
-        results = get_all_mock_exam_details_for_school(school_name)
-        if not results:
-            no_data_alert = dbc.Alert("この校舎には登録されている模試結果がありません。", color="info")
-            return no_data_alert, no_data_alert
-
-        df = pd.DataFrame(results)
+            message = "ユーザー情報が見つかりません。" if not user_info else "所属校舎が設定されていません。"
+            alert = dbc.Alert(message, color="danger")
+            return alert, alert, {}, True, True, "", True, True, ""
+
+        # ページ送りのボタンなら、その形式のテーブルのみ更新する
+        page_kind = next((kind for kind in MOCK_EXAM_LIST_FORMATS
+                          if triggered_id in (f'mock-exam-list-prev-btn-{kind}', f'mock-exam-list-next-btn-{kind}')), None)
+        if page_kind and not callback_context.triggered[0]['value']:
+            raise PreventUpdate
 
-        # 日付のフォーマット (pd.to_datetime と .dt.strftime を使う)
-        df['exam_date'] = pd.to_datetime(df['exam_date'], errors='coerce').dt.strftime('%Y-%m-%d').fillna('-')
+        page_store = dict(page_store or {})
+        # 出力: {形式: (テーブル, 前へ無効, 次へ無効, 件数表示)}
+        outputs = {kind: (no_update,) * 4 for kind in MOCK_EXAM_LIST_FORMATS}
+        row_counts = {}
+        for kind, exam_format in MOCK_EXAM_LIST_FORMATS.items():
+            if page_kind and kind != page_kind:
+                continue
+            # 形式フィルターが適用されている場合、もう片方のタブは空にする
+            if filter_format and filter_format != exam_format:
+                page_store[kind] = first_page_state()
+                outputs[kind] = (None, True, True, "")
+                continue
+
+            direction = {f'mock-exam-list-next-btn-{kind}': 'next', f'mock-exam-list-prev-btn-{kind}': 'prev'}.get(triggered_id)
+            cursors = turn_page(page_store.get(kind), direction)
+
+            rows, next_cursor = get_mock_exam_details_page(
+                school_name, exam_format, filter_type, filter_name, filter_grade,
+                after=cursors[-1], page_size=MOCK_EXAM_LIST_PAGE_SIZE
+            )
+            page_store[kind], prev_disabled, next_disabled, page_info = page_controls(
+                cursors, len(rows), next_cursor, MOCK_EXAM_LIST_PAGE_SIZE
+            )
+            row_counts[kind] = len(rows)
+            outputs[kind] = (_create_admin_mock_exam_table(rows, exam_format), prev_disabled, next_disabled, page_info)
 
+        # 絞り込みなしで両方とも空なら、校舎に模試結果が無い
+        if not page_kind and not (filter_type or filter_name or filter_format or filter_grade) \
+                and not any(row_counts.values()):
+            no_data_alert = dbc.Alert("この校舎には登録されている模試結果がありません。", color="info")
+            outputs = {kind: (no_data_alert, True, True, "") for kind in MOCK_EXAM_LIST_FORMATS}
 
-        # フィルタリング (形式フィルターを除く)
-        if filter_type:
-            df = df[df['result_type'] == filter_type]
-        if filter_name:
-            df = df[df['mock_exam_name'] == filter_name]
-        if filter_grade:
-            df = df[df['grade'] == filter_grade]
+        mark, desc = outputs['mark'], outputs['descriptive']
+        return mark[0], desc[0], page_store, mark[1], mark[2], mark[3], desc[1], desc[2], desc[3]
 
-        if df.empty:
-            no_match_alert = dbc.Alert("フィルター条件に一致する結果はありません。", color="warning")
-            return no_match_alert, no_match_alert
-
-        # フィルター後のデータでマークと記述に分割
-        df_mark = df[df['mock_exam_format'] == 'マーク'].copy()
-        df_desc = df[df['mock_exam_format'] == '記述'].copy()
-
-        # ヘルパー関数を使ってテーブルを生成
-        mark_table = _create_admin_mock_exam_table(df_mark, "mark")
-        desc_table = _create_admin_mock_exam_table(df_desc, "descriptive")
-
-        # 形式フィルターが適用されている場合、片方のタブを空にする
-        if filter_format == 'マーク':
-            desc_table = None # 記述タブは非表示 (空にする)
-            if df_mark.empty: # 絞り込んだ結果マークが無い場合
-                 mark_table = dbc.Alert("フィルター条件に一致するマーク模試の結果はありません。", color="warning", className="mt-3")
-        elif filter_format == '記述':
-            mark_table = None # マークタブは非表示 (空にする)
-            if df_desc.empty: # 絞り込んだ結果記述が無い場合
-                 desc_table = dbc.Alert("フィルター条件に一致する記述模試の結果はありません。", color="warning", className="mt-3")
-
-        return mark_table, desc_table
-    
     @app.callback(
         # allow_duplicate=True を追加し、prevent_initial_call=True を設定する
         Output('rt-edit-filename-display', 'children', allow_duplicate=True), 
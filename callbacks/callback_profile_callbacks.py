@@ -0,0 +1,87 @@
+# callbacks/callback_profile_callbacks.py
+
+from dash import Input, Output, State, html, ctx
+import dash_bootstrap_components as dbc
+from dash.exceptions import PreventUpdate
+
+from data.instrumentation import get_function_stats, reset_stats
+from utils.callback_profiler import get_callback_stats, reset_callback_stats
+
+# 表示する上位の件数
+TOP_N = 30
+
+
+def _callback_table(rows):
+    if not rows:
+        return html.Div("まだ計測結果がありません。", className="text-muted p-3")
+    header = html.Thead(html.Tr([
+        html.Th("出力"), html.Th("回数"), html.Th("エラー"), html.Th("合計 (ms)"), html.Th("平均"),
+        html.Th("p50"), html.Th("p95"), html.Th("p99"), html.Th("最大"), html.Th("平均サイズ (KB)"), html.Th("最大サイズ (KB)")
+    ]))
+    body = html.Tbody([
+        html.Tr([
+            html.Td(html.Code(r['output_id']), style={'wordBreak': 'break-all'}),
+            html.Td(r['calls']),
+            html.Td(r['errors']),
+            html.Td(f"{r['total_ms']:.0f}"),
+            html.Td(f"{r['avg_ms']:.1f}"),
+            html.Td(f"{r['p50_ms']:.1f}"),
+            html.Td(f"{r['p95_ms']:.1f}"),
+            html.Td(f"{r['p99_ms']:.1f}"),
+            html.Td(f"{r['max_ms']:.1f}"),
+            html.Td(f"{r['avg_bytes'] / 1024:.1f}"),
+            html.Td(f"{r['max_bytes'] / 1024:.1f}"),
+        ]) for r in rows
+    ])
+    return dbc.Table([header, body], hover=True, striped=True, size="sm", className="bg-white shadow-sm")
+
+
+def _function_table(rows):
+    if not rows:
+        return html.Div("まだ計測結果がありません。", className="text-muted p-3")
+    header = html.Thead(html.Tr([
+        html.Th("関数"), html.Th("回数"), html.Th("エラー"), html.Th("合計 (ms)"), html.Th("p95 (推定)"),
+        html.Th("クエリ数"), html.Th("DB時間 (ms)"), html.Th("行数"), html.Th("接続待ち (ms)")
+    ]))
+    body = html.Tbody([
+        html.Tr([
+            html.Td(html.Code(r['name'])),
+            html.Td(r['calls']),
+            html.Td(r['errors']),
+            html.Td(f"{r['total_ms']:.0f}"),
+            html.Td(f"{r['p95_ms']:.1f}"),
+            html.Td(r['queries']),
+            html.Td(f"{r['db_ms']:.0f}"),
+            html.Td(r['rows']),
+            html.Td(f"{r['acquire_ms']:.1f}"),
+        ]) for r in rows
+    ])
+    return dbc.Table([header, body], hover=True, striped=True, size="sm", className="bg-white shadow-sm")
+
+
+def register_callback_profile_callbacks(app):
+    """管理者用のコールバック計測ページのコールバックを登録する"""
+
+    @app.callback(
+        Output('callback-profile-container', 'children'),
+        [Input('callback-profile-sort', 'value'),
+         Input('callback-profile-refresh-btn', 'n_clicks'),
+         Input('callback-profile-reset-btn', 'n_clicks')],
+        State('auth-store', 'data')
+    )
+    def update_callback_profile(order_by, refresh_clicks, reset_clicks, user_info):
+        if not user_info or user_info.get('role') != 'admin':
+            raise PreventUpdate
+
+        if ctx.triggered_id == 'callback-profile-reset-btn':
+            reset_callback_stats()
+            reset_stats()
+
+        function_order = order_by if order_by in ('total_ms', 'p95_ms', 'max_ms', 'calls') else 'total_ms'
+        functions = sorted(get_function_stats(), key=lambda s: s[function_order], reverse=True)[:TOP_N]
+        return html.Div([
+            html.H5("コールバック (出力ごと)", className="mt-2"),
+            _callback_table(get_callback_stats(order_by=order_by, limit=TOP_N)),
+            html.H5("データ層の関数", className="mt-4"),
+            _function_table(functions),
+        ])
@@ -37,11 +37,9 @@ def register_homework_callbacks(app):
             group = group.sort_values('task_date')
             preview_items = []
             for _, row in group.head(3).iterrows():
-                try:
-                    dt = pd.to_datetime(row['task_date']).strftime('%m/%d')
-                    preview_items.append(html.Span(f"{dt}: {row['task'] or ''}", className="d-block small text-muted"))
-                except (ValueError, TypeError):
-                     preview_items.append(html.Span(f"日付不明: {row['task'] or ''}", className="d-block small text-muted"))
+                # task_date は DATE 型のため date オブジェクトで返る
+                dt = row['task_date'].strftime('%m/%d') if isinstance(row['task_date'], date) else "日付不明"
+                preview_items.append(html.Span(f"{dt}: {row['task'] or ''}", className="d-block small text-muted"))
             card_content = [
                 html.H5(textbook_name or "名称未設定", className="card-title"),
                 html.H6(subject or "科目未設定", className="card-subtitle text-muted mb-2 small"),
@@ -112,9 +110,9 @@ def register_homework_callbacks(app):
         output_values = [''] * 7; today = date.today()
         hw_dict = {hw['task_date']: hw['task'] for hw in homework_list}
         for i in range(7):
-            current_date_str = (today + timedelta(days=i)).strftime('%Y-%m-%d')
-            if current_date_str in hw_dict:
-                output_values[i] = hw_dict[current_date_str]
+            current_date = today + timedelta(days=i)
+            if current_date in hw_dict:
+                output_values[i] = hw_dict[current_date]
         other_info = json.loads(homework_list[0]['other_info']) if homework_list and homework_list[0]['other_info'] else {}
         all_textbooks = get_all_master_textbooks()
         selected_book = next((b for b in all_textbooks if b['id'] == textbook_id), None)
@@ -4,6 +4,7 @@ import pandas as pd
 from dash import Input, Output, State, dcc, html, no_update # ★ dcc をインポート
 from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
+from data.db_pool import use_read_only_request_transaction
 from data.nested_json_processor import get_subjects_for_student, get_student_info_by_id, get_students_for_user
 from utils.permissions import can_access_student
 from callbacks.progress_callbacks import create_welcome_layout, generate_dashboard_content
@@ -54,6 +55,8 @@ def register_main_callbacks(app):
             # 生徒が選択されていない場合は、ウェルカム画面を表示
             return None, None, create_welcome_layout()
 
+        # 生徒情報と科目を同じ時点のデータから読む
+        use_read_only_request_transaction()
         student_info = get_student_info_by_id(student_id)
         subjects = get_subjects_for_student(student_id)
 
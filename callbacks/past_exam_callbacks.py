@@ -14,6 +14,7 @@ import json
 # --- 必要な関数をインポート ---
 from data.nested_json_processor import (
     get_past_exam_results_for_student, add_past_exam_result,
+    get_past_exam_results_page, get_past_exam_filter_options,
     update_past_exam_result, delete_past_exam_result,
     add_acceptance_result,
     get_acceptance_results_for_student,
@@ -26,6 +27,10 @@ from data.nested_json_processor import (
     delete_mock_exam_result
 )
 from charts.calendar_generator import create_html_calendar, create_single_month_table
+from utils.pagination import first_page_state, turn_page, page_controls
+
+# 過去問結果の一覧の1ページの行数
+PAST_EXAM_PAGE_SIZE = 50
 
 # --- find_nearest_future_month 関数 (変更なし) ---
 def find_nearest_future_month(acceptance_data):
@@ -48,39 +53,19 @@ def find_nearest_future_month(acceptance_data):
     else:
         return today.strftime('%Y-%m') # Or handle error appropriately
 
-    df = pd.DataFrame(acceptance_list)
-
-    # Convert date columns safely
-    date_cols_map = {
-        'application_deadline': 'app_deadline_dt',
-        'exam_date': 'exam_dt',
-        'announcement_date': 'announcement_dt',
-        'procedure_deadline': 'proc_deadline_dt'
-    }
-    for col, dt_col in date_cols_map.items():
-        if col in df.columns:
-            # Convert potential date objects to strings first if necessary
-            df[col] = df[col].apply(lambda x: x.isoformat() if isinstance(x, date) else x)
-            df[dt_col] = pd.to_datetime(df[col], errors='coerce').dt.date
-        else:
-            df[dt_col] = pd.NaT # Ensure the column exists even if empty
+    # 各期日は get_acceptance_results_for_student から date オブジェクト (未設定は None) で渡される
+    def future_dates(*cols):
+        return [r.get(col) for r in acceptance_list for col in cols
+                if isinstance(r.get(col), date) and r.get(col) >= today]
 
     # --- Find nearest future application deadline ---
-    # Ensure 'app_deadline_dt' exists before filtering
-    if 'app_deadline_dt' in df.columns:
-        future_app_deadlines_series = df.loc[df['app_deadline_dt'].notna() & (df['app_deadline_dt'] >= today), 'app_deadline_dt']
-        future_app_deadlines = future_app_deadlines_series.tolist()
-        if future_app_deadlines:
-            nearest_date = min(future_app_deadlines)
-            return nearest_date.strftime('%Y-%m')
+    future_app_deadlines = future_dates('application_deadline')
+    if future_app_deadlines:
+        nearest_date = min(future_app_deadlines)
+        return nearest_date.strftime('%Y-%m')
 
     # --- Find nearest future other dates ---
-    future_other_dates = []
-    for dt_col in ['exam_dt', 'announcement_dt', 'proc_deadline_dt']:
-        if dt_col in df.columns:
-             future_dates_series = df.loc[df[dt_col].notna() & (df[dt_col] >= today), dt_col]
-             future_other_dates.extend(future_dates_series.tolist())
-
+    future_other_dates = future_dates('exam_date', 'announcement_date', 'procedure_deadline')
     if future_other_dates:
         nearest_date = min(future_other_dates)
         return nearest_date.strftime('%Y-%m')
@@ -324,19 +309,27 @@ def register_past_exam_callbacks(app):
         # 成功したらモーダルを閉じ、IDストアをクリア
         return toast_data, not success, None if success else no_update
 
-    # (update_past_exam_table - 変更なし、前回の修正を維持)
+    # 絞り込み・並べ替え・ページ送りは SQL で行い、表示するページの行だけを描画する
     @app.callback(
         [Output('past-exam-table-container', 'children'),
          Output('past-exam-university-filter', 'options'),
-         Output('past-exam-subject-filter', 'options')],
+         Output('past-exam-subject-filter', 'options'),
+         Output('past-exam-page-store', 'data'),
+         Output('past-exam-prev-page-btn', 'disabled'),
+         Output('past-exam-next-page-btn', 'disabled'),
+         Output('past-exam-page-info', 'children')],
         [Input('student-selection-store', 'data'),
          Input('toast-trigger', 'data'),
          Input('past-exam-university-filter', 'value'),
          Input('past-exam-subject-filter', 'value'),
          Input('refresh-past-exam-table-btn', 'n_clicks'),
-         Input('past-exam-tabs', 'active_tab')], # ★ Input として active_tab
+         Input('past-exam-tabs', 'active_tab'), # ★ Input として active_tab
+         Input('past-exam-prev-page-btn', 'n_clicks'),
+         Input('past-exam-next-page-btn', 'n_clicks')],
+        State('past-exam-page-store', 'data'),
     )
-    def update_past_exam_table(student_id, toast_data, selected_university, selected_subject, refresh_clicks, active_tab):
+    def update_past_exam_table(student_id, toast_data, selected_university, selected_subject, refresh_clicks, active_tab,
+                               prev_clicks, next_clicks, page_store):
         ctx = callback_context
         triggered_id = ctx.triggered_id if ctx.triggered_id else 'initial load'
 
@@ -350,75 +343,53 @@ def register_past_exam_callbacks(app):
                 raise PreventUpdate
         elif triggered_id == 'refresh-past-exam-table-btn' and refresh_clicks is None:
              raise PreventUpdate
+        elif triggered_id in ('past-exam-prev-page-btn', 'past-exam-next-page-btn') and not ctx.triggered[0]['value']:
+            raise PreventUpdate
         # ★ 生徒選択時 またはタブ切り替え時は実行
 
-        # --- ここから戻り値を確実に返すための構造 ---
-        table_content = None
-        university_options = []
-        subject_options = []
-
         if not student_id:
             table_content = dbc.Alert("まず生徒を選択してください。", color="info", className="mt-4")
-            return table_content, university_options, subject_options
-
-        try:
-            results = get_past_exam_results_for_student(student_id)
-            # 日付オブジェクトを 'YYYY-MM-DD' 文字列に変換（DataFrame作成前に）
-            for r in results:
-                r['date'] = r['date'].isoformat() if isinstance(r['date'], date) else None
-
-            df = pd.DataFrame(results) if results else pd.DataFrame()
-
-            if df.empty:
-                table_content = dbc.Alert("この生徒の過去問結果はまだありません。", color="info", className="mt-4")
+            return table_content, [], [], first_page_state(), True, True, ""
+
+        # ページ送り以外 (生徒・絞り込みの変更など) では先頭のページに戻る
+        direction = {'past-exam-next-page-btn': 'next', 'past-exam-prev-page-btn': 'prev'}.get(triggered_id)
+        cursors = turn_page(page_store, direction)
+
+        # 絞り込みの候補は絞り込み・ページ送りでは変わらないため、それ以外の場合のみ取得する
+        university_options, subject_options = no_update, no_update
+        if triggered_id not in ('past-exam-university-filter', 'past-exam-subject-filter',
+                                'past-exam-prev-page-btn', 'past-exam-next-page-btn'):
+            universities, subjects = get_past_exam_filter_options(student_id)
+            university_options = [{'label': u, 'value': u} for u in universities]
+            subject_options = [{'label': s, 'value': s} for s in subjects]
+
+        rows, next_cursor = get_past_exam_results_page(
+            student_id, selected_university, selected_subject, after=cursors[-1], page_size=PAST_EXAM_PAGE_SIZE
+        )
+        page_store, prev_disabled, next_disabled, page_info = page_controls(
+            cursors, len(rows), next_cursor, PAST_EXAM_PAGE_SIZE
+        )
+
+        if not rows:
+            if selected_university or selected_subject:
+                table_content = dbc.Alert("フィルターに一致する過去問結果はありません。", color="warning", className="mt-4")
             else:
-                # オプション生成
-                university_options = [{'label': u, 'value': u} for u in sorted(df['university_name'].dropna().unique())]
-                subject_options = [{'label': s, 'value': s} for s in sorted(df['subject'].dropna().unique())]
-
-                # フィルター処理
-                df_filtered = df.copy()
-                if selected_university:
-                    df_filtered = df_filtered[df_filtered['university_name'] == selected_university]
-                if selected_subject:
-                    df_filtered = df_filtered[df_filtered['subject'] == selected_subject]
-
-                if df_filtered.empty:
-                    table_content = dbc.Alert("フィルターに一致する過去問結果はありません。", color="warning", className="mt-4")
-                else:
-                    # テーブル生成ロジック (変更なし)
-                    def calculate_percentage(row):
-                        correct, total = row['correct_answers'], row['total_questions']
-                        return f"{(correct / total * 100):.1f}%" if pd.notna(correct) and pd.notna(total) and total > 0 else ""
-                    df_filtered['正答率'] = df_filtered.apply(calculate_percentage, axis=1)
-                    def format_time(row):
-                        req, total = row['time_required'], row['total_time_allowed']
-                        # NaNでないことを確認してから整数変換
-                        req_int = int(req) if pd.notna(req) else None
-                        total_int = int(total) if pd.notna(total) else None
-                        if req_int is not None and total_int is not None: return f"{req_int}/{total_int}"
-                        return f"{req_int}" if req_int is not None else ""
-                    df_filtered['所要時間(分)'] = df_filtered.apply(format_time, axis=1)
-
-                    # 表示用に NaN を空文字列に置換
-                    df_display = df_filtered.fillna('')
-
-                    table_header = [html.Thead(html.Tr([html.Th("日付"), html.Th("大学名"), html.Th("学部名"), html.Th("入試方式"), html.Th("年度"), html.Th("科目"),
-                                                        html.Th("所要時間(分)"), html.Th("正答率"), html.Th("操作", style={'width': '100px'})]))] # 幅調整
-                    table_body = [html.Tbody([html.Tr([html.Td(row['date']), html.Td(row['university_name']), html.Td(row['faculty_name']),
-                                                        html.Td(row['exam_system']), html.Td(row['year']), html.Td(row['subject']),
-                                                        html.Td(row['所要時間(分)']), html.Td(row['正答率']),
-                                                        html.Td([dbc.Button("編集", id={'type': 'edit-past-exam-btn', 'index': row['id']}, size="sm", className="me-1"),
-                                                                 # テーブル内の削除ボタンはダイアログを開くだけにする
-                                                                 dbc.Button("削除", id={'type': 'delete-past-exam-trigger-btn', 'index': row['id']}, color="danger", size="sm", outline=True)])
-                                                      ]) for _, row in df_display.iterrows()])] # df_display を使用
-                    table_content = dbc.Table(table_header + table_body, striped=True, bordered=True, hover=True, responsive=True, size="sm") # size="sm" 追加
-
-        except Exception as e:
-            print(f"Error in update_past_exam_table: {e}")
-            table_content = dbc.Alert(f"テーブル表示中にエラーが発生しました: {e}", color="danger")
-
-        return table_content, university_options, subject_options
+                table_content = dbc.Alert("この生徒の過去問結果はまだありません。", color="info", className="mt-4")
+            return table_content, university_options, subject_options, page_store, True, True, page_info
+
+        table_header = [html.Thead(html.Tr([html.Th("日付"), html.Th("大学名"), html.Th("学部名"), html.Th("入試方式"), html.Th("年度"), html.Th("科目"),
+                                            html.Th("所要時間(分)"), html.Th("正答率"), html.Th("操作", style={'width': '100px'})]))] # 幅調整
+        table_body = [html.Tbody([html.Tr([html.Td(row['date_display']), html.Td(row['university_name']), html.Td(row['faculty_name']),
+                                            html.Td(row['exam_system']), html.Td(row['year']), html.Td(row['subject']),
+                                            html.Td(row['time_display']), html.Td(row['accuracy_display']),
+                                            html.Td([dbc.Button("編集", id={'type': 'edit-past-exam-btn', 'index': row['id']}, size="sm", className="me-1"),
+                                                     # テーブル内の削除ボタンはダイアログを開くだけにする
+                                                     dbc.Button("削除", id={'type': 'delete-past-exam-trigger-btn', 'index': row['id']}, color="danger", size="sm", outline=True)])
+                                          ]) for row in rows])]
+        table_content = dbc.Table(table_header + table_body, striped=True, bordered=True, hover=True, responsive=True, size="sm") # size="sm" 追加
+
+        return (table_content, university_options, subject_options, page_store,
+                prev_disabled, next_disabled, page_info)
 
     # ★★★ 修正箇所 (display_delete_past_exam_confirm_from_table) ★★★
     @app.callback(
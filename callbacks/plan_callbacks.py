@@ -144,7 +144,8 @@ def register_plan_callbacks(app):
                         if details.get('予定'):
                             subject_progress[book] = {
                                 'completed': details.get('completed_units', 0),
-                                'total': details.get('total_units', 1)
+                                'total': details.get('total_units', 1),
+                                'level': level # 保存時にマスターを引き直さずに済むよう保持
                             }
             return create_buttons(active_subject=subject), subject_progress, subject
 
@@ -265,6 +266,8 @@ def register_plan_callbacks(app):
         for book in selected_books:
             if book in (custom_books or {}):
                 level = custom_books[book]['level']
+            elif (current_progress or {}).get(book, {}).get('level'):
+                level = current_progress[book]['level']
             else:
                 level = next((lvl for lvl, b_list in master_books.items() if book in b_list), "N/A")
             all_books_with_levels.append({'name': book, 'level': level})
@@ -352,7 +355,7 @@ def register_plan_callbacks(app):
             books_to_unplan = [book for book in (current_progress or {}).keys() if book not in all_selected_books]
 
         for book in books_to_unplan:
-            level = next((lvl for lvl, b_list in get_master_textbook_list(subject).items() if book in b_list), "N/A")
+            level = current_progress[book].get('level', "N/A")
             updates.append({'subject': subject, 'level': level, 'book_name': book, 'is_planned': False, 'completed_units': 0, 'total_units': 1, 'duration': None})
 
         if trigger_id != 'plan-empty-confirm-dialog':
@@ -6,12 +6,10 @@ import pandas as pd
 from dash.exceptions import PreventUpdate
 from datetime import datetime
 
+from data.db_pool import use_read_only_request_transaction
 from data.nested_json_processor import (
-    get_student_progress_by_id, 
-    get_student_info_by_id, 
-    get_total_past_exam_time, 
+    get_student_dashboard_snapshot,
     add_or_update_student_progress, 
-    get_eiken_results_for_student, 
     add_or_update_eiken_result
 )
 from charts.chart_generator import create_progress_stacked_bar_chart, create_subject_achievement_bar
@@ -87,9 +85,8 @@ def create_welcome_layout():
         className="mt-5",
     )
 
-def create_initial_progress_layout(student_id):
+def create_initial_progress_layout(student_info):
     """進捗データが全くない生徒向けの初期レイアウトを生成する"""
-    student_info = get_student_info_by_id(student_id)
     student_name = student_info.get('name', '選択された生徒')
     return dbc.Row(
         dbc.Col(
@@ -113,10 +110,8 @@ def create_initial_progress_layout(student_id):
         className="mt-5"
     )
 
-def create_eiken_display_card(student_id):
+def create_eiken_display_card(eiken_results):
     """英検の現在のスコアを表示し、更新用モーダルを提供するカード"""
-    eiken_results = get_eiken_results_for_student(student_id)
-    
     # 最新の記録を取得 (eiken_resultsはリスト形式)
     latest_result = eiken_results[-1] if eiken_results else None
     
@@ -186,9 +181,12 @@ def generate_dashboard_content(student_id, active_tab, for_print=False):
     if not student_id or not active_tab:
         return None
 
-    progress_data = get_student_progress_by_id(student_id)
+    # 生徒情報・進捗・過去問時間・英検結果を1回の問い合わせでまとめて取得する
+    snapshot = get_student_dashboard_snapshot(student_id)
+    student_info = snapshot.get('info', {})
+    progress_data = snapshot.get('progress')
     if not progress_data:
-        return create_initial_progress_layout(student_id)
+        return create_initial_progress_layout(student_info)
 
     if active_tab == '総合':
         all_records = []
@@ -204,11 +202,11 @@ def generate_dashboard_content(student_id, active_tab, for_print=False):
                         'total_units': details.get('total_units', 1),
                     })
 
-        past_exam_hours = get_total_past_exam_time(student_id)
+        past_exam_hours = snapshot['past_exam_hours']
         df_all = pd.DataFrame(all_records) if all_records else pd.DataFrame()
 
         if df_all.empty and past_exam_hours == 0:
-             return create_initial_progress_layout(student_id)
+             return create_initial_progress_layout(student_info)
 
         summary_cards = create_summary_cards(df_all, past_exam_hours)
 
@@ -227,7 +225,7 @@ def generate_dashboard_content(student_id, active_tab, for_print=False):
         stacked_bar_fig = create_progress_stacked_bar_chart(df_all, '全科目の合計学習時間', for_print=for_print)
         
         # ★★★ 修正箇所2: 呼び出す関数を変更 ★★★
-        eiken_card = create_eiken_display_card(student_id)
+        eiken_card = create_eiken_display_card(snapshot['eiken_results'])
 
         left_col = html.Div([
             # 修正：style={'height': '250px'} を削除し、responsiveを有効にする
@@ -286,7 +284,6 @@ def generate_dashboard_content(student_id, active_tab, for_print=False):
             summary_cards
         ])
 
-        student_info = get_student_info_by_id(student_id)
         right_col = create_progress_table(progress_data, student_info, active_tab)
 
         return dbc.Row([
@@ -326,6 +323,7 @@ def register_progress_callbacks(app):
                 raise PreventUpdate
         
         if not active_tab: return no_update
+        use_read_only_request_transaction()
         return generate_dashboard_content(student_id, active_tab)
 
     # ★★★ 進捗の一括保存コールバック (修正版: MATCH -> ALL) ★★★
@@ -110,7 +110,8 @@ def create_html_calendar(acceptance_data, target_year_month):
     date_cols = ['application_deadline', 'exam_date', 'announcement_date', 'procedure_deadline']
     dt_cols = ['app_deadline_dt', 'exam_dt', 'announcement_dt', 'proc_deadline_dt']
     for col, dt_col in zip(date_cols, dt_cols):
-        if col in df.columns: df[dt_col] = pd.to_datetime(df[col], errors='coerce')
+        # 各期日は DATE 型の列から date オブジェクト (未設定は None) で渡されるため変換不要
+        if col in df.columns: df[dt_col] = df[col]
         else: df[dt_col] = pd.NaT
 
     sort_keys = []
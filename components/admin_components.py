@@ -369,20 +369,36 @@ def create_mock_exam_list_modal():
                     ), width=12, md=3, className="mb-2"),
                 ], className="mb-3"),
 
+                # ページ送り (形式ごとに各ページの先頭位置を積む)
+                dcc.Store(id='mock-exam-list-page-store', data={}),
                 # ★★★ テーブル表示エリアをタブに変更 ★★★
                 dbc.Tabs(
                     [
                         dbc.Tab(
-                            dcc.Loading(
-                                html.Div(id="mock-exam-list-table-container-mark", style={"minHeight": "200px"}),
-                            ),
+                            [
+                                dcc.Loading(
+                                    html.Div(id="mock-exam-list-table-container-mark", style={"minHeight": "200px"}),
+                                ),
+                                html.Div([
+                                    dbc.Button("前へ", id="mock-exam-list-prev-btn-mark", color="secondary", outline=True, size="sm", disabled=True),
+                                    html.Span(id="mock-exam-list-page-info-mark", className="mx-3 text-muted"),
+                                    dbc.Button("次へ", id="mock-exam-list-next-btn-mark", color="secondary", outline=True, size="sm", disabled=True),
+                                ], className="d-flex justify-content-center align-items-center my-2"),
+                            ],
                             label="マーク模試",
                             tab_id="tab-mock-list-mark",
                         ),
                         dbc.Tab(
-                            dcc.Loading(
-                                html.Div(id="mock-exam-list-table-container-descriptive", style={"minHeight": "200px"}),
-                            ),
+                            [
+                                dcc.Loading(
+                                    html.Div(id="mock-exam-list-table-container-descriptive", style={"minHeight": "200px"}),
+                                ),
+                                html.Div([
+                                    dbc.Button("前へ", id="mock-exam-list-prev-btn-descriptive", color="secondary", outline=True, size="sm", disabled=True),
+                                    html.Span(id="mock-exam-list-page-info-descriptive", className="mx-3 text-muted"),
+                                    dbc.Button("次へ", id="mock-exam-list-next-btn-descriptive", color="secondary", outline=True, size="sm", disabled=True),
+                                ], className="d-flex justify-content-center align-items-center my-2"),
+                            ],
                             label="記述模試",
                             tab_id="tab-mock-list-descriptive",
                         ),
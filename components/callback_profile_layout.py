@@ -0,0 +1,37 @@
+# components/callback_profile_layout.py
+
+from dash import dcc, html
+import dash_bootstrap_components as dbc
+
+
+def create_callback_profile_layout():
+    """管理者用: コールバック・データ層の計測結果ページのレイアウト"""
+    return dbc.Container([
+        html.H3("コールバック計測", className="my-4", style={"border-left": "solid 5px #7db4e6", "padding": "10px"}),
+        html.P(
+            "集計はサーバーのワーカープロセスごとです。表示中のワーカーが起動してから (またはリセットしてから) の値を示します。",
+            className="small text-muted"
+        ),
+        dbc.Row([
+            dbc.Col(
+                dcc.Dropdown(
+                    id='callback-profile-sort',
+                    options=[
+                        {'label': '合計時間', 'value': 'total_ms'},
+                        {'label': 'p95', 'value': 'p95_ms'},
+                        {'label': '最大時間', 'value': 'max_ms'},
+                        {'label': '最大応答サイズ', 'value': 'max_bytes'},
+                        {'label': '呼び出し回数', 'value': 'calls'},
+                    ],
+                    value='total_ms',
+                    clearable=False
+                ),
+                width=12, md=3, className="mb-3"
+            ),
+            dbc.Col([
+                dbc.Button("再読み込み", id="callback-profile-refresh-btn", color="primary", className="me-2"),
+                dbc.Button("リセット", id="callback-profile-reset-btn", color="secondary", outline=True),
+            ], width=12, md=9, className="mb-3"),
+        ]),
+        dcc.Loading(html.Div(id='callback-profile-container')),
+    ], fluid=True)
@@ -180,6 +180,13 @@ def _create_past_exam_tab():
             dbc.Col(dcc.Dropdown(id='past-exam-subject-filter', placeholder="科目で絞り込み..."), width=12, md=4)
         ], className="mb-3"),
         dcc.Loading(html.Div(id="past-exam-table-container")),
+        # ページ送り (各ページの先頭位置を past-exam-page-store に積む)
+        dcc.Store(id='past-exam-page-store', data={'cursors': [None], 'next': None}),
+        html.Div([
+            dbc.Button("前へ", id="past-exam-prev-page-btn", color="secondary", outline=True, size="sm", disabled=True),
+            html.Span(id="past-exam-page-info", className="mx-3 text-muted"),
+            dbc.Button("次へ", id="past-exam-next-page-btn", color="secondary", outline=True, size="sm", disabled=True),
+        ], className="d-flex justify-content-center align-items-center mb-3"),
         dbc.Modal([ # 過去問モーダル
              dbc.ModalHeader(dbc.ModalTitle(id="past-exam-modal-title")),
              dbc.ModalBody([
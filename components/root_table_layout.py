@@ -30,6 +30,5 @@ def create_root_table_layout(user_info):
     return dbc.Container([
         html.H3("指導要領（ルート表）一覧", className="mt-4 mb-4"),
         filter_card,
-        html.Div(id='rt-list-container'),
-        dcc.Download(id="rt-download-component")
+        html.Div(id='rt-list-container')
     ], fluid=True)
\ No newline at end of file
@@ -0,0 +1,267 @@
+# data/batch_ingest.py
+
+"""
+フォーム連携APIの入力検証と一括登録
+
+/api/submit-* は1件ごとに接続・INSERT・コミットを行うため、フォームの未送信分の再送や
+クラス全員分の模試結果の同期では数千回の往復になる。一括APIは JSON配列 または NDJSON
+(1行1件) を受け取り、全件を検証したうえで正しい行だけを execute_values でまとめて登録する。
+
+- chunk_size 件ごとに1トランザクションで登録する (1チャンクの失敗が他のチャンクに影響しない)
+- チャンク内でDBエラー (存在しない student_id など) が起きた場合は、そのチャンクを1件ずつ
+  SAVEPOINT 付きで登録し直し、問題のある行だけを失敗にする
+- 結果は入力の順番 (index) ごとに status = created / invalid / error で返す
+"""
+import json
+from datetime import datetime
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from config.settings import APP_CONFIG
+from data.db_pool import get_db_connection
+from data.instrumentation import instrumented
+
+BATCH_CHUNK_SIZE = APP_CONFIG['api']['batch_chunk_size']
+
+PAST_EXAM_COLUMNS = [
+    'student_id', 'date', 'university_name', 'faculty_name', 'exam_system',
+    'year', 'subject', 'time_required', 'total_time_allowed',
+    'correct_answers', 'total_questions'
+]
+ACCEPTANCE_COLUMNS = [
+    'student_id', 'university_name', 'faculty_name', 'department_name', 'exam_system', 'result',
+    'application_deadline', 'exam_date', 'announcement_date', 'procedure_deadline'
+]
+MOCK_EXAM_SCORE_COLUMNS = [
+    'subject_kokugo_desc', 'subject_math_desc', 'subject_english_desc',
+    'subject_rika1_desc', 'subject_rika2_desc', 'subject_shakai1_desc', 'subject_shakai2_desc',
+    'subject_gendaibun_mark', 'subject_kobun_mark', 'subject_kanbun_mark',
+    'subject_math1a_mark', 'subject_math2bc_mark',
+    'subject_english_r_mark', 'subject_english_l_mark', 'subject_rika1_mark', 'subject_rika2_mark',
+    'subject_shakai1_mark', 'subject_shakai2_mark', 'subject_rika_kiso1_mark',
+    'subject_rika_kiso2_mark', 'subject_info_mark'
+]
+MOCK_EXAM_COLUMNS = [
+    'student_id', 'result_type', 'mock_exam_name', 'mock_exam_format',
+    'grade', 'round', 'exam_date'
+] + MOCK_EXAM_SCORE_COLUMNS
+
+
+def _int_or_none(value):
+    return int(value) if value is not None and value != '' else None
+
+
+def _parse_date(value):
+    return datetime.strptime(str(value), '%Y-%m-%d').date()
+
+
+# --- 入力検証 (単票APIと一括APIで共通) ---
+# いずれも (登録用の辞書, None) または (None, エラーメッセージ) を返す
+
+def parse_past_exam_submission(data):
+    if not isinstance(data, dict):
+        return None, "Each record must be a JSON object"
+    required_fields = ['student_id', 'date', 'university_name', 'year', 'subject', 'total_questions']
+    missing_fields = [f for f in required_fields if f not in data]
+    if missing_fields:
+        return None, f"Missing required fields: {', '.join(missing_fields)}"
+    try:
+        record = {
+            'student_id': int(data['student_id']),
+            'date': _parse_date(data['date']),
+            'university_name': data['university_name'],
+            'faculty_name': data.get('faculty_name'),
+            'exam_system': data.get('exam_system'),
+            'year': int(data['year']),
+            'subject': data['subject'],
+            'time_required': _int_or_none(data.get('time_required')),
+            'total_time_allowed': _int_or_none(data.get('total_time_allowed')),
+            'correct_answers': _int_or_none(data.get('correct_answers')),
+            'total_questions': _int_or_none(data.get('total_questions')),
+        }
+    except (ValueError, TypeError) as e:
+        return None, f"Invalid data format: {e}"
+    return record, None
+
+
+def parse_acceptance_submission(data):
+    if not isinstance(data, dict):
+        return None, "Each record must be a JSON object"
+    required_fields = ['student_id', 'university_name', 'faculty_name']
+    missing_fields = [f for f in required_fields if f not in data]
+    if missing_fields:
+        return None, f"Missing required fields: {', '.join(missing_fields)}"
+    try:
+        record = {
+            'student_id': int(data['student_id']),
+            'university_name': data['university_name'],
+            'faculty_name': data['faculty_name'],
+            'department_name': data.get('department_name'),
+            'exam_system': data.get('exam_system'),
+            'result': data.get('result'),
+        }
+        for field in ['application_deadline', 'exam_date', 'announcement_date', 'procedure_deadline']:
+            record[field] = _parse_date(data[field]) if data.get(field) else None
+    except (ValueError, TypeError) as e:
+        return None, f"Invalid data format: {e}"
+    return record, None
+
+
+def parse_mock_exam_submission(data):
+    if not isinstance(data, dict):
+        return None, "Each record must be a JSON object"
+    required_fields = ['student_id', 'result_type', 'mock_exam_name', 'mock_exam_format', 'grade', 'round']
+    missing_fields = [f for f in required_fields if f not in data or not data[f]]
+    if missing_fields:
+        return None, f"Missing required fields: {', '.join(missing_fields)}"
+    try:
+        student_id = int(data['student_id'])
+    except (ValueError, TypeError):
+        return None, "Invalid student_id format"
+    try:
+        exam_date = _parse_date(data['exam_date']) if data.get('exam_date') else None
+    except (ValueError, TypeError):
+        return None, "Invalid exam_date format (YYYY-MM-DD expected)"
+
+    record = {column: data.get(column) for column in MOCK_EXAM_COLUMNS}
+    record['student_id'] = student_id
+    record['exam_date'] = exam_date
+    # 点数は数値に変換できなければ NULL (add_mock_exam_result と同じ扱い)
+    for column in MOCK_EXAM_SCORE_COLUMNS:
+        try:
+            record[column] = _int_or_none(record[column])
+        except (ValueError, TypeError):
+            record[column] = None
+    return record, None
+
+
+# 一括API の種類 -> (検証関数, テーブル名, 列)
+BATCH_TARGETS = {
+    'past_exam': (parse_past_exam_submission, 'past_exam_results', PAST_EXAM_COLUMNS),
+    'acceptance': (parse_acceptance_submission, 'university_acceptance', ACCEPTANCE_COLUMNS),
+    'mock_exam': (parse_mock_exam_submission, 'mock_exam_results', MOCK_EXAM_COLUMNS),
+}
+
+
+# --- リクエスト本文の読み込み ---
+
+def iter_ndjson(lines):
+    """
+    NDJSON の各行を順に返す。空行は読み飛ばし、解釈できない行は ValueError のインスタンスを返す
+    (その行だけを invalid にし、残りの行の処理は続けるため)。
+    """
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield ValueError(f"Invalid JSON: {e}")
+
+
+# --- 一括登録 ---
+
+def _db_error_message(e):
+    return getattr(e.diag, 'message_primary', None) or str(e).strip() or e.__class__.__name__
+
+
+def insert_rows(cur, target, pending):
+    """
+    呼び出し側のトランザクション内で pending ([(index, 検証済みの辞書)]) を登録し、行ごとの結果を返す。
+    まとめての登録に失敗した場合は、1件ずつ SAVEPOINT 付きで登録し直して問題のある行だけを失敗にする。
+    """
+    _, table_name, columns = BATCH_TARGETS[target]
+    column_sql = ', '.join(columns)
+    rows = [tuple(record[column] for column in columns) for _, record in pending]
+
+    cur.execute("SAVEPOINT batch_chunk")
+    try:
+        ids = execute_values(
+            cur,
+            f"INSERT INTO {table_name} ({column_sql}) VALUES %s RETURNING id",
+            rows,
+            page_size=len(rows),
+            fetch=True
+        )
+        cur.execute("RELEASE SAVEPOINT batch_chunk")
+        return [{'index': index, 'status': 'created', 'id': row[0]} for (index, _), row in zip(pending, ids)]
+    except psycopg2.Error as e:
+        cur.execute("ROLLBACK TO SAVEPOINT batch_chunk")
+        print(f"一括登録のチャンクを1件ずつ登録し直します ({table_name}): {_db_error_message(e)}")
+
+    results = []
+    placeholders = ', '.join(['%s'] * len(columns))
+    for (index, _), row in zip(pending, rows):
+        cur.execute("SAVEPOINT batch_row")
+        try:
+            cur.execute(f"INSERT INTO {table_name} ({column_sql}) VALUES ({placeholders}) RETURNING id", row)
+            results.append({'index': index, 'status': 'created', 'id': cur.fetchone()[0]})
+            cur.execute("RELEASE SAVEPOINT batch_row")
+        except psycopg2.Error as e:
+            cur.execute("ROLLBACK TO SAVEPOINT batch_row")
+            results.append({'index': index, 'status': 'error', 'message': _db_error_message(e)})
+    return results
+
+
+def _insert_chunk(target, pending):
+    """pending を1トランザクションで登録する"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            results = insert_rows(cur, target, pending)
+        conn.commit()
+        return results
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"データベースエラー (_insert_chunk {target}): {e}")
+        return [{'index': index, 'status': 'error', 'message': "Database error"} for index, _ in pending]
+    finally:
+        conn.close()
+
+
+def validate_records(target, records):
+    """
+    records を順に検証し、(index, 検証済みの辞書, 元の入力, エラーメッセージ) を返すジェネレーター。
+    検証に失敗した行は辞書が None になる。
+    """
+    parse = BATCH_TARGETS[target][0]
+    for index, data in enumerate(records):
+        if isinstance(data, Exception):
+            yield index, None, None, str(data)
+            continue
+        record, error = parse(data)
+        yield index, record, data, error
+
+
+@instrumented
+def ingest_batch(target, records, chunk_size=BATCH_CHUNK_SIZE):
+    """
+    records (辞書のイテラブル) を検証して一括登録し、入力順の行ごとの結果のリストを返す。
+    records は順に読むため、NDJSON をストリームのまま渡せば chunk_size 件ずつ読みながら登録できる。
+    """
+    results = []
+    pending = []
+    for index, record, _, error in validate_records(target, records):
+        if error:
+            results.append({'index': index, 'status': 'invalid', 'message': error})
+            continue
+        pending.append((index, record))
+        if len(pending) >= chunk_size:
+            results.extend(_insert_chunk(target, pending))
+            pending = []
+    if pending:
+        results.extend(_insert_chunk(target, pending))
+    results.sort(key=lambda r: r['index'])
+    return results
+
+
+def summarize_batch_results(results):
+    """行ごとの結果から件数の集計を作る"""
+    summary = {'total': len(results), 'created': 0, 'queued': 0, 'invalid': 0, 'error': 0}
+    for result in results:
+        summary[result['status']] += 1
+    return summary
@@ -0,0 +1,124 @@
+# data/cache.py
+
+"""
+プロセス内キャッシュ
+
+更新頻度の低いマスターデータなどをワーカープロセス内に保持し、DBへの問い合わせを減らす。
+書き込み側の関数は invalidate() で明示的にキャッシュを破棄すること。
+"""
+import copy
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+_registry = {}
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    有効期限付きの読み取りキャッシュ。ヒット数・ミス数を記録する。
+    max_size を指定すると、超えた分を最も長く参照されていない項目から破棄する (LRU)。
+    copy_values=False の場合は値をコピーせずに返す (呼び出し側が値を変更しない大きな索引などに使う)。
+    """
+
+    def __init__(self, name, ttl, max_size=None, copy_values=True):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self._copy = copy.deepcopy if copy_values else (lambda value: value)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # key -> (有効期限, 値)。末尾ほど最近参照された項目
+        self._generation = 0 # invalidate のたびに進め、読み込み中に破棄された値を保存しないようにする
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        _registry[name] = self
+
+    @property
+    def generation(self):
+        """読み込み開始前に取得し、set() に渡すことで読み込み中の invalidate を検出する"""
+        with self._lock:
+            return self._generation
+
+    def get(self, key, default=None):
+        """キャッシュにあれば値のコピーを、無い・期限切れの場合は default を返す"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._copy(entry[1])
+            if entry:
+                del self._entries[key]
+            self.misses += 1
+        return default
+
+    def set(self, key, value, generation=None):
+        """
+        値を保存する。generation を指定した場合、その後に invalidate されていれば保存しない。
+        空の結果はDBエラー時と区別できないためキャッシュしない。
+        """
+        if not value:
+            return
+        value = self._copy(value)
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while self.max_size is not None and len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        """キャッシュから値を返す。無い・期限切れの場合は loader() の結果を保存して返す。"""
+        generation = self.generation
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        value = loader()
+        self.set(key, value, generation)
+        return self._copy(value)
+
+    def invalidate(self, key=None):
+        """key を指定すればその項目のみ、省略すればすべての項目を破棄する"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+            self._generation += 1
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions,
+            }
+
+
+def cached(cache):
+    """関数の戻り値を引数ごとに cache へ保存するデコレーター"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            return cache.get_or_load((func.__name__,) + args, lambda: func(*args))
+        wrapper.uncached = func
+        return wrapper
+    return decorator
+
+
+def get_cache_stats():
+    """登録済みの全キャッシュの統計を {名前: 統計} の形で返す"""
+    return {name: cache.stats() for name, cache in _registry.items()}
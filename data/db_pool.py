@@ -0,0 +1,402 @@
+# data/db_pool.py
+
+"""
+PostgreSQLコネクションプール
+
+gunicornの各ワーカー(プロセス)ごとに1つのプールを持ち、データ層の関数は
+get_db_connection() / db_connection() を通じて接続を借りて返却する。
+
+init_request_connection_scope() で登録したパス (Dash のコールバックなど) のリクエストでは、
+処理中に呼ばれたデータ層の関数が1本の接続を共有し、リクエストの終了時 (teardown) にプールへ返却する。
+use_read_only_request_transaction() を呼んだリクエストでは、読み取りを1つの REPEATABLE READ READ ONLY
+トランザクションで行い、関数をまたいで同じ時点のデータを読む。
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.pool
+from flask import g, has_request_context, request
+from psycopg2 import extensions
+
+from config.settings import APP_CONFIG
+from data import instrumentation
+
+DATABASE_URL = APP_CONFIG['data']['database_url']
+POOL_CONFIG = APP_CONFIG['data']['pool']
+
+
+class PoolTimeout(psycopg2.pool.PoolError):
+    """プールの接続がすべて使用中で、待機時間内に空かなかった場合のエラー"""
+
+
+class ConnectionPool:
+    """スレッドセーフなプロセス単位のコネクションプール"""
+
+    def __init__(self, dsn, min_size=1, max_size=5, checkout_timeout=10.0, health_check_interval=30.0):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"不正なプールサイズです: min_size={min_size}, max_size={max_size}")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self._init_state()
+
+    def _init_state(self):
+        self._cond = threading.Condition()
+        self._idle = [] # (接続, 返却時刻) のリスト。末尾から取り出す (LIFO)
+        self._size = 0 # 開いている接続の総数 (アイドル + 貸出中)
+        self._in_use = 0
+        self._pid = os.getpid()
+
+    def reset_after_fork(self):
+        """
+        fork後の子プロセスでプールを初期化する。
+        親から引き継いだ接続は close() すると親側のセッションまで切断されるため、閉じずに破棄する。
+        """
+        self._init_state()
+
+    def _connect(self):
+        if instrumentation.ENABLED:
+            # カーソルの execute() ごとに所要時間と行数を記録する
+            return psycopg2.connect(self.dsn, connection_factory=instrumentation.InstrumentedConnection)
+        return psycopg2.connect(self.dsn)
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _is_usable(self, conn, released_at):
+        """貸出前のヘルスチェック。長くアイドルだった接続のみ実際に疎通を確認する。"""
+        if conn.closed:
+            return False
+        if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if time.monotonic() - released_at < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def fill(self):
+        """min_size まで接続を事前に確立する (接続失敗時は貸出時に再試行される)"""
+        with self._cond:
+            missing = self.min_size - self._size
+            self._size += max(missing, 0)
+        for i in range(missing):
+            try:
+                conn = self._connect()
+            except psycopg2.Error as e:
+                print(f"データベース接続エラー (ConnectionPool.fill): {e}")
+                with self._cond:
+                    self._size -= missing - i
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def getconn(self):
+        """プールから生の接続を借りる。空きがなければ checkout_timeout 秒まで待機する。"""
+        if self._pid != os.getpid():
+            self.reset_after_fork()
+
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f"コネクションプールが枯渇しています (max_size={self.max_size})")
+                    self._cond.wait(remaining)
+                if self._idle:
+                    conn, released_at = self._idle.pop()
+                else:
+                    conn, released_at = None, None
+                    self._size += 1
+                self._in_use += 1
+
+            if conn is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._in_use -= 1
+                        self._cond.notify()
+                    raise
+
+            if self._is_usable(conn, released_at):
+                return conn
+
+            # 切断済み・異常な接続は捨てて次を探す
+            self._discard(conn)
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+
+    def putconn(self, conn, discard=False):
+        """借りた接続をプールへ返却する。未完了のトランザクションはロールバックされる。"""
+        if self._pid != os.getpid():
+            # fork前に借りた接続は子プロセスのプールの管理外
+            return
+
+        if not discard and not conn.closed:
+            try:
+                if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except psycopg2.Error:
+                discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            if discard or conn.closed:
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+        if discard and not conn.closed:
+            self._discard(conn)
+
+    def closeall(self):
+        """アイドル中の接続をすべて閉じる"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        """プールの使用状況を返す"""
+        with self._cond:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+            }
+
+
+class PooledConnection:
+    """
+    プールから貸し出した接続のラッパー。
+    psycopg2の接続と同じように使え、close() を呼ぶと実際には切断せずプールへ返却する。
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        conn = self.__dict__.get('_conn')
+        if conn is None:
+            raise psycopg2.InterfaceError("この接続は既にプールへ返却されています")
+        return getattr(conn, name)
+
+    @property
+    def closed(self):
+        return self._conn is None or self._conn.closed
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.putconn(conn)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """プロセス共有のプールを取得する (初回呼び出し時に作成)"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                pool = ConnectionPool(
+                    DATABASE_URL,
+                    min_size=POOL_CONFIG['min_size'],
+                    max_size=POOL_CONFIG['max_size'],
+                    checkout_timeout=POOL_CONFIG['checkout_timeout'],
+                    health_check_interval=POOL_CONFIG['health_check_interval'],
+                )
+                pool.fill()
+                _pool = pool
+    return _pool
+
+
+def _reset_pool_after_fork():
+    global _pool_lock
+    _pool_lock = threading.Lock()
+    if _pool is not None:
+        _pool.reset_after_fork()
+
+
+# gunicorn の --preload などで親プロセスがプールを作成済みの場合でも、ワーカーは自前の接続を持つ
+os.register_at_fork(after_in_child=_reset_pool_after_fork)
+
+
+def _checkout(pool):
+    start = time.perf_counter()
+    conn = pool.getconn()
+    instrumentation.record_connection_acquire(time.perf_counter() - start)
+    return conn
+
+
+class _RequestScope:
+    """1リクエストで共有する接続 (最初に get_db_connection() が呼ばれた時点でプールから借りる)"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.conn = None
+        self.in_use = False # 共有の接続をいずれかの関数が使用中か
+        self.read_only = False
+
+    def _begin_read_only(self):
+        self.conn.set_session(isolation_level=extensions.ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+
+    def acquire(self):
+        if self.conn is None:
+            self.conn = _checkout(self.pool)
+            if self.read_only:
+                self._begin_read_only()
+        self.in_use = True
+        return RequestConnection(self)
+
+    def end_use(self, conn):
+        """関数が close() した時点の後始末 (プールへの返却時と同じく、コミットしていない変更は破棄する)"""
+        self.in_use = False
+        try:
+            status = conn.info.transaction_status
+            if status == extensions.TRANSACTION_STATUS_INERROR or \
+                    (status != extensions.TRANSACTION_STATUS_IDLE and not self.read_only):
+                conn.rollback()
+        except psycopg2.Error:
+            # 壊れた接続は捨て、次の関数には新しい接続を貸す
+            self.conn = None
+            self.pool.putconn(conn, discard=True)
+
+    def release(self):
+        conn, self.conn = self.conn, None
+        if conn is None:
+            return
+        discard = False
+        try:
+            if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            if self.read_only:
+                conn.set_session(isolation_level='DEFAULT', readonly='DEFAULT')
+        except psycopg2.Error:
+            discard = True
+        self.pool.putconn(conn, discard=discard)
+
+
+class RequestConnection(PooledConnection):
+    """
+    リクエスト内で共有する接続のラッパー。
+    close() ではプールへ返却せず、リクエストの終了時にまとめて返却する。
+    読み取り専用のリクエストでは commit() してもトランザクション (スナップショット) を終えない。
+    """
+
+    def __init__(self, scope):
+        super().__init__(scope.pool, scope.conn)
+        self._scope = scope
+
+    def commit(self):
+        if self._scope.read_only:
+            return
+        self._conn.commit()
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._scope.end_use(conn)
+
+
+def _current_request_scope():
+    if not has_request_context():
+        return None
+    return g.get('db_request_scope')
+
+
+def get_db_connection():
+    """
+    PostgreSQLデータベース接続をプールから取得します。使用後は close() でプールへ返却してください。
+    リクエスト単位の共有が有効なリクエストでは共有の接続を返します (関数の中から別の関数を呼んで
+    共有の接続が使用中の場合は、トランザクションが混ざらないようプールから別の接続を借ります)。
+    """
+    scope = _current_request_scope()
+    if scope is not None and not scope.in_use:
+        return scope.acquire()
+    pool = get_pool()
+    return PooledConnection(pool, _checkout(pool))
+
+
+def use_read_only_request_transaction():
+    """
+    このリクエストのデータ層の読み取りを1つの REPEATABLE READ READ ONLY トランザクションで行う。
+    読み取りのみのコールバックの先頭で呼ぶ (書き込む関数を呼ぶコールバックでは使わないこと)。
+    リクエスト単位の共有が無効な場合は何もしない。
+    """
+    scope = _current_request_scope()
+    if scope is None or scope.read_only or scope.in_use:
+        return
+    scope.read_only = True
+    if scope.conn is not None:
+        scope.conn.rollback()
+        scope._begin_read_only()
+
+
+def _begin_request_scope(paths):
+    if request.path in paths:
+        g.db_request_scope = _RequestScope(get_pool())
+
+
+def _end_request_scope(exc):
+    scope = g.pop('db_request_scope', None)
+    if scope is not None:
+        scope.release()
+
+
+def init_request_connection_scope(server, paths):
+    """
+    paths のリクエストで接続を共有するフックを Flask サーバーに登録する
+    (DB_POOL_REQUEST_SCOPED=false の場合は何もしない)。
+    """
+    if not POOL_CONFIG['request_scoped']:
+        return
+    paths = frozenset(paths)
+    server.before_request(lambda: _begin_request_scope(paths))
+    server.teardown_request(_end_request_scope)
+
+
+@contextmanager
+def db_connection():
+    """
+    with 文で接続を借りる。
+    ブロックが正常終了すればコミット、例外時はロールバックし、いずれの場合も接続を返却する。
+    """
+    conn = get_db_connection()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
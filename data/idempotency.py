@@ -0,0 +1,133 @@
+# data/idempotency.py
+
+"""
+フォーム連携APIの冪等キー (api_idempotency_keys)
+
+Googleフォーム / Apps Script はタイムアウトすると同じ内容を再送するため、そのまま登録すると
+過去問・模試の結果が重複する。リクエストごとにキーを決め、最初のリクエストの応答を保存しておき、
+有効期限内に同じキーで届いたリクエストには登録せずに保存済みの応答を返す。
+
+- キーは Idempotency-Key ヘッダー。無い場合は正規化した本文のハッシュを使う
+- 処理中の行 (state = 'processing') があれば後から来た同じキーのリクエストは 409 とする。
+  ワーカーが処理中に落ちた場合に備え、locked_until を過ぎた processing の行は引き継げる
+- 5xx の応答は保存せずにキーを解放し、再送で登録し直せるようにする
+"""
+import hashlib
+import json
+import random
+from datetime import timedelta
+
+from psycopg2.extras import Json
+
+from config.settings import APP_CONFIG
+from data.db_pool import db_connection
+
+IDEMPOTENCY_TTL = timedelta(hours=APP_CONFIG['api']['idempotency_ttl_hours'])
+PROCESSING_TIMEOUT = timedelta(seconds=APP_CONFIG['api']['idempotency_lock_seconds'])
+
+# 期限切れの行を掃除する頻度 (begin_request 呼び出しのうちこの割合で実行)
+_PURGE_PROBABILITY = 0.01
+
+# begin_request の結果
+BEGIN_NEW = 'new'               # 初回 (処理して complete_request / release_request を呼ぶ)
+BEGIN_REPLAY = 'replay'         # 処理済み (保存済みの応答を返す)
+BEGIN_PROCESSING = 'processing' # 同じキーのリクエストを処理中
+BEGIN_MISMATCH = 'mismatch'     # 同じキーで内容の異なるリクエスト
+
+
+def _normalize(value):
+    """文字列の前後の空白を除き、空文字列と None を区別しない形にそろえる"""
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items() if item not in (None, '')}
+    if isinstance(value, list):
+        return [_normalize(item) for item in value]
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+
+def make_request_hash(endpoint, payload):
+    normalized = json.dumps(_normalize(payload), sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(f"{endpoint}\n{normalized}".encode('utf-8')).hexdigest()
+
+
+def make_idempotency_key(endpoint, header_key, request_hash):
+    """ヘッダーのキーがあればエンドポイントごとに区別したキーを、無ければ本文のハッシュを返す"""
+    if header_key:
+        return hashlib.sha256(f"{endpoint}\nheader\n{header_key}".encode('utf-8')).hexdigest()
+    return request_hash
+
+
+def begin_request(idempotency_key, endpoint, request_hash):
+    """
+    キーの使用を開始する。(BEGIN_* のいずれか, 保存済みの (ステータス, 本文) または None) を返す。
+    期限切れの行と、処理が途絶えた processing の行は新しいリクエストで上書きする。
+    """
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            if random.random() < _PURGE_PROBABILITY:
+                cur.execute("DELETE FROM api_idempotency_keys WHERE expires_at < CURRENT_TIMESTAMP")
+            cur.execute(
+                """
+                INSERT INTO api_idempotency_keys (idempotency_key, endpoint, request_hash, locked_until, expires_at)
+                VALUES (%s, %s, %s, CURRENT_TIMESTAMP + %s, CURRENT_TIMESTAMP + %s)
+                ON CONFLICT (idempotency_key) DO UPDATE SET
+                    endpoint = EXCLUDED.endpoint,
+                    request_hash = EXCLUDED.request_hash,
+                    state = 'processing',
+                    response_status = NULL,
+                    response_body = NULL,
+                    locked_until = EXCLUDED.locked_until,
+                    created_at = CURRENT_TIMESTAMP,
+                    expires_at = EXCLUDED.expires_at
+                WHERE api_idempotency_keys.expires_at < CURRENT_TIMESTAMP
+                   OR (api_idempotency_keys.state = 'processing'
+                       AND api_idempotency_keys.locked_until < CURRENT_TIMESTAMP)
+                RETURNING idempotency_key
+                """,
+                (idempotency_key, endpoint, request_hash, PROCESSING_TIMEOUT, IDEMPOTENCY_TTL)
+            )
+            if cur.fetchone():
+                return BEGIN_NEW, None
+
+            cur.execute(
+                """
+                SELECT request_hash, state, response_status, response_body
+                FROM api_idempotency_keys WHERE idempotency_key = %s
+                """,
+                (idempotency_key,)
+            )
+            row = cur.fetchone()
+    if row is None:
+        # 判定の間に別のリクエストが解放した (再送してもらう)
+        return BEGIN_PROCESSING, None
+    stored_hash, state, response_status, response_body = row
+    if stored_hash != request_hash:
+        return BEGIN_MISMATCH, None
+    if state == 'completed':
+        return BEGIN_REPLAY, (response_status, response_body)
+    return BEGIN_PROCESSING, None
+
+
+def complete_request(idempotency_key, response_status, response_body):
+    """処理結果を保存する。以降の同じキーのリクエストにはこの応答を返す"""
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE api_idempotency_keys
+                SET state = 'completed', response_status = %s, response_body = %s, locked_until = CURRENT_TIMESTAMP
+                WHERE idempotency_key = %s
+                """,
+                (response_status, Json(response_body), idempotency_key)
+            )
+
+
+def release_request(idempotency_key):
+    """処理に失敗したキーを解放し、再送で処理し直せるようにする"""
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "DELETE FROM api_idempotency_keys WHERE idempotency_key = %s AND state = 'processing'",
+                (idempotency_key,)
+            )
@@ -0,0 +1,393 @@
+# data/instrumentation.py
+
+"""
+データ層の計測 (関数ごとの呼び出し回数・所要時間・返した行数・接続の待ち時間) とスロークエリログ
+
+- @instrumented (または instrument_module_functions) を付けたデータ層の関数ごとに集計する
+- プールの接続は InstrumentedConnection で作成し、カーソルの execute() ごとに所要時間と行数を記録する
+  (呼び出し中の計測対象の関数に加算し、計測対象外から実行されたクエリは UNATTRIBUTED に集計する)
+- しきい値 (QUERY_SLOW_MS) を超えたクエリは、パラメータ・リテラルを伏せた SQL をログに出力し、
+  直近の分を get_slow_queries() で参照できるよう保持する
+集計はワーカープロセスごとで、get_function_stats() / get_slow_queries() / reset_stats() で参照・初期化する。
+capture_queries() のブロック内では、実行したクエリをパラメータを埋め込んだ SQL のまま記録する (クエリプランの検査用)。
+"""
+import bisect
+import contextlib
+import contextvars
+import functools
+import inspect
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from psycopg2 import extensions
+
+from config.settings import APP_CONFIG
+
+CONFIG = APP_CONFIG['instrumentation']
+ENABLED = CONFIG['enabled']
+
+# 所要時間のヒストグラムの区切り (ミリ秒)。最後の区間はそれ以上すべて
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# 計測対象の関数の外で実行されたクエリの集計名
+UNATTRIBUTED = '(unattributed)'
+
+
+class FunctionStats:
+    """1つの関数 (または UNATTRIBUTED) の集計値"""
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+        self.acquires = 0
+        self.acquire_seconds = 0.0
+
+    def add_call(self, seconds, error):
+        self.calls += 1
+        self.errors += int(error)
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, seconds * 1000)] += 1
+
+    def add_usage(self, usage):
+        self.queries += usage.queries
+        self.db_seconds += usage.db_seconds
+        self.rows += usage.rows
+        self.acquires += usage.acquires
+        self.acquire_seconds += usage.acquire_seconds
+
+    def percentile_ms(self, fraction):
+        """ヒストグラムから推定したパーセンタイル (該当する区間の上限。最後の区間は最大値)"""
+        if not self.calls:
+            return 0.0
+        threshold = fraction * self.calls
+        cumulative = 0
+        for i, count in enumerate(self.buckets):
+            cumulative += count
+            if cumulative >= threshold:
+                return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else self.max_seconds * 1000
+        return self.max_seconds * 1000
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'calls': self.calls,
+            'errors': self.errors,
+            'total_ms': self.total_seconds * 1000,
+            'avg_ms': self.total_seconds * 1000 / self.calls if self.calls else 0.0,
+            'max_ms': self.max_seconds * 1000,
+            'p50_ms': self.percentile_ms(0.50),
+            'p95_ms': self.percentile_ms(0.95),
+            'p99_ms': self.percentile_ms(0.99),
+            'histogram': dict(zip([*(str(b) for b in LATENCY_BUCKETS_MS), '+Inf'], self.buckets)),
+            'queries': self.queries,
+            'db_ms': self.db_seconds * 1000,
+            'rows': self.rows,
+            'acquires': self.acquires,
+            'acquire_ms': self.acquire_seconds * 1000,
+        }
+
+
+class _Usage:
+    """1回の関数呼び出しの間に使ったDB資源"""
+    __slots__ = ('queries', 'db_seconds', 'rows', 'acquires', 'acquire_seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+        self.acquires = 0
+        self.acquire_seconds = 0.0
+
+    def merge(self, other):
+        self.queries += other.queries
+        self.db_seconds += other.db_seconds
+        self.rows += other.rows
+        self.acquires += other.acquires
+        self.acquire_seconds += other.acquire_seconds
+
+
+_lock = threading.Lock()
+_stats = {} # 関数名 -> FunctionStats
+_slow_queries = deque(maxlen=CONFIG['slow_query_log_size'])
+_current = contextvars.ContextVar('instrumented_call', default=None) # (関数名, _Usage)
+_captured = contextvars.ContextVar('captured_queries', default=None) # capture_queries() のリスト
+
+
+def _get_stats(name):
+    stats = _stats.get(name)
+    if stats is None:
+        stats = _stats[name] = FunctionStats(name)
+    return stats
+
+
+def instrumented(func):
+    """データ層の関数の呼び出し回数・所要時間・DB使用量を記録するデコレーター"""
+    if not ENABLED or getattr(func, '_instrumented', False):
+        return func
+    name = func.__name__
+    if inspect.isgeneratorfunction(func):
+        wrapper = _instrumented_generator(func, name)
+        wrapper._instrumented = True
+        return wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        parent = _current.get()
+        usage = _Usage()
+        token = _current.set((name, usage))
+        start = time.perf_counter()
+        error = False
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            error = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            _current.reset(token)
+            _record_call(name, elapsed, error, usage, parent)
+
+    wrapper._instrumented = True
+    return wrapper
+
+
+def _instrumented_generator(func, name):
+    """
+    ジェネレーター関数用のラッパー。要素を取り出すたびに計測中の関数として実行し、
+    ジェネレーターの終了時に1回の呼び出しとして記録する。
+    所要時間は要素の生成にかかった時間の合計 (取り出し側の処理やクライアントへの送信の時間は含めない)。
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        parent = _current.get()
+        usage = _Usage()
+        elapsed = 0.0
+        error = False
+        generator = func(*args, **kwargs)
+        try:
+            while True:
+                token = _current.set((name, usage))
+                start = time.perf_counter()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                except Exception:
+                    error = True
+                    raise
+                finally:
+                    elapsed += time.perf_counter() - start
+                    _current.reset(token)
+                yield item
+        finally:
+            # 途中で取り出しをやめた場合も、ジェネレーターの後始末を計測中に行う
+            token = _current.set((name, usage))
+            try:
+                generator.close()
+            finally:
+                _current.reset(token)
+            _record_call(name, elapsed, error, usage, parent)
+
+    return wrapper
+
+
+def _record_call(name, elapsed, error, usage, parent):
+    with _lock:
+        stats = _get_stats(name)
+        stats.add_call(elapsed, error)
+        stats.add_usage(usage)
+    if parent is not None:
+        # 呼び出し元の関数にも内側で使った分を含める
+        parent[1].merge(usage)
+
+
+def instrument_module_functions(namespace):
+    """
+    モジュールの末尾で instrument_module_functions(globals()) と呼び、
+    そのモジュールで定義された公開関数 (先頭が _ 以外) をすべて計測対象にする。
+    """
+    module_name = namespace['__name__']
+    for name, obj in list(namespace.items()):
+        if name.startswith('_') or not inspect.isfunction(obj) or obj.__module__ != module_name:
+            continue
+        namespace[name] = instrumented(obj)
+
+
+def _record_unattributed(apply):
+    with _lock:
+        stats = _get_stats(UNATTRIBUTED)
+        usage = _Usage()
+        apply(usage)
+        stats.add_usage(usage)
+
+
+def record_connection_acquire(seconds):
+    """プールから接続を借りるまでの待ち時間を記録する (db_pool から呼ぶ)"""
+    if not ENABLED:
+        return
+    def apply(usage):
+        usage.acquires += 1
+        usage.acquire_seconds += seconds
+    current = _current.get()
+    if current is None:
+        _record_unattributed(apply)
+    else:
+        apply(current[1])
+
+
+# --- クエリ単位の計測 ---
+
+_STRING_LITERAL = re.compile(r"[EeBbXxNn]?'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?(?![\w$])")
+_REPEATED_TUPLES = re.compile(r"(\([^()]*\))(?:\s*,\s*\([^()]*\))+")
+_WHITESPACE = re.compile(r"\s+")
+_MAX_SQL_LENGTH = 1000
+
+
+def redact_sql(query):
+    """SQL中の文字列・数値リテラルを ? に置き換え、VALUES の繰り返しを省略して1行にまとめる"""
+    text = _STRING_LITERAL.sub('?', query)
+    text = _NUMBER_LITERAL.sub('?', text)
+    text = _REPEATED_TUPLES.sub(r'\1, ...', text)
+    text = _WHITESPACE.sub(' ', text).strip()
+    return text if len(text) <= _MAX_SQL_LENGTH else text[:_MAX_SQL_LENGTH] + ' ...'
+
+
+def _describe_params(params):
+    """パラメータは値を出さず、型名だけを残す"""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: type(value).__name__ for key, value in params.items()}
+    return [type(value).__name__ for value in params]
+
+
+def _record_query(cursor, query, params, seconds):
+    rows = cursor.rowcount if cursor.description is not None and cursor.rowcount > 0 else 0
+    current = _current.get()
+
+    def apply(usage):
+        usage.queries += 1
+        usage.db_seconds += seconds
+        usage.rows += rows
+    if current is None:
+        _record_unattributed(apply)
+    else:
+        apply(current[1])
+
+    if seconds * 1000 < CONFIG['slow_query_ms']:
+        return
+    if hasattr(query, 'as_string'): # psycopg2.sql.Composed
+        query = query.as_string(cursor.connection)
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', errors='replace')
+    entry = {
+        'at': datetime.now().isoformat(timespec='seconds'),
+        'function': current[0] if current else UNATTRIBUTED,
+        'duration_ms': seconds * 1000,
+        'rows': rows,
+        'sql': redact_sql(query),
+        'params': _describe_params(params),
+    }
+    with _lock:
+        _slow_queries.append(entry)
+    print(f"スロークエリ ({entry['function']}, {entry['duration_ms']:.1f}ms, {rows}行): {entry['sql']} params={entry['params']}")
+
+
+@contextlib.contextmanager
+def capture_queries():
+    """
+    ブロック内で execute() したクエリを {'function': 関数名, 'sql': パラメータを埋め込んだ SQL} のリストに記録する。
+    値がそのまま残るため、ログには出さず検査ツール (explain_data_queries.py) でのみ使う。
+    """
+    queries = []
+    token = _captured.set(queries)
+    try:
+        yield queries
+    finally:
+        _captured.reset(token)
+
+
+def _capture_query(cursor, query, params, captured):
+    current = _current.get()
+    sql = cursor.mogrify(query, params)
+    captured.append({
+        'function': current[0] if current else UNATTRIBUTED,
+        'sql': sql.decode('utf-8', errors='replace') if isinstance(sql, bytes) else sql,
+    })
+
+
+class _InstrumentedCursorMixin:
+    def execute(self, query, vars=None):
+        captured = _captured.get()
+        if captured is not None:
+            _capture_query(self, query, vars, captured)
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            _record_query(self, query, vars, time.perf_counter() - start)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            _record_query(self, query, None, time.perf_counter() - start)
+
+
+_cursor_classes = {}
+
+
+def _instrumented_cursor_class(base):
+    cls = _cursor_classes.get(base)
+    if cls is None:
+        cls = _cursor_classes[base] = type(f"Instrumented{base.__name__}", (_InstrumentedCursorMixin, base), {})
+    return cls
+
+
+class InstrumentedConnection(extensions.connection):
+    """
+    cursor() で作るカーソルを計測付きのサブクラスに差し替える接続。
+    cursor_factory (DictCursor など) を指定した場合も、そのクラスを継承した計測付きのカーソルになる。
+    """
+
+    def cursor(self, *args, **kwargs):
+        if len(args) >= 2:
+            args = (args[0], _instrumented_cursor_class(args[1] or self.cursor_factory or extensions.cursor)) + args[2:]
+        else:
+            base = kwargs.get('cursor_factory') or self.cursor_factory or extensions.cursor
+            kwargs['cursor_factory'] = _instrumented_cursor_class(base)
+        return super().cursor(*args, **kwargs)
+
+
+# --- 集計の参照 ---
+
+def get_function_stats():
+    """関数ごとの集計を合計所要時間の長い順に返す"""
+    with _lock:
+        stats = [s.to_dict() for s in _stats.values()]
+    return sorted(stats, key=lambda s: s['total_ms'], reverse=True)
+
+
+def get_slow_queries():
+    """直近のスロークエリ (新しい順)"""
+    with _lock:
+        return list(reversed(_slow_queries))
+
+
+def reset_stats():
+    with _lock:
+        _stats.clear()
+        _slow_queries.clear()
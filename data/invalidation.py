@@ -0,0 +1,142 @@
+# data/invalidation.py
+
+"""
+ワーカー間のキャッシュ無効化バス (PostgreSQL LISTEN/NOTIFY)
+
+gunicornの各ワーカーはそれぞれ独自のプロセス内キャッシュを持つため、あるワーカーで書き込みが
+あっても他のワーカーのキャッシュは古いままになる。書き込み関数はトランザクション内で notify() を
+呼び、コミットと同時に全ワーカーへ (トピック, キー) を通知する。各ワーカーのリスナースレッドは
+通知を受け取ると、subscribe() で登録されたハンドラーを呼び出して該当キャッシュを破棄する。
+
+書き込んだワーカー自身のキャッシュは、コミット直後に dispatch() を呼んで即座に破棄すること。
+"""
+import json
+import os
+import select
+import threading
+
+import psycopg2
+
+from config.settings import APP_CONFIG
+
+DATABASE_URL = APP_CONFIG['data']['database_url']
+CHANNEL = 'dashboard_cache_invalidation'
+
+# トピック一覧
+TOPIC_MASTER_DATA = 'master_data' # 参考書マスター・プリセット (キーなし)
+TOPIC_STUDENT = 'student'         # 生徒情報の追加・編集・削除 (キー: student_id)
+TOPIC_PROGRESS = 'progress'       # 進捗の更新 (キー: student_id)
+TOPIC_HOMEWORK = 'homework'       # 宿題の保存・削除 (キー: student_id)
+
+_handlers = {} # トピック -> ハンドラーのリスト
+_handlers_lock = threading.Lock()
+
+
+def subscribe(topic, handler):
+    """
+    トピックの無効化ハンドラーを登録する。
+    handler(key) の key が None の場合は、そのトピックに関する全項目を破棄すること。
+    """
+    with _handlers_lock:
+        _handlers.setdefault(topic, []).append(handler)
+
+
+def dispatch(topic, key=None):
+    """このプロセス内で登録済みのハンドラーを呼び出す"""
+    with _handlers_lock:
+        handlers = list(_handlers.get(topic, []))
+    for handler in handlers:
+        try:
+            handler(key)
+        except Exception as e:
+            print(f"キャッシュ無効化ハンドラーでエラーが発生しました ({topic}, {key}): {e}")
+
+
+def dispatch_all():
+    """全トピックの全項目を破棄する (通知を取りこぼした可能性がある場合に使用)"""
+    with _handlers_lock:
+        topics = list(_handlers)
+    for topic in topics:
+        dispatch(topic)
+
+
+def notify(conn, topic, key=None):
+    """
+    書き込みトランザクション内で呼び出す。通知はコミット時に配信され、ロールバック時は破棄される。
+    呼び出し側のカーソルの rowcount を変えないよう、別カーソルで送信する。
+    """
+    payload = json.dumps({'topic': topic, 'key': key})
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_notify(%s, %s)", (CHANNEL, payload))
+
+
+class InvalidationListener(threading.Thread):
+    """専用接続で LISTEN し、受け取った通知をハンドラーへ振り分けるバックグラウンドスレッド"""
+
+    def __init__(self, dsn, poll_interval=5.0, retry_interval=5.0):
+        super().__init__(name='cache-invalidation-listener', daemon=True)
+        self.dsn = dsn
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {CHANNEL}")
+                # 切断中に届いた通知は受け取れないため、(再)接続のたびにキャッシュ全体を破棄する
+                dispatch_all()
+                self._listen(conn)
+            except psycopg2.Error as e:
+                print(f"キャッシュ無効化リスナーの接続エラー: {e}")
+                self._stop_event.wait(self.retry_interval)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def _listen(self, conn):
+        while not self._stop_event.is_set():
+            readable, _, _ = select.select([conn], [], [], self.poll_interval)
+            if not readable:
+                continue
+            conn.poll()
+            while conn.notifies:
+                notification = conn.notifies.pop(0)
+                try:
+                    message = json.loads(notification.payload)
+                except ValueError:
+                    print(f"不正なキャッシュ無効化通知を無視しました: {notification.payload}")
+                    continue
+                dispatch(message.get('topic'), message.get('key'))
+
+
+_listener = None
+
+
+def start_listener():
+    """このプロセスのリスナースレッドを起動する (起動済みなら何もしない)"""
+    global _listener
+    if not APP_CONFIG['cache']['invalidation_listener']:
+        return None
+    if _listener is None or not _listener.is_alive():
+        _listener = InvalidationListener(DATABASE_URL)
+        _listener.start()
+    return _listener
+
+
+def _restart_listener_after_fork():
+    # スレッドはforkで子プロセスへ引き継がれないため、親で起動済みなら子でも起動し直す
+    global _listener
+    if _listener is not None:
+        _listener = None
+        start_listener()
+
+
+os.register_at_fork(after_in_child=_restart_listener_after_fork)
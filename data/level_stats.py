@@ -0,0 +1,97 @@
+# data/level_stats.py
+
+"""
+レベル達成人数の集計テーブル (level_achievement_stats) の維持
+
+統計ページは (校舎, 学年, 科目, レベル) ごとの「そのレベルの参考書を1冊以上達成した生徒数」を表示する。
+毎回 progress 全体を集計すると生徒数に比例して遅くなるため、集計結果をテーブルに保持し、
+進捗の UPSERT や生徒の学年・校舎の変更と同じトランザクション内で増減させる。
+
+- 同じ生徒の書き込みは students の行ロック (FOR UPDATE) で直列化し、変更前後の達成集合の差分だけを反映する
+- マスターのレベル・科目の変更や削除は多くの生徒に影響するため、全体を再集計する
+- 値がずれた場合は rebuild_level_stats.py で再集計できる
+学年が未設定の生徒は grade = '' として集計する (主キーに NULL を含められないため)。
+"""
+
+from psycopg2.extras import execute_values
+
+# 統計ページで集計するレベル
+ACHIEVEMENT_LEVELS = ('日大', 'MARCH', '早慶')
+
+# 集計テーブルへの書き込みと再集計を直列化するためのロック
+# (再集計中に差分が反映されると二重に数えられるため、再集計は EXCLUSIVE でテーブルをロックする)
+_REBUILD_LOCK_SQL = "LOCK TABLE level_achievement_stats IN EXCLUSIVE MODE"
+
+_ACHIEVEMENTS_SQL = """
+    SELECT DISTINCT COALESCE(m.subject, p.subject), COALESCE(m.level, p.level)
+    FROM progress p
+    LEFT JOIN master_textbooks m ON p.master_textbook_id = m.id
+    WHERE p.student_id = %s AND p.is_done = true
+      AND COALESCE(m.level, p.level) IN %s
+"""
+
+
+def lock_student(cur, student_id):
+    """
+    生徒の行をロックし、(校舎, 学年) を返す。生徒が存在しなければ None。
+    同じ生徒の進捗・生徒情報の書き込みを直列化し、達成集合の差分を正しく取るために使う。
+    """
+    cur.execute("SELECT school, COALESCE(grade, '') FROM students WHERE id = %s FOR UPDATE", (student_id,))
+    row = cur.fetchone()
+    return (row[0], row[1]) if row else None
+
+
+def get_student_achievements(cur, student_id):
+    """生徒が達成済みの (科目, レベル) の集合を返す"""
+    cur.execute(_ACHIEVEMENTS_SQL, (student_id, ACHIEVEMENT_LEVELS))
+    return {(row[0], row[1]) for row in cur.fetchall()}
+
+
+def apply_achievement_delta(cur, school, grade, removed=(), added=()):
+    """(校舎, 学年) の集計から removed の (科目, レベル) を1減らし、added を1増やす"""
+    deltas = [(school, grade or '', subject, level, -1) for subject, level in removed]
+    deltas += [(school, grade or '', subject, level, 1) for subject, level in added]
+    if not deltas:
+        return
+    execute_values(
+        cur,
+        """
+        INSERT INTO level_achievement_stats (school, grade, subject, level, student_count)
+        VALUES %s
+        ON CONFLICT (school, grade, subject, level) DO UPDATE SET
+            student_count = level_achievement_stats.student_count + EXCLUDED.student_count
+        """,
+        deltas
+    )
+    cur.execute(
+        "DELETE FROM level_achievement_stats WHERE school = %s AND grade = %s AND student_count <= 0",
+        (school, grade or '')
+    )
+
+
+def rebuild_level_achievement_stats(conn):
+    """
+    集計テーブルを progress から作り直す (コミットは呼び出し側で行う)。
+    再集計後の行数を返す。
+    """
+    with conn.cursor() as cur:
+        cur.execute(_REBUILD_LOCK_SQL)
+        cur.execute("DELETE FROM level_achievement_stats")
+        cur.execute(
+            """
+            INSERT INTO level_achievement_stats (school, grade, subject, level, student_count)
+            SELECT s.school, COALESCE(s.grade, ''), a.subject, a.level, COUNT(*)
+            FROM (
+                SELECT DISTINCT p.student_id,
+                       COALESCE(m.subject, p.subject) AS subject,
+                       COALESCE(m.level, p.level) AS level
+                FROM progress p
+                LEFT JOIN master_textbooks m ON p.master_textbook_id = m.id
+                WHERE p.is_done = true AND COALESCE(m.level, p.level) IN %s
+            ) a
+            JOIN students s ON s.id = a.student_id
+            GROUP BY s.school, COALESCE(s.grade, ''), a.subject, a.level
+            """,
+            (ACHIEVEMENT_LEVELS,)
+        )
+        return cur.rowcount
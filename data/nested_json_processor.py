@@ -5,18 +5,37 @@ from psycopg2.extras import DictCursor, execute_values
 import os
 import json
 import uuid
-import pandas as pd
+import hashlib
 from datetime import datetime, timedelta, date # date をインポート
 from config.settings import APP_CONFIG
-import psycopg2
-from psycopg2.extras import DictCursor, execute_values
-
-DATABASE_URL = APP_CONFIG['data']['database_url']
-
-def get_db_connection():
-    """PostgreSQLデータベース接続を取得します。"""
-    conn = psycopg2.connect(DATABASE_URL)
-    return conn
+from data.db_pool import get_db_connection, db_connection # 接続はプロセス共有のプールから借りる
+from data.cache import TTLCache, cached
+from data.instrumentation import instrument_module_functions
+from data.level_stats import (
+    lock_student, get_student_achievements, apply_achievement_delta, rebuild_level_achievement_stats,
+    ACHIEVEMENT_LEVELS
+)
+from data.invalidation import (
+    notify, dispatch, subscribe,
+    TOPIC_MASTER_DATA, TOPIC_STUDENT, TOPIC_PROGRESS, TOPIC_HOMEWORK
+)
+
+# 科目・参考書マスター・プリセットは更新が月に数回程度のため、ワーカー内にキャッシュする
+MASTER_DATA_CACHE = TTLCache('master_data', APP_CONFIG['cache']['master_data_ttl'])
+subscribe(TOPIC_MASTER_DATA, lambda key: MASTER_DATA_CACHE.invalidate())
+
+# 生徒ごとの進捗 (偏差値による所要時間の調整済み)。タブ切替や学習計画モーダルで同じ生徒を繰り返し読むためキャッシュする
+PROGRESS_CACHE = TTLCache(
+    'student_progress', APP_CONFIG['cache']['progress_cache_ttl'],
+    max_size=APP_CONFIG['cache']['progress_cache_size']
+)
+
+def _invalidate_student_progress(key):
+    PROGRESS_CACHE.invalidate(int(key) if key is not None else None)
+
+subscribe(TOPIC_PROGRESS, _invalidate_student_progress)
+subscribe(TOPIC_STUDENT, _invalidate_student_progress) # 偏差値の変更・生徒の削除
+subscribe(TOPIC_MASTER_DATA, lambda key: PROGRESS_CACHE.invalidate()) # マスターの名称・所要時間の変更
 
 # --- (既存の関数は省略) ---
 
@@ -73,10 +92,9 @@ def get_students_for_user(user_info):
     if not user_info:
         return []
 
-    conn = get_db_connection()
     students_cursor = []
 
-    with conn.cursor(cursor_factory=DictCursor) as cur:
+    with db_connection() as conn, conn.cursor(cursor_factory=DictCursor) as cur:
         if user_info.get('role') == 'admin':
             user_school = user_info.get('school')
             if user_school:
@@ -96,36 +114,33 @@ def get_students_for_user(user_info):
                     ORDER BY s.name
                 ''', (user_id,))
                 students_cursor = cur.fetchall()
-    conn.close()
 
     return [dict(row) for row in students_cursor]
 
 
 def get_student_progress(school, student_name):
-    conn = get_db_connection()
-    with conn.cursor(cursor_factory=DictCursor) as cur:
+    with db_connection() as conn, conn.cursor(cursor_factory=DictCursor) as cur:
         cur.execute('SELECT id FROM students WHERE name = %s AND school = %s', (student_name, school))
         student = cur.fetchone()
         if student is None:
-            conn.close()
             return {}
         student_id = student['id']
 
         cur.execute(
             """
             SELECT
-                p.subject, p.level, p.book_name,
+                COALESCE(m.subject, p.subject) AS subject, COALESCE(m.level, p.level) AS level,
+                COALESCE(m.book_name, p.book_name) AS book_name,
                 COALESCE(p.duration, m.duration, 0) as duration,
                 p.is_planned, p.is_done,
                 COALESCE(p.completed_units, 0) as completed_units,
                 COALESCE(p.total_units, 1) as total_units
             FROM progress p
-            LEFT JOIN master_textbooks m ON p.book_name = m.book_name AND p.subject = m.subject AND p.level = m.level
+            LEFT JOIN master_textbooks m ON p.master_textbook_id = m.id
             WHERE p.student_id = %s
             """, (student_id,)
         )
         progress_records = cur.fetchall()
-    conn.close()
     progress_data = {}
     for row in progress_records:
         subject, level, book_name = row['subject'], row['level'], row['book_name']
@@ -142,6 +157,13 @@ def get_student_progress(school, student_name):
         }
     return progress_data
 
+def _build_student_info(student, instructors):
+    """生徒行と担当講師行から生徒情報の辞書を組み立てる"""
+    student_info = dict(student)
+    student_info['main_instructors'] = [i['username'] for i in instructors if i['is_main'] == 1]
+    student_info['sub_instructors'] = [i['username'] for i in instructors if i['is_main'] == 0]
+    return student_info
+
 def get_student_info_by_id(student_id):
     """生徒IDに基づいて生徒情報（追加項目含む）を取得する"""
     conn = get_db_connection()
@@ -169,24 +191,55 @@ def get_student_info_by_id(student_id):
         if conn:
             conn.close()
 
-    student_info = dict(student)
-    student_info['main_instructors'] = [i['username'] for i in instructors if i['is_main'] == 1]
-    student_info['sub_instructors'] = [i['username'] for i in instructors if i['is_main'] == 0]
+    return _build_student_info(student, instructors)
 
-    return student_info
+LEVEL_DEVIATION_MAP = {
+    '基礎徹底': 50,
+    '日大': 60,
+    'MARCH': 70,
+    '早慶': 75
+}
+
+def _build_progress_data(progress_records, student_deviation):
+    """進捗行を 科目 > レベル > 参考書 の辞書にまとめ、偏差値に応じて所要時間を調整する"""
+    progress_data = {}
+    for row in progress_records:
+        subject, level, book_name = row['subject'], row['level'], row['book_name']
+        base_duration = row['base_duration'] # 元の所要時間
+
+        adjusted_duration = base_duration # デフォルトは元の値
+        if student_deviation is not None and level in LEVEL_DEVIATION_MAP:
+            level_deviation = LEVEL_DEVIATION_MAP[level]
+            # 計算式を適用
+            factor = ((level_deviation - student_deviation) * 0.025 + 1)
+            adjusted_duration = factor * base_duration
+            # 結果が負にならないように調整
+            adjusted_duration = max(0, adjusted_duration)
+
+        if subject not in progress_data:
+            progress_data[subject] = {}
+        if level not in progress_data[subject]:
+            progress_data[subject][level] = {}
+
+        progress_data[subject][level][book_name] = {
+            '所要時間': adjusted_duration, # 計算後の値を入れる
+            '予定': bool(row['is_planned']),
+            '達成済': bool(row['is_done']),
+            'completed_units': row['completed_units'],
+            'total_units': row['total_units']
+        }
+    return progress_data
 
 def get_student_progress_by_id(student_id):
-    """生徒IDに基づいて生徒の進捗データを取得し、偏差値に応じて所要時間を調整する"""
+    """生徒IDに基づいて生徒の進捗データを取得し、偏差値に応じて所要時間を調整する (生徒ごとにキャッシュ)"""
+    if not student_id:
+        return {}
+    return PROGRESS_CACHE.get_or_load(int(student_id), lambda: _load_student_progress_by_id(student_id))
+
+def _load_student_progress_by_id(student_id):
     student_info = get_student_info_by_id(student_id)
     student_deviation = student_info.get('deviation_value')
 
-    level_deviation_map = {
-        '基礎徹底': 50,
-        '日大': 60,
-        'MARCH': 70,
-        '早慶': 75
-    }
-
     conn = get_db_connection()
     progress_records = [] # progress_records を空リストで初期化
     try:
@@ -195,13 +248,15 @@ def get_student_progress_by_id(student_id):
             cur.execute(
                 """
                 SELECT
-                    p.subject, p.level, p.book_name,
+                    -- マスターの参考書は現在のマスターの名称・レベルで返す (名称変更後も進捗が対応付く)
+                    COALESCE(m.subject, p.subject) AS subject, COALESCE(m.level, p.level) AS level,
+                    COALESCE(m.book_name, p.book_name) AS book_name,
                     COALESCE(p.duration, m.duration, 0) as base_duration, -- 元のdurationをbase_durationとして取得
                     p.is_planned, p.is_done,
                     COALESCE(p.completed_units, 0) as completed_units,
                     COALESCE(p.total_units, 1) as total_units
                 FROM progress p
-                LEFT JOIN master_textbooks m ON p.book_name = m.book_name AND p.subject = m.subject AND p.level = m.level
+                LEFT JOIN master_textbooks m ON p.master_textbook_id = m.id
                 WHERE p.student_id = %s
                 """, (student_id,)
             )
@@ -213,33 +268,101 @@ def get_student_progress_by_id(student_id):
         if conn:
             conn.close()
 
-    progress_data = {}
-    for row in progress_records:
-        subject, level, book_name = row['subject'], row['level'], row['book_name']
-        base_duration = row['base_duration'] # 元の所要時間
+    return _build_progress_data(progress_records, student_deviation)
+
+# get_student_dashboard_snapshot の進捗列 (行は _build_progress_data の入力と同じ形)
+_SNAPSHOT_PROGRESS_SQL = """
+    COALESCE((
+        SELECT json_agg(json_build_object(
+            'subject', COALESCE(m.subject, p.subject), 'level', COALESCE(m.level, p.level),
+            'book_name', COALESCE(m.book_name, p.book_name),
+            'base_duration', COALESCE(p.duration, m.duration, 0),
+            'is_planned', p.is_planned, 'is_done', p.is_done,
+            'completed_units', COALESCE(p.completed_units, 0),
+            'total_units', COALESCE(p.total_units, 1)
+        ))
+        FROM progress p
+        LEFT JOIN master_textbooks m ON p.master_textbook_id = m.id
+        WHERE p.student_id = s.id
+    ), '[]'::json)
+"""
+
+def get_student_dashboard_snapshot(student_id):
+    """
+    ダッシュボード表示に必要な生徒情報・担当講師・進捗・過去問合計時間・英検結果を、
+    1つの接続・1つのREPEATABLE READトランザクション内の1クエリでまとめて取得する。
+    生徒が存在しない場合やエラー時は空の辞書を返す。
+    """
+    row = None
+    # 進捗がキャッシュ済みならクエリから進捗の集約を省く
+    progress_generation = PROGRESS_CACHE.generation
+    cached_progress = PROGRESS_CACHE.get(int(student_id)) if student_id else None
+    progress_sql = "NULL::json" if cached_progress is not None else _SNAPSHOT_PROGRESS_SQL
+    try:
+        with db_connection() as conn:
+            with conn.cursor(cursor_factory=DictCursor) as cur:
+                # 借りた接続でトランザクションが未開始の場合のみ分離レベルを指定できる
+                if conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+                cur.execute(
+                    f"""
+                    SELECT
+                        s.id, s.name, s.school, s.deviation_value, s.target_level, s.grade, s.previous_school,
+                        COALESCE((
+                            SELECT json_agg(json_build_object('username', u.username, 'is_main', si.is_main))
+                            FROM student_instructors si
+                            JOIN users u ON si.user_id = u.id
+                            WHERE si.student_id = s.id
+                        ), '[]'::json) AS instructors,
+                        {progress_sql} AS progress,
+                        (
+                            SELECT COALESCE(SUM(per.time_required), 0)
+                            FROM past_exam_results per
+                            WHERE per.student_id = s.id AND per.time_required IS NOT NULL
+                        ) AS past_exam_minutes,
+                        COALESCE((
+                            SELECT json_agg(json_build_object(
+                                'id', e.id, 'student_id', e.student_id, 'grade', e.grade,
+                                'cse_score', e.cse_score, 'exam_date', e.exam_date, 'result', e.result
+                            ) ORDER BY e.grade)
+                            FROM eiken_results e
+                            WHERE e.student_id = s.id
+                        ), '[]'::json) AS eiken_results
+                    FROM students s
+                    WHERE s.id = %s
+                    """,
+                    (student_id,)
+                )
+                row = cur.fetchone()
+    except psycopg2.Error as e:
+        print(f"データベースエラー (get_student_dashboard_snapshot): {e}")
+        return {}
 
-        adjusted_duration = base_duration # デフォルトは元の値
-        if student_deviation is not None and level in level_deviation_map:
-            level_deviation = level_deviation_map[level]
-            # 計算式を適用
-            factor = ((level_deviation - student_deviation) * 0.025 + 1)
-            adjusted_duration = factor * base_duration
-            # 結果が負にならないように調整
-            adjusted_duration = max(0, adjusted_duration)
+    if not row:
+        return {}
 
-        if subject not in progress_data:
-            progress_data[subject] = {}
-        if level not in progress_data[subject]:
-            progress_data[subject][level] = {}
+    student_columns = ['id', 'name', 'school', 'deviation_value', 'target_level', 'grade', 'previous_school']
+    student_info = _build_student_info({col: row[col] for col in student_columns}, row['instructors'])
 
-        progress_data[subject][level][book_name] = {
-            '所要時間': adjusted_duration, # 計算後の値を入れる
-            '予定': bool(row['is_planned']),
-            '達成済': bool(row['is_done']),
-            'completed_units': row['completed_units'],
-            'total_units': row['total_units']
-        }
-    return progress_data
+    # JSONで受け取った日付を get_eiken_results_for_student と同じ date 型に揃える
+    eiken_results = row['eiken_results']
+    for result in eiken_results:
+        if result.get('exam_date'):
+            result['exam_date'] = date.fromisoformat(result['exam_date'])
+
+    if cached_progress is not None:
+        progress = cached_progress
+    else:
+        progress = _build_progress_data(row['progress'], student_info.get('deviation_value'))
+        # 読み込み中に進捗が更新されていなければ、以降のタブ切替・学習計画モーダル用にキャッシュする
+        PROGRESS_CACHE.set(int(student_id), progress, progress_generation)
+
+    return {
+        'info': student_info,
+        'progress': progress,
+        'past_exam_hours': row['past_exam_minutes'] / 60.0, # 時間単位
+        'eiken_results': eiken_results,
+    }
 
 def get_student_info(school, student_name):
     conn = get_db_connection()
@@ -284,16 +407,25 @@ def get_assigned_students_for_user(user_id):
     return [dict(row) for row in students]
 
 def get_master_textbook_list(subject, search_term=""):
+    """科目の参考書名をレベルごとにまとめて返す。search_term を指定すると参考書名の部分一致で絞り込む。"""
+    textbooks_by_level = _get_master_textbooks_by_level(subject)
+    if not search_term:
+        return textbooks_by_level
+    # 検索語ごとにキャッシュを分けず、キャッシュ済みの一覧を絞り込む
+    filtered = {}
+    for level, book_names in textbooks_by_level.items():
+        matched = [b for b in book_names if search_term in b]
+        if matched:
+            filtered[level] = matched
+    return filtered
+
+@cached(MASTER_DATA_CACHE)
+def _get_master_textbooks_by_level(subject):
     conn = get_db_connection()
     records = [] # records を空リストで初期化
     try:
         with conn.cursor(cursor_factory=DictCursor) as cur:
-            query = "SELECT level, book_name FROM master_textbooks WHERE subject = %s"
-            params = [subject]
-            if search_term:
-                query += " AND book_name LIKE %s"
-                params.append(f"%{search_term}%")
-            cur.execute(query, tuple(params))
+            cur.execute("SELECT level, book_name FROM master_textbooks WHERE subject = %s", (subject,))
             records = cur.fetchall()
     except psycopg2.Error as e:
          print(f"データベースエラー (get_master_textbook_list): {e}")
@@ -325,6 +457,10 @@ def add_or_update_student_progress(student_id, progress_updates):
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
+            # レベル達成人数の集計を差分で更新するため、変更前の達成状況を取得しておく
+            student = lock_student(cur, student_id)
+            achievements_before = get_student_achievements(cur, student_id) if student else set()
+
             # UPSERT用のデータリストを作成
             data_to_upsert = []
             for update in progress_updates:
@@ -353,24 +489,61 @@ def add_or_update_student_progress(student_id, progress_updates):
                     max(1, update.get('total_units', 1)) # total_unitsが0以下にならないように
                 ))
 
-            # INSERT ... ON CONFLICT を使ったUPSERTクエリ
-            upsert_query = """
-                INSERT INTO progress (
-                    student_id, subject, level, book_name, duration,
-                    is_planned, is_done, completed_units, total_units
-                ) VALUES %s
-                ON CONFLICT (student_id, subject, level, book_name) DO UPDATE SET
+            if data_to_upsert:
+                # マスターにある参考書は master_textbook_id を、カスタム参考書は文字列キーを衝突キーにしてUPSERTする。
+                # master_textbook_id は (科目, レベル, 参考書名) からマスターを引いて解決する。
+                values_sql = """
+                    FROM (VALUES %s) AS v(student_id, subject, level, book_name, duration,
+                                          is_planned, is_done, completed_units, total_units)
+                    LEFT JOIN master_textbooks m
+                        ON m.subject = v.subject AND m.level = v.level AND m.book_name = v.book_name
+                """
+                values_template = "(%s, %s, %s, %s, %s::real, %s::boolean, %s::boolean, %s::integer, %s::integer)"
+                update_sql = """
                     duration = COALESCE(EXCLUDED.duration, progress.duration), -- duration が None で渡された場合は既存の値を維持
                     is_planned = EXCLUDED.is_planned,
                     is_done = EXCLUDED.is_done,
                     completed_units = EXCLUDED.completed_units,
-                    total_units = EXCLUDED.total_units;
-            """
-
-            if data_to_upsert:
-                execute_values(cur, upsert_query, data_to_upsert)
+                    total_units = EXCLUDED.total_units
+                """
+                execute_values(cur, f"""
+                    INSERT INTO progress (
+                        student_id, master_textbook_id, subject, level, book_name, duration,
+                        is_planned, is_done, completed_units, total_units
+                    )
+                    SELECT v.student_id, m.id, v.subject, v.level, v.book_name, v.duration,
+                           v.is_planned, v.is_done, v.completed_units, v.total_units
+                    {values_sql}
+                    WHERE m.id IS NOT NULL
+                    ON CONFLICT (student_id, master_textbook_id) DO UPDATE SET
+                        -- マスター変更前の名称で保存されていた行は現在の名称に揃える
+                        subject = EXCLUDED.subject, level = EXCLUDED.level, book_name = EXCLUDED.book_name,
+                        {update_sql}
+                """, data_to_upsert, template=values_template)
+                execute_values(cur, f"""
+                    INSERT INTO progress (
+                        student_id, subject, level, book_name, duration,
+                        is_planned, is_done, completed_units, total_units
+                    )
+                    SELECT v.student_id, v.subject, v.level, v.book_name, v.duration,
+                           v.is_planned, v.is_done, v.completed_units, v.total_units
+                    {values_sql}
+                    WHERE m.id IS NULL
+                    ON CONFLICT (student_id, subject, level, book_name) WHERE master_textbook_id IS NULL DO UPDATE SET
+                        {update_sql}
+                """, data_to_upsert, template=values_template)
+
+            if student:
+                achievements_after = get_student_achievements(cur, student_id)
+                apply_achievement_delta(
+                    cur, *student,
+                    removed=achievements_before - achievements_after,
+                    added=achievements_after - achievements_before
+                )
 
+        notify(conn, TOPIC_PROGRESS, student_id)
         conn.commit()
+        dispatch(TOPIC_PROGRESS, student_id)
         return True, f"{len(progress_updates)}件の進捗を更新しました。"
     except (Exception, psycopg2.Error) as e:
         print(f"進捗の一括更新エラー: {e}")
@@ -380,6 +553,7 @@ def add_or_update_student_progress(student_id, progress_updates):
         if conn:
             conn.close()
 
+@cached(MASTER_DATA_CACHE)
 def get_all_subjects():
     """データベースからすべての科目を指定された順序で取得する"""
     conn = get_db_connection()
@@ -415,7 +589,12 @@ def get_subjects_for_student(student_id):
     try:
         with conn.cursor(cursor_factory=DictCursor) as cur:
             cur.execute(
-                'SELECT DISTINCT subject FROM progress WHERE student_id = %s AND is_planned = true',
+                '''
+                SELECT DISTINCT COALESCE(m.subject, p.subject) AS subject
+                FROM progress p
+                LEFT JOIN master_textbooks m ON p.master_textbook_id = m.id
+                WHERE p.student_id = %s AND p.is_planned = true
+                ''',
                 (student_id,)
             )
             subjects_raw = cur.fetchall()
@@ -559,7 +738,9 @@ def add_or_update_homework(student_id, subject, textbook_id, custom_textbook_nam
                     """,
                     tasks_to_add
                 )
+        notify(conn, TOPIC_HOMEWORK, student_id)
         conn.commit()
+        dispatch(TOPIC_HOMEWORK, student_id)
         return True, "宿題を保存しました。"
     except (Exception, psycopg2.Error) as e:
         print(f"宿題の保存エラー: {e}")
@@ -569,6 +750,7 @@ def add_or_update_homework(student_id, subject, textbook_id, custom_textbook_nam
         if conn:
             conn.close()
 
+@cached(MASTER_DATA_CACHE)
 def get_bulk_presets():
     conn = get_db_connection()
     presets_raw = [] # 初期化
@@ -576,9 +758,10 @@ def get_bulk_presets():
         with conn.cursor(cursor_factory=DictCursor) as cur:
             cur.execute("""
                 SELECT
-                    p.id, p.subject, p.preset_name, pb.book_name
+                    p.id, p.subject, p.preset_name, COALESCE(m.book_name, pb.book_name) AS book_name
                 FROM bulk_presets p
                 JOIN bulk_preset_books pb ON p.id = pb.preset_id
+                LEFT JOIN master_textbooks m ON pb.master_textbook_id = m.id
                 ORDER BY p.subject, p.preset_name, pb.id -- 書籍の順序も安定させるために pb.id を追加
             """)
             presets_raw = cur.fetchall()
@@ -602,6 +785,7 @@ def get_bulk_presets():
         presets[subject][preset_name].append(book_name)
     return presets
 
+@cached(MASTER_DATA_CACHE)
 def get_all_master_textbooks():
     conn = get_db_connection()
     textbooks = [] # 初期化
@@ -616,15 +800,38 @@ def get_all_master_textbooks():
             conn.close()
     return [dict(row) for row in textbooks]
 
+def _link_custom_progress_to_master(conn, book_id):
+    """
+    マスターと同じ科目・レベル・名称で登録済みのカスタム参考書の進捗を、そのマスターに紐付ける。
+    呼び出し側のカーソルの rowcount を変えないよう、別カーソルで実行する。
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE progress p
+            SET master_textbook_id = m.id
+            FROM master_textbooks m
+            WHERE m.id = %s AND p.master_textbook_id IS NULL
+              AND p.subject = m.subject AND p.level = m.level AND p.book_name = m.book_name
+              AND NOT EXISTS (
+                  SELECT 1 FROM progress p2 WHERE p2.student_id = p.student_id AND p2.master_textbook_id = m.id
+              )
+            """,
+            (book_id,)
+        )
+
 def add_master_textbook(subject, level, book_name, duration):
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
             cur.execute(
-                "INSERT INTO master_textbooks (subject, level, book_name, duration) VALUES (%s, %s, %s, %s)",
+                "INSERT INTO master_textbooks (subject, level, book_name, duration) VALUES (%s, %s, %s, %s) RETURNING id",
                 (subject, level, book_name, duration)
             )
+            _link_custom_progress_to_master(conn, cur.fetchone()[0])
+        notify(conn, TOPIC_MASTER_DATA)
         conn.commit()
+        dispatch(TOPIC_MASTER_DATA)
         return True, "参考書が正常に追加されました。"
     except psycopg2.IntegrityError: # UNIQUE制約違反
         conn.rollback()
@@ -641,14 +848,23 @@ def update_master_textbook(book_id, subject, level, book_name, duration):
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
+            cur.execute("SELECT subject, level FROM master_textbooks WHERE id = %s FOR UPDATE", (book_id,))
+            old = cur.fetchone()
+            if old is None:
+                return False, "指定されたIDの参考書が見つかりません。"
             cur.execute(
                 "UPDATE master_textbooks SET subject = %s, level = %s, book_name = %s, duration = %s WHERE id = %s",
                 (subject, level, book_name, duration, book_id)
             )
+            # 紐付け済みの進捗・プリセットは master_textbook_id で結合するため書き換え不要
+            # (新たに紐付く進捗は科目・レベルが同じため、集計は変わらない)
+            _link_custom_progress_to_master(conn, book_id)
+            # レベル・科目が変わると多くの生徒の達成状況が変わるため、集計は作り直す
+            if (old[0], old[1]) != (subject, level):
+                rebuild_level_achievement_stats(conn)
+        notify(conn, TOPIC_MASTER_DATA)
         conn.commit()
-        # 更新された行数をチェック
-        if cur.rowcount == 0:
-             return False, "指定されたIDの参考書が見つかりません。"
+        dispatch(TOPIC_MASTER_DATA)
         return True, "参考書が正常に更新されました。"
     except psycopg2.IntegrityError: # UNIQUE制約違反
         conn.rollback()
@@ -661,18 +877,75 @@ def update_master_textbook(book_id, subject, level, book_name, duration):
         if conn:
             conn.close()
 
+def _detach_progress_from_master(conn, book_id):
+    """
+    マスターの削除前に、紐付いた進捗・プリセットをカスタム参考書として残せる状態にする。
+    削除で master_textbook_id が NULL になると文字列キー (科目・レベル・参考書名) で一意性を判定するため、
+    - マスターの現在の名称と同じカスタム参考書の進捗は、紐付いた進捗に統合して削除する
+      (進んでいる方の進捗を残す)
+    - 紐付いた進捗・プリセットの文字列列をマスターの現在の値に揃える (名称変更前の値のまま残っていることがある)
+    呼び出し側のカーソルの rowcount を変えないよう、別カーソルで実行する。
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            WITH merged AS (
+                DELETE FROM progress c
+                USING progress p, master_textbooks m
+                WHERE m.id = %(book_id)s AND p.master_textbook_id = m.id
+                  AND c.student_id = p.student_id AND c.master_textbook_id IS NULL
+                  AND c.subject = m.subject AND c.level = m.level AND c.book_name = m.book_name
+                RETURNING c.student_id, c.duration, c.is_planned, c.is_done, c.completed_units, c.total_units
+            )
+            UPDATE progress p
+            SET duration = COALESCE(c.duration, p.duration), is_planned = c.is_planned, is_done = c.is_done,
+                completed_units = c.completed_units, total_units = c.total_units
+            FROM merged c
+            WHERE p.master_textbook_id = %(book_id)s AND p.student_id = c.student_id
+              AND (c.is_done, c.completed_units::real / c.total_units)
+                  > (p.is_done, p.completed_units::real / p.total_units)
+            """,
+            {'book_id': book_id}
+        )
+        cur.execute(
+            """
+            UPDATE progress p
+            SET subject = m.subject, level = m.level, book_name = m.book_name
+            FROM master_textbooks m
+            WHERE m.id = %s AND p.master_textbook_id = m.id
+            """,
+            (book_id,)
+        )
+        cur.execute(
+            """
+            UPDATE bulk_preset_books pb
+            SET book_name = m.book_name
+            FROM master_textbooks m
+            WHERE m.id = %s AND pb.master_textbook_id = m.id
+            """,
+            (book_id,)
+        )
+
 def delete_master_textbook(book_id):
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM master_textbooks WHERE id = %s FOR UPDATE", (book_id,))
+            if cur.fetchone() is None:
+                return False, "指定されたIDの参考書が見つかりません。"
+            cur.execute("SELECT EXISTS (SELECT 1 FROM progress WHERE master_textbook_id = %s)", (book_id,))
+            has_linked_progress = cur.fetchone()[0]
             # 関連する homework レコードの master_textbook_id を NULL に設定
             cur.execute("UPDATE homework SET master_textbook_id = NULL WHERE master_textbook_id = %s", (book_id,))
+            _detach_progress_from_master(conn, book_id)
             # master_textbooks から削除
             cur.execute("DELETE FROM master_textbooks WHERE id = %s", (book_id,))
+            # 紐付いていた進捗は保存済みの科目・レベルで集計されるようになるため作り直す
+            if has_linked_progress:
+                rebuild_level_achievement_stats(conn)
+        notify(conn, TOPIC_MASTER_DATA)
         conn.commit()
-        # 削除された行数をチェック
-        if cur.rowcount == 0:
-            return False, "指定されたIDの参考書が見つかりません。"
+        dispatch(TOPIC_MASTER_DATA)
         return True, "参考書が正常に削除されました。閉じるボタンを押してください。"
     except psycopg2.Error as e:
         conn.rollback()
@@ -752,7 +1025,9 @@ def add_student(name, school, deviation_value, target_level, grade, previous_sch
                      "INSERT INTO student_instructors (student_id, user_id, is_main) VALUES %s",
                      instructors_to_insert
                  )
+        notify(conn, TOPIC_STUDENT, student_id)
         conn.commit()
+        dispatch(TOPIC_STUDENT, student_id)
         return True, "生徒が正常に追加されました。"
     except psycopg2.IntegrityError as e: # UNIQUE制約違反など
         conn.rollback()
@@ -773,6 +1048,14 @@ def update_student(student_id, name, deviation_value, target_level, grade, previ
     """生徒情報を更新（追加項目含む）"""
     conn = get_db_connection()
     try:
+        with conn.cursor() as stats_cur:
+            # 学年が変わる場合はレベル達成人数の集計を新しい学年へ移す
+            student = lock_student(stats_cur, student_id)
+            if student and student[1] != (grade or ''):
+                achievements = get_student_achievements(stats_cur, student_id)
+                apply_achievement_delta(stats_cur, *student, removed=achievements)
+                apply_achievement_delta(stats_cur, student[0], grade, added=achievements)
+
         with conn.cursor() as cur:
             # 生徒情報の更新
             dev_val = int(deviation_value) if deviation_value is not None and str(deviation_value).strip() != '' else None
@@ -802,7 +1085,9 @@ def update_student(student_id, name, deviation_value, target_level, grade, previ
                      instructors_to_insert
                  )
 
+        notify(conn, TOPIC_STUDENT, student_id)
         conn.commit()
+        dispatch(TOPIC_STUDENT, student_id)
         if cur.rowcount == 0:
              return False, "指定されたIDの生徒が見つかりません。"
         return True, "生徒情報が正常に更新されました。"
@@ -824,6 +1109,12 @@ def update_student(student_id, name, deviation_value, target_level, grade, previ
 def delete_student(student_id):
     conn = get_db_connection()
     try:
+        with conn.cursor() as stats_cur:
+            # 削除される生徒の達成分をレベル達成人数の集計から差し引く
+            student = lock_student(stats_cur, student_id)
+            if student:
+                apply_achievement_delta(stats_cur, *student, removed=get_student_achievements(stats_cur, student_id))
+
         with conn.cursor() as cur:
             # 外部キー制約 (ON DELETE CASCADE) により、関連データも自動削除されるはず
             # 明示的に削除する場合は以下のコメントアウトを外す
@@ -836,7 +1127,9 @@ def delete_student(student_id):
 
             # students テーブルから削除
             cur.execute("DELETE FROM students WHERE id = %s", (student_id,))
+        notify(conn, TOPIC_STUDENT, student_id)
         conn.commit()
+        dispatch(TOPIC_STUDENT, student_id)
         # 削除された行数をチェック
         if cur.rowcount == 0:
             return False, "指定されたIDの生徒が見つかりません。"
@@ -879,7 +1172,12 @@ def get_all_presets_with_books():
         with conn.cursor(cursor_factory=DictCursor) as cur:
             cur.execute("SELECT id, subject, preset_name FROM bulk_presets ORDER BY subject, preset_name")
             presets = cur.fetchall()
-            cur.execute("SELECT preset_id, book_name FROM bulk_preset_books ORDER BY preset_id, id") # 順序安定のため id も追加
+            cur.execute("""
+                SELECT pb.preset_id, pb.master_textbook_id, COALESCE(m.book_name, pb.book_name) AS book_name
+                FROM bulk_preset_books pb
+                LEFT JOIN master_textbooks m ON pb.master_textbook_id = m.id
+                ORDER BY pb.preset_id, pb.id
+            """) # 順序安定のため id も追加
             books = cur.fetchall()
     except psycopg2.Error as e:
          print(f"データベースエラー (get_all_presets_with_books): {e}")
@@ -887,10 +1185,13 @@ def get_all_presets_with_books():
         if conn:
             conn.close()
 
-    presets_dict = {p['id']: dict(p, books=[]) for p in presets}
+    presets_dict = {p['id']: dict(p, books=[], book_ids=[]) for p in presets}
     for book in books:
         if book['preset_id'] in presets_dict:
             presets_dict[book['preset_id']]['books'].append(book['book_name'])
+            # マスターから削除された参考書は book_ids に含めない
+            if book['master_textbook_id'] is not None:
+                presets_dict[book['preset_id']]['book_ids'].append(book['master_textbook_id'])
 
     return list(presets_dict.values())
 
@@ -908,21 +1209,20 @@ def add_preset(subject, preset_name, book_ids):
 
             # 関連書籍を追加
             if book_ids:
-                # book_ids から book_names を取得
-                placeholders = ','.join(['%s'] * len(book_ids))
-                cur.execute(f"SELECT book_name FROM master_textbooks WHERE id IN ({placeholders})", book_ids)
-                book_names_rows = cur.fetchall()
-                book_names = [row['book_name'] for row in book_names_rows]
-
-                # bulk_preset_books に挿入
-                books_to_insert = [(preset_id, book) for book in book_names]
-                if books_to_insert:
-                     execute_values(
-                         cur,
-                         "INSERT INTO bulk_preset_books (preset_id, book_name) VALUES %s",
-                         books_to_insert
-                     )
+                # 選択順に master_textbook_id と (表示用の) 参考書名を保存
+                cur.execute(
+                    """
+                    INSERT INTO bulk_preset_books (preset_id, master_textbook_id, book_name)
+                    SELECT %s, m.id, m.book_name
+                    FROM unnest(%s::integer[]) WITH ORDINALITY AS b(id, ord)
+                    JOIN master_textbooks m ON m.id = b.id
+                    ORDER BY b.ord
+                    """,
+                    (preset_id, list(book_ids))
+                )
+        notify(conn, TOPIC_MASTER_DATA)
         conn.commit()
+        dispatch(TOPIC_MASTER_DATA)
         return True, "プリセットが追加されました。"
     except psycopg2.IntegrityError: # UNIQUE制約違反
         conn.rollback()
@@ -951,21 +1251,20 @@ def update_preset(preset_id, subject, preset_name, book_ids):
 
             # 新しい関連書籍を追加
             if book_ids:
-                # book_ids から book_names を取得
-                placeholders = ','.join(['%s'] * len(book_ids))
-                cur.execute(f"SELECT book_name FROM master_textbooks WHERE id IN ({placeholders})", book_ids)
-                book_names_rows = cur.fetchall()
-                book_names = [row['book_name'] for row in book_names_rows]
-
-                # bulk_preset_books に挿入
-                books_to_insert = [(preset_id, book) for book in book_names]
-                if books_to_insert:
-                    execute_values(
-                        cur,
-                        "INSERT INTO bulk_preset_books (preset_id, book_name) VALUES %s",
-                        books_to_insert
-                    )
+                # 選択順に master_textbook_id と (表示用の) 参考書名を保存
+                cur.execute(
+                    """
+                    INSERT INTO bulk_preset_books (preset_id, master_textbook_id, book_name)
+                    SELECT %s, m.id, m.book_name
+                    FROM unnest(%s::integer[]) WITH ORDINALITY AS b(id, ord)
+                    JOIN master_textbooks m ON m.id = b.id
+                    ORDER BY b.ord
+                    """,
+                    (preset_id, list(book_ids))
+                )
+        notify(conn, TOPIC_MASTER_DATA)
         conn.commit()
+        dispatch(TOPIC_MASTER_DATA)
         # 更新された行数をチェック (bulk_presets テーブルのみ)
         if cur.rowcount == 0:
              return False, "指定されたIDのプリセットが見つかりません。"
@@ -988,7 +1287,9 @@ def delete_preset(preset_id):
         with conn.cursor() as cur:
             # bulk_presets から削除
             cur.execute("DELETE FROM bulk_presets WHERE id = %s", (preset_id,))
+        notify(conn, TOPIC_MASTER_DATA)
         conn.commit()
+        dispatch(TOPIC_MASTER_DATA)
         # 削除された行数をチェック
         if cur.rowcount == 0:
             return False, "指定されたIDのプリセットが見つかりません。"
@@ -1020,7 +1321,9 @@ def delete_homework_group(student_id, textbook_id, custom_textbook_name):
 
             cur.execute(query, tuple(params))
             rowcount = cur.rowcount
+        notify(conn, TOPIC_HOMEWORK, student_id)
         conn.commit()
+        dispatch(TOPIC_HOMEWORK, student_id)
 
         if rowcount > 0:
             return True, "宿題が正常に削除されました。"
@@ -1080,22 +1383,96 @@ def get_past_exam_results_for_student(student_id):
     finally:
         if conn:
             conn.close()
-    # 日付文字列をdateオブジェクトに変換（エラー時はNone）
-    processed_results = []
-    for row_dict in [dict(row) for row in results]:
-        try:
-            row_dict['date'] = date.fromisoformat(row_dict['date']) if row_dict.get('date') else None
-        except (ValueError, TypeError):
-            row_dict['date'] = None # 不正な形式の場合はNoneにする
-        processed_results.append(row_dict)
-    return processed_results
+    # date 列は DATE 型のため date オブジェクトで返る
+    return [dict(row) for row in results]
+
+def get_past_exam_results_page(student_id, university=None, subject=None, after=None, page_size=50):
+    """
+    過去問結果の一覧の1ページ分を取得する (キーセットページング)。
+    並び順は get_past_exam_results_for_student と同じ (日付の新しい順 → 大学名 → 科目、同順位は id)。
+    日付・所要時間・正答率は表示用の文字列に整形して返す。
+    after には前のページの next_cursor を渡す。戻り値は (行のリスト, next_cursor)。次のページが無ければ next_cursor は None。
+    """
+    conn = get_db_connection()
+    rows = []
+    try:
+        with conn.cursor(cursor_factory=DictCursor) as cur:
+            query = """
+                SELECT
+                    id, date, university_name, subject,
+                    to_char(date, 'YYYY-MM-DD') AS date_display,
+                    COALESCE(faculty_name, '') AS faculty_name,
+                    COALESCE(exam_system, '') AS exam_system,
+                    year,
+                    CASE
+                        WHEN time_required IS NULL THEN ''
+                        WHEN total_time_allowed IS NULL THEN time_required::text
+                        ELSE time_required || '/' || total_time_allowed
+                    END AS time_display,
+                    CASE
+                        WHEN correct_answers IS NOT NULL AND total_questions > 0
+                        THEN to_char(correct_answers * 100.0 / total_questions, 'FM9990.0') || '%%'
+                        ELSE ''
+                    END AS accuracy_display
+                FROM past_exam_results
+                WHERE student_id = %s
+            """
+            params = [student_id]
+            if university:
+                query += " AND university_name = %s"
+                params.append(university)
+            if subject:
+                query += " AND subject = %s"
+                params.append(subject)
+            if after:
+                after_date, after_university, after_subject, after_id = after
+                query += """
+                    AND (date < %s::date
+                         OR (date = %s::date AND (university_name, subject, id) > (%s, %s, %s)))
+                """
+                params.extend([after_date, after_date, after_university, after_subject, after_id])
+            # 1件多く読み、次のページがあるかを判定する
+            query += " ORDER BY date DESC, university_name, subject, id LIMIT %s"
+            params.append(page_size + 1)
+            cur.execute(query, tuple(params))
+            rows = [dict(row) for row in cur.fetchall()]
+    except psycopg2.Error as e:
+        print(f"データベースエラー (get_past_exam_results_page): {e}")
+    finally:
+        conn.close()
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = [last['date'].isoformat(), last['university_name'], last['subject'], last['id']]
+    return rows, next_cursor
+
+def get_past_exam_filter_options(student_id):
+    """過去問結果の絞り込みの候補 (大学名・科目の一覧) を返す: (大学名のリスト, 科目のリスト)"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT
+                    ARRAY(SELECT DISTINCT university_name FROM past_exam_results WHERE student_id = %(id)s ORDER BY 1),
+                    ARRAY(SELECT DISTINCT subject FROM past_exam_results WHERE student_id = %(id)s ORDER BY 1)
+                """,
+                {'id': student_id}
+            )
+            universities, subjects = cur.fetchone()
+            return universities, subjects
+    except psycopg2.Error as e:
+        print(f"データベースエラー (get_past_exam_filter_options): {e}")
+        return [], []
+    finally:
+        conn.close()
 
 def add_past_exam_result(student_id, result_data):
     """新しい過去問結果をデータベースに追加する"""
     conn = get_db_connection()
     try:
-        # 日付を文字列形式に変換
-        date_str = result_data['date'].isoformat() if isinstance(result_data.get('date'), date) else result_data.get('date')
 
         with conn.cursor() as cur:
             cur.execute(
@@ -1108,7 +1485,7 @@ def add_past_exam_result(student_id, result_data):
                 """,
                 (
                     student_id,
-                    date_str, # 文字列形式の日付
+                    result_data['date'], # date オブジェクトまたは 'YYYY-MM-DD'
                     result_data['university_name'],
                     result_data.get('faculty_name'),
                     result_data.get('exam_system'),
@@ -1134,8 +1511,6 @@ def update_past_exam_result(result_id, result_data):
     """既存の過去問結果を更新する"""
     conn = get_db_connection()
     try:
-        # 日付を文字列形式に変換
-        date_str = result_data['date'].isoformat() if isinstance(result_data.get('date'), date) else result_data.get('date')
 
         with conn.cursor() as cur:
             cur.execute(
@@ -1147,7 +1522,7 @@ def update_past_exam_result(result_id, result_data):
                 WHERE id = %s
                 """,
                 (
-                    date_str, # 文字列形式の日付
+                    result_data['date'], # date オブジェクトまたは 'YYYY-MM-DD'
                     result_data['university_name'],
                     result_data.get('faculty_name'),
                     result_data.get('exam_system'),
@@ -1372,32 +1747,29 @@ def get_student_level_statistics(target_school=None, target_grade=None):
     """
     指定された校舎・学年の生徒について、各科目のレベル達成人数を集計する。
     target_school が None の場合は全校舎を集計する。
+    集計は level_achievement_stats (進捗の書き込み時に更新) から読む。
     """
     conn = get_db_connection()
-    progress_data = []
+    level_counts = []
     try:
         with conn.cursor(cursor_factory=DictCursor) as cur:
-            # ★ ベースとなるクエリ
             query = """
-                SELECT
-                    s.id as student_id,
-                    p.subject,
-                    p.level
-                FROM progress p
-                JOIN students s ON p.student_id = s.id
-                WHERE p.is_done = true AND p.level IN ('日大', 'MARCH', '早慶')
+                SELECT subject, level, SUM(student_count) AS student_count
+                FROM level_achievement_stats
+                WHERE student_count > 0
             """
             params = []
             # ★ target_school が指定されている場合のみ WHERE句に追加
             if target_school:
-                query += " AND s.school = %s"
+                query += " AND school = %s"
                 params.append(target_school)
             if target_grade:
-                query += " AND s.grade = %s"
+                query += " AND grade = %s"
                 params.append(target_grade)
+            query += " GROUP BY subject, level"
 
             cur.execute(query, tuple(params)) # params が空でも tuple() はOK
-            progress_data = cur.fetchall()
+            level_counts = cur.fetchall()
     except psycopg2.Error as e:
          print(f"データベースエラー (get_student_level_statistics): {e}")
          return {}
@@ -1405,39 +1777,21 @@ def get_student_level_statistics(target_school=None, target_grade=None):
         if conn:
             conn.close()
 
-    if not progress_data:
-        return {}
-
-    progress_list = [dict(row) for row in progress_data]
-    df = pd.DataFrame(progress_list)
-
-    required_columns = ['student_id', 'subject', 'level']
-    if not all(col in df.columns for col in required_columns):
+    if not level_counts:
         return {}
 
-    # ★ 生徒ごと、科目ごと、レベルごとの達成記録にユニーク化
-    df_unique_students = df.drop_duplicates(subset=required_columns)
-
-    # 科目とレベルでグループ化し、生徒数をカウント
-    level_counts = df_unique_students.groupby(['subject', 'level']).size().reset_index(name='student_count')
-
     stats = {}
-    for _, row in level_counts.iterrows():
+    for row in level_counts:
         subject = row['subject']
-        level = row['level']
-        count = row['student_count']
-
         if subject not in stats:
-            stats[subject] = {'日大': 0, 'MARCH': 0, '早慶': 0}
-
-        if level in stats[subject]:
-            stats[subject][level] = count
+            stats[subject] = {level: 0 for level in ACHIEVEMENT_LEVELS}
+        stats[subject][row['level']] = int(row['student_count'])
 
     # 集計結果に含まれない科目を追加し、カウントを0で初期化
     all_subjects = get_all_subjects() # データベースから全科目リストを取得
     for subj in all_subjects:
         if subj not in stats:
-            stats[subj] = {'日大': 0, 'MARCH': 0, '早慶': 0}
+            stats[subj] = {level: 0 for level in ACHIEVEMENT_LEVELS}
 
     return stats
 
@@ -1463,17 +1817,8 @@ def get_acceptance_results_for_student(student_id):
     finally:
         if conn:
             conn.close()
-    # 日付文字列をdateオブジェクトに変換（エラー時はNone）
-    processed_results = []
-    date_cols = ['application_deadline', 'exam_date', 'announcement_date', 'procedure_deadline']
-    for row_dict in [dict(row) for row in results]:
-        for col in date_cols:
-             try:
-                 row_dict[col] = date.fromisoformat(row_dict[col]) if row_dict.get(col) else None
-             except (ValueError, TypeError):
-                 row_dict[col] = None # 不正な形式の場合はNoneにする
-        processed_results.append(row_dict)
-    return processed_results
+    # 各期日は DATE 型のため date オブジェクト (未設定は None) で返る
+    return [dict(row) for row in results]
 
 # --- add_acceptance_result ---
 def add_acceptance_result(student_id, data):
@@ -1481,12 +1826,6 @@ def add_acceptance_result(student_id, data):
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
-            # 日付データを文字列に変換 (Noneもそのまま渡す)
-            app_deadline_str = data.get('application_deadline').isoformat() if isinstance(data.get('application_deadline'), date) else data.get('application_deadline')
-            exam_date_str = data.get('exam_date').isoformat() if isinstance(data.get('exam_date'), date) else data.get('exam_date')
-            announcement_date_str = data.get('announcement_date').isoformat() if isinstance(data.get('announcement_date'), date) else data.get('announcement_date')
-            proc_deadline_str = data.get('procedure_deadline').isoformat() if isinstance(data.get('procedure_deadline'), date) else data.get('procedure_deadline')
-
             cur.execute(
                 """
                 INSERT INTO university_acceptance (
@@ -1501,10 +1840,11 @@ def add_acceptance_result(student_id, data):
                     data.get('department_name'),
                     data.get('exam_system'),
                     data.get('result'),
-                    app_deadline_str,
-                    exam_date_str,
-                    announcement_date_str,
-                    proc_deadline_str
+                    # 日付は date オブジェクト・'YYYY-MM-DD'・None のいずれもそのまま渡せる (空文字列はNone)
+                    data.get('application_deadline') or None,
+                    data.get('exam_date') or None,
+                    data.get('announcement_date') or None,
+                    data.get('procedure_deadline') or None
                 )
             )
         conn.commit()
@@ -1531,14 +1871,12 @@ def update_acceptance_result(result_id, data):
                 'university_name', 'faculty_name', 'department_name', 'exam_system', 'result',
                 'application_deadline', 'exam_date', 'announcement_date', 'procedure_deadline'
             ]
+            date_fields = fields_to_update[-4:]
             for field in fields_to_update:
                 if field in data:
                     value = data[field]
-                    # 日付オブジェクトは文字列に変換
-                    if isinstance(value, date):
-                         value = value.isoformat()
-                    # resultが空文字列の場合はNoneに変換
-                    elif field == 'result' and value == '':
+                    # 空文字列はNoneに変換 (日付列は DATE 型のため空文字列を受け付けない)
+                    if value == '' and (field == 'result' or field in date_fields):
                          value = None
                     set_clauses.append(f"{field} = %s")
                     params.append(value)
@@ -1868,6 +2206,78 @@ def get_all_mock_exam_details_for_school(school_name):
             conn.close()
     return [dict(row) for row in results]
 
+# 校舎の模試結果一覧 (管理者) に表示する点数の列 (形式ごと)
+MOCK_EXAM_LIST_SCORE_COLUMNS = {
+    'マーク': (
+        'subject_kokugo_mark', 'subject_math1a_mark', 'subject_math2bc_mark',
+        'subject_english_r_mark', 'subject_english_l_mark', 'subject_rika1_mark', 'subject_rika2_mark',
+        'subject_shakai1_mark', 'subject_shakai2_mark', 'subject_rika_kiso1_mark',
+        'subject_rika_kiso2_mark', 'subject_info_mark',
+    ),
+    '記述': (
+        'subject_kokugo_desc', 'subject_math_desc', 'subject_english_desc',
+        'subject_rika1_desc', 'subject_rika2_desc', 'subject_shakai1_desc', 'subject_shakai2_desc',
+    ),
+}
+
+def get_mock_exam_details_page(school_name, exam_format, result_type=None, mock_exam_name=None, grade=None,
+                               after=None, page_size=100):
+    """
+    校舎の模試結果一覧の1ページ分を、形式 (マーク / 記述) ごとに取得する (キーセットページング)。
+    種類・模試名・学年の絞り込みは SQL で行い、一覧に表示する列のみを取得する。
+    並び順は get_all_mock_exam_details_for_school と同じ (生徒名 → 受験日の新しい順 (未入力が先) → id の新しい順)。
+    after には前のページの next_cursor を渡す。戻り値は (行のリスト, next_cursor)。次のページが無ければ next_cursor は None。
+    """
+    score_columns = MOCK_EXAM_LIST_SCORE_COLUMNS[exam_format]
+    conn = get_db_connection()
+    rows = []
+    try:
+        with conn.cursor(cursor_factory=DictCursor) as cur:
+            # 受験日が未入力の行を先頭に並べるため、未入力は最大の日付として扱う
+            query = f"""
+                SELECT
+                    s.name AS student_name, mer.id, mer.result_type, mer.mock_exam_name, mer.grade, mer.round,
+                    COALESCE(to_char(mer.exam_date, 'YYYY-MM-DD'), '-') AS exam_date,
+                    COALESCE(mer.exam_date, DATE '9999-12-31') AS sort_date,
+                    {', '.join('mer.' + column for column in score_columns)}
+                FROM mock_exam_results mer
+                JOIN students s ON mer.student_id = s.id
+                WHERE s.school = %s AND mer.mock_exam_format = %s
+            """
+            params = [school_name, exam_format]
+            if result_type:
+                query += " AND mer.result_type = %s"
+                params.append(result_type)
+            if mock_exam_name:
+                query += " AND mer.mock_exam_name = %s"
+                params.append(mock_exam_name)
+            if grade:
+                query += " AND mer.grade = %s"
+                params.append(grade)
+            if after:
+                after_name, after_date, after_id = after
+                query += """
+                    AND (s.name > %s
+                         OR (s.name = %s AND (COALESCE(mer.exam_date, DATE '9999-12-31'), mer.id) < (%s::date, %s)))
+                """
+                params.extend([after_name, after_name, after_date, after_id])
+            # 1件多く読み、次のページがあるかを判定する
+            query += " ORDER BY s.name, sort_date DESC, mer.id DESC LIMIT %s"
+            params.append(page_size + 1)
+            cur.execute(query, tuple(params))
+            rows = [dict(row) for row in cur.fetchall()]
+    except psycopg2.Error as e:
+        print(f"データベースエラー (get_mock_exam_details_page): {e}")
+    finally:
+        conn.close()
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = [last['student_name'], last['sort_date'].isoformat(), last['id']]
+    return rows, next_cursor
+
 def get_mock_exam_filter_options(school_name):
     """
     指定された校舎の模試結果から、フィルター用のユニークな値を取得する。
@@ -1952,15 +2362,113 @@ def add_or_update_eiken_result(student_id, grade, cse_score):
             conn.close()
 
 def get_root_table_by_id(table_id):
-    """IDを指定してファイル名とバイナリデータを取得する"""
+    """IDを指定してファイル名とバイナリデータを取得する (ファイル本体が必要な場合のみ使うこと)"""
     conn = get_db_connection()
     try:
         with conn.cursor(cursor_factory=DictCursor) as cur:
-            cur.execute("SELECT filename, file_content FROM root_tables WHERE id = %s", (table_id,))
+            cur.execute(
+                """
+                SELECT r.filename, b.content AS file_content
+                FROM root_tables r
+                JOIN root_table_blobs b ON b.content_sha256 = r.content_sha256
+                WHERE r.id = %s
+                """,
+                (table_id,)
+            )
             return cur.fetchone()
     finally:
         conn.close()
 
+def get_root_table_metadata(table_id):
+    """ファイル本体を読まずに、ルート表のメタデータ (ファイル名・科目・レベル・年度・ハッシュ・サイズ) を取得する"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=DictCursor) as cur:
+            cur.execute(
+                """
+                SELECT r.id, r.filename, r.subject, r.level, r.academic_year, r.uploaded_at,
+                       r.content_sha256, b.file_size
+                FROM root_tables r
+                JOIN root_table_blobs b ON b.content_sha256 = r.content_sha256
+                WHERE r.id = %s
+                """,
+                (table_id,)
+            )
+            row = cur.fetchone()
+            return dict(row) if row else None
+    except psycopg2.Error as e:
+        print(f"データベースエラー (get_root_table_metadata): {e}")
+        return None
+    finally:
+        conn.close()
+
+# ルート表の配信時に1回のクエリで読むバイト数
+ROOT_TABLE_CHUNK_SIZE = 256 * 1024
+
+def iter_root_table_content(content_sha256, start, end, chunk_size=ROOT_TABLE_CHUNK_SIZE):
+    """
+    ルート表のファイル本体のうち [start, end) を chunk_size ごとに返すジェネレーター。
+    遅いクライアントへの送信中に接続を占有しないよう、チャンクごとにプールから接続を借りて返す。
+    本体はハッシュで引くため、送信中にルート表が差し替えられても別の内容が混ざることはない
+    (本体が削除された場合は送信を打ち切る)。
+    """
+    position = start
+    while position < end:
+        length = min(chunk_size, end - position)
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT substring(content FROM %s FOR %s) FROM root_table_blobs WHERE content_sha256 = %s",
+                    (position + 1, length, content_sha256) # substring の位置は1始まり
+                )
+                row = cur.fetchone()
+        if row is None or not row[0]:
+            print(f"ルート表のファイル ({content_sha256}) が配信中に削除されたため送信を中断しました。")
+            return
+        chunk = bytes(row[0])
+        yield chunk
+        position += len(chunk)
+
+def _acquire_root_table_blob(cur, content_bytes):
+    """
+    ファイル本体を root_table_blobs に登録 (既にあれば参照数を1増や) し、ハッシュを返す。
+    同じ内容のファイルは1つだけ保存される。
+    """
+    content_sha256 = hashlib.sha256(content_bytes).hexdigest()
+    cur.execute("SELECT 1 FROM root_table_blobs WHERE content_sha256 = %s", (content_sha256,))
+    if cur.fetchone():
+        # 既存の本体を書き直さないよう、参照数だけを更新する
+        cur.execute(
+            "UPDATE root_table_blobs SET ref_count = ref_count + 1 WHERE content_sha256 = %s",
+            (content_sha256,)
+        )
+        if cur.rowcount == 1:
+            return content_sha256
+    cur.execute(
+        """
+        INSERT INTO root_table_blobs (content_sha256, content, file_size, ref_count)
+        VALUES (%s, %s, %s, 1)
+        ON CONFLICT (content_sha256) DO UPDATE SET ref_count = root_table_blobs.ref_count + 1
+        """,
+        (content_sha256, content_bytes, len(content_bytes))
+    )
+    return content_sha256
+
+def _release_root_table_blob(cur, content_sha256):
+    """ファイル本体の参照数を1減らし、どこからも参照されなくなった本体を削除する"""
+    cur.execute(
+        "UPDATE root_table_blobs SET ref_count = ref_count - 1 WHERE content_sha256 = %s",
+        (content_sha256,)
+    )
+    cur.execute(
+        """
+        DELETE FROM root_table_blobs b
+        WHERE b.content_sha256 = %s AND b.ref_count <= 0
+          AND NOT EXISTS (SELECT 1 FROM root_tables r WHERE r.content_sha256 = b.content_sha256)
+        """,
+        (content_sha256,)
+    )
+
 def get_filtered_root_tables(subject=None, level=None, year=None):
     conn = get_db_connection()
     try:
@@ -1997,9 +2505,10 @@ def add_root_table(filename, content_bytes, subject, level, year):
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
+            content_sha256 = _acquire_root_table_blob(cur, content_bytes)
             cur.execute(
-                "INSERT INTO root_tables (filename, file_content, subject, level, academic_year) VALUES (%s, %s, %s, %s, %s)",
-                (filename, content_bytes, subject, level, year)
+                "INSERT INTO root_tables (filename, content_sha256, subject, level, academic_year) VALUES (%s, %s, %s, %s, %s)",
+                (filename, content_sha256, subject, level, year)
             )
         conn.commit()
         return True, "ルート表を登録しました。"
@@ -2015,10 +2524,18 @@ def update_root_table(table_id, subject, level, year, filename=None, content_byt
     try:
         with conn.cursor() as cur:
             if filename and content_bytes:
+                cur.execute("SELECT content_sha256 FROM root_tables WHERE id = %s FOR UPDATE", (table_id,))
+                row = cur.fetchone()
+                if row is None:
+                    conn.rollback()
+                    return False, "指定されたルート表が見つかりません。"
+                old_sha256 = row[0]
+                new_sha256 = _acquire_root_table_blob(cur, content_bytes)
                 cur.execute(
-                    "UPDATE root_tables SET subject=%s, level=%s, academic_year=%s, filename=%s, file_content=%s WHERE id=%s",
-                    (subject, level, year, filename, content_bytes, table_id)
+                    "UPDATE root_tables SET subject=%s, level=%s, academic_year=%s, filename=%s, content_sha256=%s WHERE id=%s",
+                    (subject, level, year, filename, new_sha256, table_id)
                 )
+                _release_root_table_blob(cur, old_sha256)
             else:
                 cur.execute(
                     "UPDATE root_tables SET subject=%s, level=%s, academic_year=%s WHERE id=%s",
@@ -2037,7 +2554,10 @@ def delete_root_table(table_id):
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
-            cur.execute("DELETE FROM root_tables WHERE id = %s", (table_id,))
+            cur.execute("DELETE FROM root_tables WHERE id = %s RETURNING content_sha256", (table_id,))
+            row = cur.fetchone()
+            if row:
+                _release_root_table_blob(cur, row[0])
         conn.commit()
         return True, "ルート表を削除しました。"
     except Exception as e:
@@ -2045,3 +2565,7 @@ def delete_root_table(table_id):
         return False, f"削除エラー: {e}"
     finally:
         conn.close()
+
+
+# このモジュールの公開関数はすべて呼び出し回数・所要時間・DB使用量を計測する (data/instrumentation.py)
+instrument_module_functions(globals())
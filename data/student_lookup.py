@@ -0,0 +1,75 @@
+# data/student_lookup.py
+
+"""
+フォーム連携API (/api/get-student-id) 用の生徒名の索引
+
+フォームから届く生徒名は全角/半角スペースの有無やカタカナ/ひらがなの表記が揺れるため、
+完全一致の検索では見つからず再送されることがあった。校舎名・生徒名を正規化した
+(校舎, 生徒名) -> 生徒ID の索引をワーカーごとに保持し、DBに問い合わせずに答える。
+生徒の追加・編集・削除 (TOPIC_STUDENT) で索引を破棄し、次の検索時に作り直す。
+"""
+import unicodedata
+
+import psycopg2
+
+from config.settings import APP_CONFIG
+from data.cache import TTLCache
+from data.db_pool import get_db_connection
+from data.invalidation import subscribe, TOPIC_STUDENT
+from data.instrumentation import instrumented
+
+# 索引は検索のたびにコピーしないよう copy_values=False とし、作り直す場合は新しい辞書に置き換える
+STUDENT_LOOKUP_CACHE = TTLCache('student_lookup', APP_CONFIG['cache']['student_lookup_ttl'], copy_values=False)
+subscribe(TOPIC_STUDENT, lambda key: STUDENT_LOOKUP_CACHE.invalidate())
+
+_INDEX_KEY = 'index'
+
+# カタカナ (ァ〜ヶ) をひらがなに寄せる変換表
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(ord('ァ'), ord('ヶ') + 1)}
+
+
+def normalize_name(value):
+    """
+    NFKC で全角英数字・半角カナをそろえ、空白をすべて除き、カタカナをひらがなに寄せる。
+    英字は大文字・小文字を区別しない。
+    """
+    if value is None:
+        return ''
+    normalized = unicodedata.normalize('NFKC', str(value))
+    normalized = ''.join(normalized.split()) # NFKC 後の全角スペースを含む空白を除く
+    return normalized.translate(_KATAKANA_TO_HIRAGANA).casefold()
+
+
+def _load_index():
+    """(正規化した校舎名, 正規化した生徒名) -> ((生徒ID, 校舎名, 生徒名), ...)"""
+    conn = get_db_connection()
+    index = {}
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, school, name FROM students ORDER BY id")
+            for student_id, school, name in cur.fetchall():
+                key = (normalize_name(school), normalize_name(name))
+                index[key] = index.get(key, ()) + ((student_id, school, name),)
+    except psycopg2.Error as e:
+        print(f"データベースエラー (student_lookup): {e}")
+        return {}
+    finally:
+        conn.close()
+    return index
+
+
+@instrumented
+def find_student_id(school, name):
+    """
+    生徒IDを返す。(生徒ID, None) または (None, 'not_found' / 'ambiguous')。
+    正規化すると同じになる生徒が複数いる場合は、校舎名・生徒名が完全に一致する生徒を選び、
+    それも無ければ 'ambiguous' とする。
+    """
+    index = STUDENT_LOOKUP_CACHE.get_or_load(_INDEX_KEY, _load_index)
+    candidates = index.get((normalize_name(school), normalize_name(name)), ())
+    if len(candidates) == 1:
+        return candidates[0][0], None
+    exact = [student_id for student_id, s_school, s_name in candidates if s_school == school and s_name == name]
+    if len(exact) == 1:
+        return exact[0], None
+    return None, 'ambiguous' if candidates else 'not_found'
@@ -0,0 +1,228 @@
+# data/submission_queue.py
+
+"""
+フォーム連携APIの非同期登録 (write-behind キュー)
+
+模試の直後などにフォームからの送信が集中すると、APIがDBへの登録を待つ間にフォーム側が
+タイムアウトして再送し、さらに負荷が増える。非同期モード (API_ASYNC_SUBMISSIONS=true) では、
+APIは入力を検証して api_submission_queue に積むだけで 202 を返し、各ワーカープロセスの
+バックグラウンドスレッドが FOR UPDATE SKIP LOCKED で複数件ずつ取り出してまとめて登録する。
+
+ジョブの取り出し・登録・状態の更新は1トランザクションで行うため、途中でプロセスが落ちても
+ジョブは queued に戻り、二重に登録されることはない。
+"""
+import os
+import threading
+
+from psycopg2.extras import Json, execute_values
+
+from config.settings import APP_CONFIG
+from data.db_pool import db_connection
+from data.batch_ingest import BATCH_TARGETS, BATCH_CHUNK_SIZE, insert_rows, validate_records
+from data.instrumentation import instrumented
+
+API_CONFIG = APP_CONFIG['api']
+
+
+def is_async_enabled():
+    return API_CONFIG['async_submissions']
+
+
+# --- 登録 (API側) ---
+
+@instrumented
+def enqueue(target, payloads):
+    """検証済みの入力をキューに積み、ジョブIDのリストを返す"""
+    if target not in BATCH_TARGETS:
+        raise ValueError(f"不明な登録先です: {target}")
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            rows = execute_values(
+                cur,
+                "INSERT INTO api_submission_queue (target, payload) VALUES %s RETURNING id",
+                [(target, Json(payload)) for payload in payloads],
+                page_size=max(len(payloads), 1),
+                fetch=True
+            )
+    _wakeup.set() # このプロセスのワーカーをすぐに起こす
+    return [row[0] for row in rows]
+
+
+@instrumented
+def enqueue_batch(target, records, chunk_size=BATCH_CHUNK_SIZE):
+    """records を検証し、正しい行を chunk_size 件ずつキューに積む。入力順の行ごとの結果を返す"""
+    results = []
+    pending = []
+
+    def flush():
+        job_ids = enqueue(target, [data for _, data in pending])
+        results.extend({'index': index, 'status': 'queued', 'job_id': job_id}
+                       for (index, _), job_id in zip(pending, job_ids))
+        pending.clear()
+
+    for index, record, data, error in validate_records(target, records):
+        if error:
+            results.append({'index': index, 'status': 'invalid', 'message': error})
+            continue
+        pending.append((index, data))
+        if len(pending) >= chunk_size:
+            flush()
+    if pending:
+        flush()
+    results.sort(key=lambda r: r['index'])
+    return results
+
+
+@instrumented
+def get_job_statuses(job_ids):
+    """ジョブIDごとの状態を返す (存在しないIDは含まれない)"""
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT id, target, state, result_id, error, created_at, processed_at
+                FROM api_submission_queue WHERE id = ANY(%s) ORDER BY id
+                """,
+                (list(job_ids),)
+            )
+            return [
+                {
+                    'job_id': row[0], 'target': row[1], 'state': row[2], 'result_id': row[3], 'message': row[4],
+                    'created_at': row[5].isoformat() if row[5] else None,
+                    'processed_at': row[6].isoformat() if row[6] else None,
+                }
+                for row in cur.fetchall()
+            ]
+
+
+# --- 取り出し・登録 (ワーカー側) ---
+
+@instrumented
+def process_queue_batch(limit=None):
+    """未処理のジョブを最大 limit 件取り出して登録し、処理した件数を返す"""
+    limit = limit or API_CONFIG['queue_batch_size']
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            # 他のワーカーが処理中のジョブは飛ばす
+            cur.execute(
+                """
+                SELECT id, target, payload FROM api_submission_queue
+                WHERE state = 'queued'
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+                """,
+                (limit,)
+            )
+            jobs = cur.fetchall()
+            if not jobs:
+                return 0
+
+            outcomes = [] # (job_id, state, result_id, error)
+            pending_by_target = {}
+            for job_id, target, payload in jobs:
+                if target not in BATCH_TARGETS:
+                    outcomes.append((job_id, 'failed', None, f"Unknown target: {target}"))
+                    continue
+                record, error = BATCH_TARGETS[target][0](payload)
+                if error: # キューに積んだ後に検証内容が変わった場合
+                    outcomes.append((job_id, 'failed', None, error))
+                    continue
+                pending_by_target.setdefault(target, []).append((job_id, record))
+
+            for target, pending in pending_by_target.items():
+                for result in insert_rows(cur, target, pending):
+                    if result['status'] == 'created':
+                        outcomes.append((result['index'], 'done', result['id'], None))
+                    else:
+                        outcomes.append((result['index'], 'failed', None, result.get('message')))
+
+            execute_values(
+                cur,
+                """
+                UPDATE api_submission_queue q
+                SET state = v.state, result_id = v.result_id, error = v.error, processed_at = CURRENT_TIMESTAMP
+                FROM (VALUES %s) AS v(id, state, result_id, error)
+                WHERE q.id = v.id
+                """,
+                outcomes,
+                template="(%s::bigint, %s, %s::integer, %s)",
+                page_size=len(outcomes)
+            )
+    return len(jobs)
+
+
+def purge_processed_jobs():
+    """保持期間を過ぎた処理済みのジョブを削除し、削除した件数を返す"""
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                DELETE FROM api_submission_queue
+                WHERE state <> 'queued' AND processed_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+                """,
+                (API_CONFIG['queue_retention_days'],)
+            )
+            return cur.rowcount
+
+
+_wakeup = threading.Event()
+
+
+class SubmissionQueueWorker(threading.Thread):
+    """キューを定期的に確認し、未処理のジョブを登録するバックグラウンドスレッド"""
+
+    # 処理済みのジョブを掃除する間隔 (秒)
+    PURGE_INTERVAL = 60 * 60
+
+    def __init__(self, poll_interval=None, batch_size=None):
+        super().__init__(name='submission-queue-worker', daemon=True)
+        self.poll_interval = poll_interval or API_CONFIG['queue_poll_interval']
+        self.batch_size = batch_size or API_CONFIG['queue_batch_size']
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        _wakeup.set()
+
+    def run(self):
+        waited = 0.0
+        while not self._stop_event.is_set():
+            try:
+                processed = process_queue_batch(self.batch_size)
+                if waited >= self.PURGE_INTERVAL:
+                    purge_processed_jobs()
+                    waited = 0.0
+            except Exception as e: # DBの瞬断などでスレッドを止めない
+                print(f"データベースエラー (submission queue worker): {e}")
+                processed = 0
+            if processed >= self.batch_size:
+                continue # まだ残っている可能性があるため続けて取り出す
+            _wakeup.wait(self.poll_interval)
+            _wakeup.clear()
+            waited += self.poll_interval
+
+
+_worker = None
+
+
+def start_worker():
+    """非同期モードの場合、このプロセスのワーカースレッドを起動する (起動済みなら何もしない)"""
+    global _worker
+    if not is_async_enabled():
+        return None
+    if _worker is None or not _worker.is_alive():
+        _worker = SubmissionQueueWorker()
+        _worker.start()
+    return _worker
+
+
+def _restart_worker_after_fork():
+    # スレッドはforkで子プロセスへ引き継がれないため、親で起動済みなら子でも起動し直す
+    global _worker
+    if _worker is not None:
+        _worker = None
+        start_worker()
+
+
+os.register_at_fork(after_in_child=_restart_worker_after_fork)
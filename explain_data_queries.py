@@ -0,0 +1,450 @@
+# explain_data_queries.py
+
+"""
+データ層の SELECT のクエリプラン検査
+
+data/nested_json_processor.py と auth/user_manager.py の SELECT を合成データ (generate_synthetic_data.py) 上で
+EXPLAIN し、プランの形・走査した行数・バッファ (ヒット / 読み込み) を JSON に保存する。
+
+- 読み取りの関数は実際に呼び出し、実行された SQL (data/instrumentation.py の capture_queries で記録) を
+  EXPLAIN (ANALYZE, BUFFERS) する
+- それ以外 (書き込みの関数の中の SELECT など) はソースの SQL を EXPLAIN (GENERIC_PLAN) する (PostgreSQL 16 以降。
+  実行しないため行数・バッファは記録しない)
+- 大きなテーブル (--large-table-rows 行以上) の Seq Scan と、見積もり行数と実際の行数が --misestimate-factor 倍以上
+  ずれたノードを表示する
+- --compare で以前の結果と比べ、プランの変化・新しい Seq Scan / 見積もりのずれ・走査行数やバッファの増加を
+  回帰として表示する (終了コード 1)
+
+    # 1/5 規模の合成データを投入して検査し、benchmark_results/ に保存
+    python explain_data_queries.py --scale 0.2
+    # 現在のDBのまま検査し、基準の結果と比較する
+    python explain_data_queries.py --no-generate --compare benchmark_results/explain_baseline.json
+
+ANALYZE は SELECT を実際に実行する (結果はロールバックする)。本番のDBでは実行しないこと。
+"""
+import argparse
+import ast
+import json
+import os
+import re
+import sys
+from datetime import datetime
+
+import psycopg2
+
+import generate_synthetic_data
+from auth import user_manager
+from benchmark_data_access import RESULTS_DIR, BenchmarkSample, dataset_counts, git_revision
+from data import instrumentation
+from data import nested_json_processor as njp
+from data.db_pool import db_connection
+
+SOURCE_FILES = ('data/nested_json_processor.py', 'auth/user_manager.py')
+
+# 回帰とみなす走査行数・バッファの増加率と、誤差として無視する差
+DEFAULT_THRESHOLD = 0.50
+MIN_ROWS_DIFF = 1000
+MIN_BUFFERS_DIFF = 100
+
+# 見積もりのずれは、どちらかが この行数以上の場合のみ数える (数行のずれは無視する)
+MIN_MISESTIMATE_ROWS = 100
+
+_SELECT_START = re.compile(r'\s*(SELECT|WITH)\b', re.IGNORECASE)
+_NAMED_PARAM = re.compile(r'%\((\w+)\)s')
+_REPEATED_PLACEHOLDERS = re.compile(r'\?(?:\s*,\s*\?)+')
+
+
+def normalize_sql(sql):
+    """パラメータ・リテラルを ? にした1行の SQL (結果の照合キー。IN / ARRAY の要素数の違いもまとめる)"""
+    text = sql.replace('%%', '%').replace('%s', '?')
+    text = _NAMED_PARAM.sub('?', text)
+    return _REPEATED_PLACEHOLDERS.sub('?, ...', instrumentation.redact_sql(text))
+
+
+# --- 検査する呼び出し ---
+
+class ExplainSample(BenchmarkSample):
+    """検査の入力 (ベンチマークと同じ生徒・講師に、科目・参考書・ルート表を加える)"""
+
+    def __init__(self, school_prefix, seed):
+        super().__init__(school_prefix, seed, size=1)
+        self.student_id = self.student_ids[0]
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT name FROM students WHERE id = %s", (self.student_id,))
+            self.student_name = cur.fetchone()[0]
+            cur.execute(
+                "SELECT subject, master_textbook_id FROM homework WHERE student_id = %s AND master_textbook_id IS NOT NULL LIMIT 1",
+                (self.student_id,)
+            )
+            row = cur.fetchone()
+            if row is None:
+                cur.execute("SELECT subject, id FROM master_textbooks ORDER BY id LIMIT 1")
+                row = cur.fetchone()
+            self.subject, self.textbook_id = row if row else ('英語', None)
+            cur.execute("SELECT id FROM root_tables ORDER BY id LIMIT 1")
+            row = cur.fetchone()
+            self.root_table_id = row[0] if row else None
+
+
+def build_calls(sample):
+    """読み取りの関数の (関数, 引数) のリスト"""
+    student = sample.student_id
+    calls = [
+        (njp.get_all_schools, ()),
+        (njp.get_all_grades, ()),
+        (njp.get_students_for_user, (sample.admin_user,)),
+        (njp.get_students_for_user, (sample.instructor_user,)),
+        (njp.get_student_progress, (sample.school, sample.student_name)),
+        (njp.get_student_info_by_id, (student,)),
+        (njp.get_student_progress_by_id, (student,)),
+        (njp.get_student_dashboard_snapshot, (student,)),
+        (njp.get_student_info, (sample.school, sample.student_name)),
+        (njp.get_assigned_students_for_user, (sample.instructor_user['id'],)),
+        (njp.get_master_textbook_list, (sample.subject,)),
+        (njp.get_master_textbook_list, (sample.subject, '基礎')),
+        (njp.get_all_subjects, ()),
+        (njp.get_subjects_for_student, (student,)),
+        (njp.get_all_homework_for_student, (student,)),
+        (njp.get_homework_for_textbook, (student, sample.textbook_id)),
+        (njp.get_bulk_presets, ()),
+        (njp.get_all_master_textbooks, ()),
+        (njp.get_all_students_with_details, ()),
+        (njp.get_all_instructors_for_school, (sample.school,)),
+        (njp.get_all_presets_with_books, ()),
+        (njp.get_total_past_exam_time, (student,)),
+        (njp.get_past_exam_results_for_student, (student,)),
+        (njp.get_student_count_by_school, ()),
+        (njp.get_textbook_count_by_subject, ()),
+        (njp.get_students_for_instructor, (sample.instructor_user['id'],)),
+        (njp.get_all_bug_reports, ()),
+        (njp.get_all_changelog_entries, ()),
+        (njp.get_student_level_statistics, (sample.school,)),
+        (njp.get_student_level_statistics, (None,)),
+        (njp.get_acceptance_results_for_student, (student,)),
+        (njp.get_all_feature_requests, ()),
+        (njp.get_mock_exam_results_for_student, (student,)),
+        (njp.get_all_mock_exam_details_for_school, (sample.school,)),
+        (njp.get_mock_exam_filter_options, (sample.school,)),
+        (njp.get_eiken_results_for_student, (student,)),
+        (njp.get_filtered_root_tables, ()),
+        (njp.get_all_root_tables, ()),
+        (user_manager.get_user, (sample.admin_user['username'],)),
+        (user_manager.authenticate_user, (sample.admin_user['username'], 'password')),
+        (user_manager.load_users, ()),
+    ]
+    if sample.root_table_id is not None:
+        calls += [
+            (njp.get_root_table_metadata, (sample.root_table_id,)),
+            (njp.get_root_table_by_id, (sample.root_table_id,)),
+        ]
+    return calls
+
+
+def capture_select_queries(sample):
+    """読み取りの関数を呼び出し、実行された SELECT を {照合キー: {'function', 'sql'}} で返す"""
+    queries = {}
+    called = set()
+    for func, args in build_calls(sample):
+        # キャッシュに当たるとクエリが実行されないため、呼び出しごとに空にする
+        njp.PROGRESS_CACHE.invalidate()
+        njp.MASTER_DATA_CACHE.invalidate()
+        called.add(func.__name__)
+        with instrumentation.capture_queries() as captured:
+            instrumentation.instrumented(func)(*args)
+        for query in captured:
+            if not _SELECT_START.match(query['sql']):
+                continue
+            key = f"{query['function']}: {normalize_sql(query['sql'])}"
+            queries.setdefault(key, query)
+    return queries, called
+
+
+def extract_select_literals(path):
+    """ソースの関数ごとの SELECT の文字列リテラル: [(関数名, SQL)] (f-string で組み立てる SQL は除く)"""
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=path)
+    literals = []
+    for node in tree.body:
+        if not isinstance(node, ast.FunctionDef):
+            continue
+        formatted = {id(part) for sub in ast.walk(node) if isinstance(sub, ast.JoinedStr) for part in sub.values}
+        for sub in ast.walk(node):
+            if isinstance(sub, ast.Constant) and isinstance(sub.value, str) and id(sub) not in formatted \
+                    and _SELECT_START.match(sub.value):
+                literals.append((node.name, sub.value))
+    return literals
+
+
+def to_generic_sql(sql):
+    """psycopg2 のプレースホルダー (%s / %(name)s) を $1, $2, ... に置き換える"""
+    names = {}
+    counter = iter(range(1, 10000))
+
+    def replace(match):
+        if match.group(0) == '%%':
+            return '%'
+        if match.group(1):
+            if match.group(1) not in names:
+                names[match.group(1)] = next(counter)
+            return f"${names[match.group(1)]}"
+        return f"${next(counter)}"
+    return re.sub(r'%%|%\((\w+)\)s|%s', replace, sql)
+
+
+# --- プランの解析 ---
+
+def _walk(node):
+    yield node
+    for child in node.get('Plans', ()):
+        yield from _walk(child)
+
+
+def plan_shape(node):
+    """プランの形 (ノードの種類・テーブル・インデックス) を1行にする。行数やコストは含めない"""
+    label = node['Node Type']
+    if node.get('Relation Name'):
+        label += f" on {node['Relation Name']}"
+    if node.get('Index Name'):
+        label += f" using {node['Index Name']}"
+    children = node.get('Plans')
+    if children:
+        label += f"({', '.join(plan_shape(child) for child in children)})"
+    return label
+
+
+def analyze_plan(explain_json, table_rows, args):
+    root = explain_json[0]
+    plan = root['Plan']
+    nodes = list(_walk(plan))
+    analyzed = 'Actual Rows' in plan
+
+    seq_scans = sorted({
+        n['Relation Name'] for n in nodes
+        if n['Node Type'] == 'Seq Scan' and table_rows.get(n.get('Relation Name'), 0) >= args.large_table_rows
+    })
+    result = {'shape': plan_shape(plan), 'seq_scans': seq_scans, 'analyzed': analyzed}
+    if not analyzed:
+        return result
+
+    rows_scanned = 0
+    misestimates = []
+    for n in nodes:
+        loops = n.get('Actual Loops', 1) or 1
+        if n.get('Relation Name') or n['Node Type'].endswith('Scan'):
+            rows_scanned += (n['Actual Rows'] + n.get('Rows Removed by Filter', 0)
+                             + n.get('Rows Removed by Index Recheck', 0)) * loops
+        estimated, actual = n['Plan Rows'], n['Actual Rows']
+        if n.get('Actual Loops', 1) == 0 or max(estimated, actual) < MIN_MISESTIMATE_ROWS:
+            continue
+        factor = max(estimated, actual) / max(min(estimated, actual), 1)
+        if factor >= args.misestimate_factor:
+            misestimates.append({
+                'node': n['Node Type'], 'relation': n.get('Relation Name'),
+                'estimated': estimated, 'actual': actual, 'factor': round(factor, 1),
+            })
+    result.update({
+        'rows_scanned': rows_scanned,
+        'shared_hit_blocks': plan.get('Shared Hit Blocks', 0),
+        'shared_read_blocks': plan.get('Shared Read Blocks', 0),
+        'planning_ms': root.get('Planning Time'),
+        'execution_ms': root.get('Execution Time'),
+        'misestimates': misestimates,
+    })
+    return result
+
+
+def table_row_counts(cur):
+    cur.execute(
+        "SELECT relname, GREATEST(reltuples, 0)::bigint FROM pg_class "
+        "WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace"
+    )
+    return dict(cur.fetchall())
+
+
+def explain_queries(args):
+    """全 SELECT を EXPLAIN し、{照合キー: 結果} を返す"""
+    sample = ExplainSample(args.school_prefix, args.seed)
+    captured, called = capture_select_queries(sample)
+    covered_sql = [normalize_sql(q['sql']) for q in captured.values()]
+
+    # 呼び出さなかった関数の SELECT (書き込みの関数の中の確認用のクエリなど) はソースから取り出す
+    static = {}
+    for path in SOURCE_FILES:
+        for function, sql in extract_select_literals(path):
+            normalized = normalize_sql(sql)
+            if function in called or any(normalized in c for c in covered_sql):
+                continue
+            static.setdefault(f"{function}: {normalized}", {'function': function, 'sql': sql})
+
+    results = {}
+    with db_connection() as conn, conn.cursor() as cur:
+        table_rows = table_row_counts(cur)
+        generic_supported = conn.server_version >= 160000
+        if static and not generic_supported:
+            print(f"PostgreSQL 16 未満のため、呼び出さない関数の SELECT {len(static)} 件は検査しません。")
+        targets = [(k, q, 'analyze') for k, q in captured.items()]
+        if generic_supported:
+            targets += [(k, q, 'generic') for k, q in static.items()]
+
+        for key, query, mode in targets:
+            entry = {'function': query['function'], 'mode': mode, 'sql': normalize_sql(query['sql'])}
+            try:
+                cur.execute(f"SET LOCAL statement_timeout = {int(args.statement_timeout)}")
+                if mode == 'analyze':
+                    cur.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query['sql']}")
+                else:
+                    cur.execute(f"EXPLAIN (GENERIC_PLAN, FORMAT JSON) {to_generic_sql(query['sql'])}")
+                entry.update(analyze_plan(cur.fetchone()[0], table_rows, args))
+            except psycopg2.Error as e:
+                entry['error'] = str(e).strip().splitlines()[0]
+            finally:
+                # ANALYZE で実行した分も含め、毎回ロールバックする
+                conn.rollback()
+            results[key] = entry
+    return results
+
+
+# --- 表示・比較 ---
+
+def print_results(queries):
+    analyzed = [q for q in queries.values() if q.get('analyzed')]
+    print(f"\n検査したクエリ: {len(queries)} 件 (ANALYZE {len(analyzed)} 件, GENERIC_PLAN "
+          f"{sum(1 for q in queries.values() if q['mode'] == 'generic')} 件, "
+          f"エラー {sum(1 for q in queries.values() if 'error' in q)} 件)")
+    print("\n--- 走査行数の多いクエリ ---")
+    for q in sorted(analyzed, key=lambda q: q['rows_scanned'], reverse=True)[:15]:
+        print(f"  {q['rows_scanned']:>10,}行  バッファ {q['shared_hit_blocks'] + q['shared_read_blocks']:>7,}  "
+              f"{q['execution_ms']:8.2f}ms  {q['function']}")
+
+    flagged = [(k, q) for k, q in queries.items() if q.get('seq_scans') or q.get('misestimates')]
+    if flagged:
+        print("\n--- 要確認 ---")
+    for key, q in flagged:
+        notes = [f"Seq Scan on {', '.join(q['seq_scans'])}"] if q.get('seq_scans') else []
+        notes += [
+            f"見積もりのずれ {m['node']}{' on ' + m['relation'] if m['relation'] else ''} "
+            f"(見積 {m['estimated']:,} / 実際 {m['actual']:,})"
+            for m in q.get('misestimates', ())
+        ]
+        print(f"  {q['function']} [{q['mode']}]: {'; '.join(notes)}\n      {q['sql'][:200]}")
+    for key, q in queries.items():
+        if 'error' in q:
+            print(f"  (EXPLAIN できません) {q['function']}: {q['error']}")
+
+
+def _increased(current, base, threshold, min_diff):
+    return current - base >= min_diff and current > base * (1 + threshold)
+
+
+def compare_results(current, baseline, threshold):
+    """baseline と比べた回帰のメッセージのリストを返す"""
+    regressions = []
+    base_queries = baseline['queries']
+    for key, q in current['queries'].items():
+        base = base_queries.get(key)
+        if base is None or 'error' in q or 'error' in base:
+            continue
+        name = q['function']
+        if q['shape'] != base['shape']:
+            regressions.append(f"{name}: プランが変わりました\n      {base['shape']}\n   -> {q['shape']}")
+        new_seq_scans = set(q['seq_scans']) - set(base['seq_scans'])
+        if new_seq_scans:
+            regressions.append(f"{name}: 新しい Seq Scan ({', '.join(sorted(new_seq_scans))})")
+        if not (q.get('analyzed') and base.get('analyzed')):
+            continue
+        if _increased(q['rows_scanned'], base['rows_scanned'], threshold, MIN_ROWS_DIFF):
+            regressions.append(f"{name}: 走査行数 {base['rows_scanned']:,} -> {q['rows_scanned']:,}")
+        buffers = q['shared_hit_blocks'] + q['shared_read_blocks']
+        base_buffers = base['shared_hit_blocks'] + base['shared_read_blocks']
+        if _increased(buffers, base_buffers, threshold, MIN_BUFFERS_DIFF):
+            regressions.append(f"{name}: バッファ {base_buffers:,} -> {buffers:,}")
+        base_misses = {(m['node'], m['relation']) for m in base['misestimates']}
+        for m in q['misestimates']:
+            if (m['node'], m['relation']) not in base_misses:
+                regressions.append(
+                    f"{name}: 新しい見積もりのずれ {m['node']}{' on ' + m['relation'] if m['relation'] else ''} "
+                    f"(見積 {m['estimated']:,} / 実際 {m['actual']:,})"
+                )
+    missing = set(base_queries) - set(current['queries'])
+    if missing:
+        print(f"基準の結果にあり、今回見つからなかったクエリ: {len(missing)} 件 (SQL の変更・削除)")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="データ層の SELECT のクエリプランを検査します。")
+    parser.add_argument('--scale', type=float, default=0.2, help="合成データの規模 (generate_synthetic_data.py の --scale)")
+    parser.add_argument('--no-generate', action='store_true', help="合成データを投入し直さず、現在のDBで検査する")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--school-prefix', default='合成校')
+    parser.add_argument('--large-table-rows', type=int, default=10000, help="Seq Scan を表示するテーブルの行数")
+    parser.add_argument('--misestimate-factor', type=float, default=10.0, help="見積もりのずれとみなす倍率")
+    parser.add_argument('--statement-timeout', type=int, default=30000, help="1クエリの上限 (ミリ秒)")
+    parser.add_argument('--output', help=f"結果の保存先 (省略時は {RESULTS_DIR}/explain_<日時>.json)")
+    parser.add_argument('--input', help="検査せず、保存済みの結果を --compare と比較する")
+    parser.add_argument('--compare', help="比較する基準の結果 (JSON)")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help="回帰とみなす走査行数・バッファの増加率")
+    args = parser.parse_args(argv)
+    if args.input and not args.compare:
+        parser.error("--input は --compare と一緒に指定してください。")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.input:
+        with open(args.input, encoding='utf-8') as f:
+            current = json.load(f)
+    else:
+        if not instrumentation.ENABLED:
+            print("QUERY_INSTRUMENTATION=false のため、実行された SQL を記録できません。")
+            return 1
+        try:
+            if not args.no_generate:
+                print(f"--- 合成データを投入します (scale={args.scale:g}) ---")
+                success, message = generate_synthetic_data.generate(generate_synthetic_data.parse_args([
+                    '--scale', str(args.scale), '--seed', str(args.seed), '--school-prefix', args.school_prefix, '--replace'
+                ]))
+                print(message)
+                if not success:
+                    return 1
+            print("--- EXPLAIN を実行します ---")
+            queries = explain_queries(args)
+            dataset = dataset_counts()
+        except (Exception, psycopg2.Error) as e:
+            print(f"検査中にエラーが発生しました: {e}")
+            return 1
+        current = {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': git_revision(),
+            'dataset_label': 'current' if args.no_generate else f"scale={args.scale:g}",
+            'dataset': dataset,
+            'queries': queries,
+        }
+        print_results(queries)
+        output = args.output or os.path.join(RESULTS_DIR, f"explain_{datetime.now():%Y%m%d_%H%M%S}.json")
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(current, f, ensure_ascii=False, indent=2)
+        print(f"\n結果を保存しました: {output}")
+
+    if not args.compare:
+        return 0
+    with open(args.compare, encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"\n--- 比較: {args.compare} ({baseline.get('git_revision')}) -> {current.get('git_revision')} ---")
+    if baseline.get('dataset_label') != current.get('dataset_label'):
+        print(f"注意: データの規模が異なります ({baseline.get('dataset_label')} / {current.get('dataset_label')})。")
+    regressions = compare_results(current, baseline, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} 件の回帰が見つかりました:")
+        for message in regressions:
+            print(f"  - {message}")
+        return 1
+    print("回帰は見つかりませんでした。")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,287 @@
+# generate_synthetic_data.py
+
+"""
+性能検証用の合成データを既存のスキーマへ投入する
+
+校舎数・校舎あたりの生徒数・講師数と、生徒1人あたりの進捗・宿題・過去問・模試・入試結果の件数を指定し、
+COPY でまとめて投入する。同じ --seed と件数なら同じ内容になる (パスワードのハッシュと投入先のIDを除く)。
+
+    # 本番規模 (50校舎 x 400人 = 生徒2万人)
+    python generate_synthetic_data.py --scale 1
+    # 1/10 規模で、前回投入した合成データを削除してから投入し直す
+    python generate_synthetic_data.py --scale 0.1 --replace
+
+合成データの校舎名は --school-prefix (既定: 合成校) で始まり、--replace はその校舎の生徒・講師だけを削除する。
+参考書マスター (initialize_database.py で投入) が必要。講師のパスワードはすべて 'password'。
+"""
+import argparse
+import csv
+import io
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import date, timedelta
+
+import psycopg2
+from dotenv import load_dotenv
+from werkzeug.security import generate_password_hash
+
+from data.invalidation import notify, TOPIC_STUDENT, TOPIC_PROGRESS, TOPIC_HOMEWORK
+from data.level_stats import ACHIEVEMENT_LEVELS, rebuild_level_achievement_stats
+
+# .envファイルから環境変数を読み込む
+load_dotenv()
+
+DATABASE_URL = os.getenv('DATABASE_URL')
+
+# --scale 1 のときの校舎数 (校舎あたりの生徒数は --students-per-school)
+BASE_SCHOOLS = 50
+
+GRADES = ['高1', '高2', '高3', '既卒']
+UNIVERSITIES = [
+    ('早稲田大学', ['政治経済学部', '法学部', '商学部', '文学部']),
+    ('慶應義塾大学', ['経済学部', '法学部', '商学部', '理工学部']),
+    ('明治大学', ['政治経済学部', '法学部', '商学部', '理工学部']),
+    ('青山学院大学', ['経済学部', '法学部', '文学部']),
+    ('立教大学', ['経済学部', '法学部', '文学部']),
+    ('中央大学', ['法学部', '経済学部', '理工学部']),
+    ('法政大学', ['経済学部', '法学部', '社会学部']),
+    ('日本大学', ['法学部', '経済学部', '文理学部', '理工学部']),
+]
+EXAM_SYSTEMS = ['一般', '共通テスト利用', '総合型選抜']
+EXAM_SUBJECTS = ['英語', '数学', '国語', '日本史', '世界史', '物理', '化学']
+ACCEPTANCE_RESULTS = ['合格', '不合格', '補欠', None]
+MOCK_EXAM_NAMES = ['全統模試', '共通テスト模試', '早慶レベル模試']
+MOCK_DESC_COLUMNS = [
+    'subject_kokugo_desc', 'subject_math_desc', 'subject_english_desc',
+    'subject_rika1_desc', 'subject_shakai1_desc'
+]
+MOCK_MARK_COLUMNS = [
+    'subject_gendaibun_mark', 'subject_kobun_mark', 'subject_kanbun_mark',
+    'subject_math1a_mark', 'subject_math2bc_mark', 'subject_english_r_mark', 'subject_english_l_mark',
+    'subject_rika1_mark', 'subject_shakai1_mark', 'subject_info_mark'
+]
+
+
+def get_db_connection():
+    """PostgreSQLデータベース接続を取得します。"""
+    if not DATABASE_URL:
+        raise ValueError("エラー: 環境変数 'DATABASE_URL' が設定されていません。")
+    return psycopg2.connect(DATABASE_URL)
+
+
+def copy_rows(cur, table, columns, rows):
+    """rows (タプルのリスト) を COPY で投入する。None は NULL になる (空文字は使わないこと)"""
+    if not rows:
+        return 0
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    return len(rows)
+
+
+def reserve_ids(cur, table, count):
+    """table の id の連番を count 件分先に確保する (子テーブルの行を同じ COPY の流れで作るため)"""
+    cur.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)", (table, count))
+    return [row[0] for row in cur.fetchall()]
+
+
+def delete_synthetic_data(cur, school_prefix):
+    """school_prefix で始まる校舎の生徒・講師を削除する (進捗・宿題・試験結果は外部キーで一緒に消える)"""
+    pattern = school_prefix.replace('%', r'\%').replace('_', r'\_') + '%'
+    cur.execute("DELETE FROM students WHERE school LIKE %s", (pattern,))
+    students = cur.rowcount
+    cur.execute("DELETE FROM users WHERE school LIKE %s", (pattern,))
+    print(f"  - 既存の合成データを削除しました (生徒 {students} 人, 講師 {cur.rowcount} 人)。")
+
+
+class SyntheticDataGenerator:
+    """1校舎ずつ行を作って COPY で投入する"""
+
+    def __init__(self, cur, args, textbooks):
+        self.cur = cur
+        self.args = args
+        self.textbooks = textbooks # (id, subject, level, book_name, duration) のリスト
+        self.rng = random.Random(args.seed)
+        self.base_date = args.base_date
+        self.password_hash = generate_password_hash('password')
+        self.counts = {}
+
+    def _copy(self, table, columns, rows):
+        self.counts[table] = self.counts.get(table, 0) + copy_rows(self.cur, table, columns, rows)
+
+    def _recent_date(self, days):
+        return self.base_date - timedelta(days=self.rng.randrange(days))
+
+    def generate_school(self, school_index):
+        args, rng = self.args, self.rng
+        school = f"{args.school_prefix}{school_index + 1:03d}"
+
+        # 講師 (1人目は校舎の管理者)
+        user_ids = reserve_ids(self.cur, 'users', args.instructors_per_school)
+        self._copy('users', ['id', 'username', 'password', 'role', 'school'], [
+            (user_id, f"synth_{school_index + 1:03d}_{n + 1:02d}", self.password_hash, 'admin' if n == 0 else 'user', school)
+            for n, user_id in enumerate(user_ids)
+        ])
+
+        student_ids = reserve_ids(self.cur, 'students', args.students_per_school)
+        students, instructors = [], []
+        progress, homework, past_exams, mock_exams, acceptances = [], [], [], [], []
+        for n, student_id in enumerate(student_ids):
+            grade = rng.choice(GRADES)
+            students.append((
+                student_id, f"生徒{school_index + 1:03d}-{n + 1:04d}", school,
+                rng.randint(40, 75), rng.choice(ACHIEVEMENT_LEVELS), grade
+            ))
+            main, *subs = rng.sample(user_ids, min(2, len(user_ids)))
+            instructors.append((student_id, main, 1))
+            instructors.extend((student_id, user_id, 0) for user_id in subs)
+
+            books = rng.sample(self.textbooks, min(args.progress_per_student, len(self.textbooks)))
+            for textbook_id, subject, level, book_name, duration in books:
+                total_units = rng.randint(1, 5)
+                completed_units = rng.randint(0, total_units)
+                progress.append((
+                    student_id, subject, level, book_name, duration, True,
+                    completed_units == total_units, completed_units, total_units, textbook_id
+                ))
+
+            for _ in range(args.homework_per_student):
+                textbook_id, subject, _, _, _ = rng.choice(books or self.textbooks)
+                start_page = rng.randint(1, 200)
+                homework.append((
+                    student_id, textbook_id, subject, f"p.{start_page}-{start_page + rng.randint(5, 30)}",
+                    self._recent_date(180), str(uuid.UUID(int=rng.getrandbits(128))),
+                    rng.choice(['未着手', '完了'])
+                ))
+
+            for _ in range(args.past_exams_per_student):
+                university, faculties = rng.choice(UNIVERSITIES)
+                total_questions = rng.choice([40, 50, 60, 100])
+                total_time = rng.choice([60, 80, 90])
+                past_exams.append((
+                    student_id, self._recent_date(365), university, rng.choice(faculties), rng.choice(EXAM_SYSTEMS),
+                    rng.randint(self.base_date.year - 6, self.base_date.year - 1), rng.choice(EXAM_SUBJECTS),
+                    rng.randint(total_time // 2, total_time), total_time,
+                    rng.randint(0, total_questions), total_questions
+                ))
+
+            for round_index in range(args.mock_exams_per_student):
+                exam_format = rng.choice(['マーク', '記述'])
+                score_columns = MOCK_MARK_COLUMNS if exam_format == 'マーク' else MOCK_DESC_COLUMNS
+                scores = {column: rng.randint(20, 100) for column in score_columns}
+                mock_exams.append((
+                    student_id, rng.choice(['自己採点', '結果']), rng.choice(MOCK_EXAM_NAMES), exam_format,
+                    grade if grade != '既卒' else '高3', f"第{round_index % 4 + 1}回", self._recent_date(365),
+                    *(scores.get(column) for column in MOCK_DESC_COLUMNS + MOCK_MARK_COLUMNS)
+                ))
+
+            for _ in range(args.acceptances_per_student):
+                university, faculties = rng.choice(UNIVERSITIES)
+                exam_date = self._recent_date(120)
+                acceptances.append((
+                    student_id, university, rng.choice(faculties), None, rng.choice(EXAM_SYSTEMS),
+                    rng.choice(ACCEPTANCE_RESULTS), exam_date - timedelta(days=30), exam_date,
+                    exam_date + timedelta(days=10), exam_date + timedelta(days=20)
+                ))
+
+        self._copy('students', ['id', 'name', 'school', 'deviation_value', 'target_level', 'grade'], students)
+        self._copy('student_instructors', ['student_id', 'user_id', 'is_main'], instructors)
+        self._copy('progress', [
+            'student_id', 'subject', 'level', 'book_name', 'duration', 'is_planned', 'is_done',
+            'completed_units', 'total_units', 'master_textbook_id'
+        ], progress)
+        self._copy('homework', [
+            'student_id', 'master_textbook_id', 'subject', 'task', 'task_date', 'task_group_id', 'status'
+        ], homework)
+        self._copy('past_exam_results', [
+            'student_id', 'date', 'university_name', 'faculty_name', 'exam_system', 'year', 'subject',
+            'time_required', 'total_time_allowed', 'correct_answers', 'total_questions'
+        ], past_exams)
+        self._copy('mock_exam_results', [
+            'student_id', 'result_type', 'mock_exam_name', 'mock_exam_format', 'grade', 'round', 'exam_date'
+        ] + MOCK_DESC_COLUMNS + MOCK_MARK_COLUMNS, mock_exams)
+        self._copy('university_acceptance', [
+            'student_id', 'university_name', 'faculty_name', 'department_name', 'exam_system', 'result',
+            'application_deadline', 'exam_date', 'announcement_date', 'procedure_deadline'
+        ], acceptances)
+
+
+def generate(args):
+    conn = None
+    try:
+        conn = get_db_connection()
+        started = time.monotonic()
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, subject, level, book_name, duration FROM master_textbooks ORDER BY id")
+            textbooks = cur.fetchall()
+            if not textbooks:
+                return False, "参考書マスターが空です。先に initialize_database.py を実行してください。"
+
+            if args.replace:
+                delete_synthetic_data(cur, args.school_prefix)
+
+            generator = SyntheticDataGenerator(cur, args, textbooks)
+            for school_index in range(args.schools):
+                generator.generate_school(school_index)
+                print(f"  - {school_index + 1}/{args.schools} 校舎を投入しました。", end='\r')
+            print()
+
+            # 統計ページの集計テーブルと、実行中のアプリのキャッシュを合わせる
+            rebuild_level_achievement_stats(conn)
+            for topic in (TOPIC_STUDENT, TOPIC_PROGRESS, TOPIC_HOMEWORK):
+                notify(conn, topic)
+        conn.commit()
+
+        # 投入直後でも実行計画が実データに合うよう統計情報を更新する
+        with conn.cursor() as cur:
+            for table in generator.counts:
+                cur.execute(f"ANALYZE {table}")
+        conn.commit()
+
+        summary = ', '.join(f"{table} {count}" for table, count in generator.counts.items())
+        return True, f"合成データを投入しました ({time.monotonic() - started:.1f}秒): {summary}"
+    except (Exception, psycopg2.Error) as e:
+        print(f"データベースエラー (generate_synthetic_data): {e}")
+        if conn:
+            conn.rollback()
+        return False, f"合成データの投入中にエラーが発生しました: {e}"
+    finally:
+        if conn:
+            conn.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="性能検証用の合成データを COPY で投入します。")
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help=f"規模 (1 で {BASE_SCHOOLS} 校舎。--schools を指定した場合はそちらを優先)")
+    parser.add_argument('--schools', type=int, help="校舎数")
+    parser.add_argument('--students-per-school', type=int, default=400)
+    parser.add_argument('--instructors-per-school', type=int, default=8)
+    parser.add_argument('--progress-per-student', type=int, default=30)
+    parser.add_argument('--homework-per-student', type=int, default=20)
+    parser.add_argument('--past-exams-per-student', type=int, default=10)
+    parser.add_argument('--mock-exams-per-student', type=int, default=4)
+    parser.add_argument('--acceptances-per-student', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--base-date', type=date.fromisoformat, default=date(2025, 10, 1),
+                        help="日付の基準日 (YYYY-MM-DD)。各日付はこの日以前に散らばる")
+    parser.add_argument('--school-prefix', default='合成校', help="合成データの校舎名の接頭辞")
+    parser.add_argument('--replace', action='store_true', help="同じ接頭辞の校舎の既存データを削除してから投入する")
+    args = parser.parse_args(argv)
+    if args.schools is None:
+        args.schools = max(1, round(BASE_SCHOOLS * args.scale))
+    if args.instructors_per_school < 1 or args.students_per_school < 1:
+        parser.error("--instructors-per-school と --students-per-school は 1 以上を指定してください。")
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    print(f"--- 合成データの投入を開始します ({args.schools} 校舎 x {args.students_per_school} 人) ---")
+    success, message = generate(args)
+    print(message)
+    sys.exit(0 if success else 1)
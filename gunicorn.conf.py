@@ -0,0 +1,27 @@
+# gunicorn.conf.py
+
+"""
+gunicorn の設定 (gunicorn -c gunicorn.conf.py app_main:server)
+
+/metrics の値を全ワーカーで集計するため、prometheus_client の multiprocess モードを使う。
+各ワーカーは PROMETHEUS_MULTIPROC_DIR に値を書き出し、どのワーカーが /metrics に応答しても全ワーカー分を返す。
+ディレクトリは起動時に空にし、終了したワーカーの分は child_exit で片付ける。
+"""
+import os
+import shutil
+
+bind = f"0.0.0.0:{os.getenv('PORT', 8051)}"
+workers = int(os.getenv('WEB_CONCURRENCY', 4))
+
+PROMETHEUS_MULTIPROC_DIR = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus_multiproc')
+
+
+def on_starting(server):
+    # 前回の起動時の値が残っていると合計が狂うため、マスター起動時に空にする
+    shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -9,6 +9,8 @@ import psycopg2
 from psycopg2.extras import DictCursor, execute_values
 from dotenv import load_dotenv
 
+from migrations.runner import run_migrations
+
 # .envファイルを読み込んで環境変数を設定
 load_dotenv()
 
@@ -140,7 +142,7 @@ def create_all_tables(conn):
                 custom_textbook_name TEXT,
                 subject TEXT NOT NULL,
                 task TEXT NOT NULL,
-                task_date TEXT NOT NULL,
+                task_date DATE NOT NULL,
                 task_group_id TEXT,
                 status TEXT NOT NULL DEFAULT '未着手',
                 other_info TEXT,
@@ -176,7 +178,7 @@ def create_all_tables(conn):
             CREATE TABLE IF NOT EXISTS past_exam_results (
                 id SERIAL PRIMARY KEY,
                 student_id INTEGER NOT NULL,
-                date TEXT NOT NULL,
+                date DATE NOT NULL,
                 university_name TEXT NOT NULL,
                 faculty_name TEXT,
                 exam_system TEXT,
@@ -201,10 +203,10 @@ def create_all_tables(conn):
                 department_name TEXT,
                 exam_system TEXT,
                 result TEXT, -- '合格', '不合格', または NULL
-                application_deadline TEXT,
-                exam_date TEXT,
-                announcement_date TEXT,
-                procedure_deadline TEXT,
+                application_deadline DATE,
+                exam_date DATE,
+                announcement_date DATE,
+                procedure_deadline DATE,
                 FOREIGN KEY (student_id) REFERENCES students (id) ON DELETE CASCADE
             )
         ''')
@@ -503,6 +505,11 @@ if __name__ == '__main__':
         import_master_textbooks(connection)
         setup_bulk_presets_from_json(connection)
 
+        # インデックスなどのスキーマ変更を適用
+        print("--- マイグレーションの適用を開始 ---")
+        run_migrations(connection)
+        print("--- マイグレーションの適用が完了 ---\n")
+
         print("\n🎉🎉🎉 データベースの初期化がすべて完了しました！ 🎉🎉🎉")
 
     except (Exception, psycopg2.Error) as e:
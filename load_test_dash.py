@@ -0,0 +1,523 @@
+# load_test_dash.py
+
+"""
+Dash コールバックを直接呼び出す負荷試験
+
+実際の通信の大半はページの読み込みではなく /_dash-update-component への POST のため、
+ブラウザ (Dash のレンダラー) と同じ手順でコールバックを呼び出す仮想の講師を複数スレッドで動かす。
+
+- 起動中のサーバーから /_dash-dependencies (登録済みのコールバック) と /_dash-layout を取得し、
+  コンポーネントのプロパティをクライアント側に保持する
+- プロパティを変更すると、それを Input に持つコールバックを送信し、応答で更新されたプロパティや
+  新しく表示されたコンポーネントから連鎖するコールバックも順に送信する (パターンマッチ ALL / MATCH に対応、
+  clientside callback は送信しない)
+- シナリオ: ログイン → 生徒を選択 → 科目タブを切り替え → 学習計画モーダルを開閉 → 進捗を保存 → 過去問ページ
+
+    # 合成データ (generate_synthetic_data.py) の各校舎の管理者 4人で 60秒
+    python load_test_dash.py --url http://127.0.0.1:8051 --concurrency 4 --duration 60
+
+結果はコールバック (出力) ごとの件数・エラー率・p50/p95/p99 と全体のスループットを表示し、--output で JSON に保存する。
+進捗を保存するため、ローカルまたは検証用のサーバーに対してのみ実行すること。
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+DASH_UPDATE_PATH = '/_dash-update-component'
+
+# 1回の操作から連鎖して送信するコールバックの段数の上限 (Interval などによる無限の連鎖を防ぐ)
+MAX_CHAIN_ROUNDS = 10
+
+WILDCARDS = ('ALL', 'MATCH', 'ALLSMALLER')
+
+
+# --- コンポーネントID ---
+
+def _parse_id(value):
+    """依存関係のIDは文字列、パターンマッチのIDは JSON 文字列"""
+    return json.loads(value) if value.startswith('{') else value
+
+
+def _id_key(component_id):
+    """コンポーネントIDを辞書のキーにする (Dash の応答と同じ文字列表現)"""
+    if isinstance(component_id, dict):
+        return json.dumps(component_id, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return component_id
+
+
+def _wildcard(value):
+    return isinstance(value, list) and len(value) == 1 and value[0] in WILDCARDS and value[0]
+
+
+def _matches(pattern, component_id, match_values=None):
+    if not isinstance(component_id, dict) or set(pattern) != set(component_id):
+        return False
+    for key, value in pattern.items():
+        wildcard = _wildcard(value)
+        if wildcard == 'MATCH' and match_values is not None and key in match_values:
+            if component_id[key] != match_values[key]:
+                return False
+        elif not wildcard and component_id[key] != value:
+            return False
+    return True
+
+
+def _is_component(value):
+    return isinstance(value, dict) and 'props' in value and 'type' in value
+
+
+class CallbackSpec:
+    """/_dash-dependencies の1件"""
+
+    def __init__(self, dependency):
+        self.output = dependency['output']
+        self.multi = self.output.startswith('..')
+        outputs = self.output[2:-2].split('...') if self.multi else [self.output]
+        self.outputs = [(_parse_id(o.rsplit('.', 1)[0]), o.rsplit('.', 1)[1]) for o in outputs]
+        self.inputs = [(_parse_id(i['id']), i['property']) for i in dependency['inputs']]
+        self.state = [(_parse_id(s['id']), s['property']) for s in dependency['state']]
+        self.prevent_initial_call = dependency.get('prevent_initial_call', False)
+        self.clientside = bool(dependency.get('clientside_function'))
+        # 集計用の名前 (allow_duplicate の @ハッシュは除く)
+        self.label = re.sub(r'@[0-9a-f]{16,}', '', self.output)
+
+    def input_match(self, component_id, prop):
+        """component_id.prop がこのコールバックの Input なら (True, MATCH の値) を返す"""
+        for spec_id, spec_prop in self.inputs:
+            if spec_prop != prop:
+                continue
+            if isinstance(spec_id, str):
+                if spec_id == component_id:
+                    return True, None
+            elif _matches(spec_id, component_id):
+                return True, {k: component_id[k] for k, v in spec_id.items() if _wildcard(v) == 'MATCH'} or None
+        return False, None
+
+    def references(self, component_id):
+        """component_id が Input または Output に含まれるか (新しく表示されたコンポーネントの初回呼び出しの判定)"""
+        for spec_id, _ in self.inputs + self.outputs:
+            if spec_id == component_id or (isinstance(spec_id, dict) and _matches(spec_id, component_id)):
+                return True
+        return False
+
+
+class _MissingComponent(Exception):
+    """コールバックの Input/State/Output のコンポーネントが画面にない (レンダラーは送信しない)"""
+
+
+class Recorder:
+    """全仮想講師の結果をコールバックごとに集計する"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.callbacks = {} # ラベル -> {'latencies': [...], 'errors': n, 'bytes': n}
+        self.steps = {}     # シナリオの手順 -> {'latencies': [...], 'skipped': n}
+        self.iterations = 0
+
+    def record_callback(self, label, seconds, status, size):
+        with self._lock:
+            stats = self.callbacks.setdefault(label, {'latencies': [], 'errors': 0, 'bytes': 0})
+            stats['latencies'].append(seconds)
+            stats['errors'] += int(status >= 400)
+            stats['bytes'] += size
+
+    def record_step(self, name, seconds, performed):
+        with self._lock:
+            stats = self.steps.setdefault(name, {'latencies': [], 'skipped': 0})
+            if performed:
+                stats['latencies'].append(seconds)
+            else:
+                stats['skipped'] += 1
+
+    def record_iteration(self):
+        with self._lock:
+            self.iterations += 1
+
+
+class DashClient:
+    """1人分のブラウザの代わりにコンポーネントのプロパティを保持し、コールバックを送信する"""
+
+    def __init__(self, base_url, callbacks, recorder, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.callbacks = callbacks
+        self.recorder = recorder
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.components = {} # キー -> {'id': 元のID, 'props': {...}}
+        self._children = {}  # (親のキー, プロパティ) -> その下に表示されているコンポーネントのキーの集合
+
+    # --- レイアウト ---
+
+    def load_layout(self):
+        response = self.session.get(f"{self.base_url}/_dash-layout", timeout=self.timeout)
+        response.raise_for_status()
+        self.components.clear()
+        self._children.clear()
+        added = set()
+        self._register(response.json(), (None, 'layout'), added)
+        self._run(self._initial_calls(added))
+
+    def _register(self, value, owner, added):
+        if isinstance(value, list):
+            for item in value:
+                self._register(item, owner, added)
+            return
+        if not _is_component(value):
+            return
+        props = value['props']
+        key = _id_key(props['id']) if 'id' in props else None
+        if key is not None:
+            self.components[key] = {'id': props['id'], 'props': dict(props)}
+            self._children.setdefault(owner, set()).add(key)
+            added.add(key)
+        for prop, child in props.items():
+            if _is_component(child) or isinstance(child, list):
+                # ID の無いコンポーネントの子は、ID のある最も近い祖先のプロパティの下に登録する
+                self._register(child, (key, prop) if key is not None else owner, added)
+
+    def _remove_children(self, owner):
+        for key in self._children.pop(owner, ()):
+            self.components.pop(key, None)
+            for child_owner in [o for o in self._children if o[0] == key]:
+                self._remove_children(child_owner)
+
+    def find(self, predicate):
+        """predicate(コンポーネントID) を満たす表示中のコンポーネントのIDのリスト"""
+        return [c['id'] for c in self.components.values() if predicate(c['id'])]
+
+    def get_prop(self, component_id, prop, default=None):
+        component = self.components.get(_id_key(component_id))
+        return component['props'].get(prop, default) if component else default
+
+    # --- 操作 ---
+
+    def set_props(self, component_id, **props):
+        """ユーザーの操作としてプロパティを変更し、連鎖するコールバックをすべて送信する"""
+        key = _id_key(component_id)
+        if key not in self.components:
+            raise _MissingComponent(key)
+        self.components[key]['props'].update(props)
+        self._run(self._triggered_calls([(component_id, prop) for prop in props]))
+
+    def click(self, component_id):
+        self.set_props(component_id, n_clicks=(self.get_prop(component_id, 'n_clicks') or 0) + 1)
+
+    # --- コールバックの送信 ---
+
+    def _triggered_calls(self, changed, source=None):
+        """
+        変更されたプロパティを Input に持つコールバック: {(コールバック, MATCHの値): changedPropIds}
+        レンダラーと同様に、変更元のコールバック自身 (Input と Output が同じプロパティ) は呼び直さない。
+        """
+        calls = {}
+        for spec in self.callbacks:
+            if spec.clientside or spec is source:
+                continue
+            for component_id, prop in changed:
+                hit, match_values = spec.input_match(component_id, prop)
+                if hit:
+                    call_key = (spec, json.dumps(match_values, sort_keys=True))
+                    calls.setdefault(call_key, []).append(f"{_id_key(component_id)}.{prop}")
+        return calls
+
+    def _initial_calls(self, added):
+        """新しく表示されたコンポーネントに関わる prevent_initial_call でないコールバック"""
+        calls = {}
+        for spec in self.callbacks:
+            if spec.clientside or spec.prevent_initial_call:
+                continue
+            for key in added:
+                component_id = self.components[key]['id'] if key in self.components else None
+                if component_id is not None and spec.references(component_id):
+                    match_values = None
+                    if isinstance(component_id, dict):
+                        match_values = {k: component_id[k] for spec_id, _ in spec.inputs + spec.outputs
+                                        if isinstance(spec_id, dict) and _matches(spec_id, component_id)
+                                        for k, v in spec_id.items() if _wildcard(v) == 'MATCH'} or None
+                    calls.setdefault((spec, json.dumps(match_values, sort_keys=True)), [])
+        return calls
+
+    def _run(self, calls):
+        for _ in range(MAX_CHAIN_ROUNDS):
+            if not calls:
+                return
+            next_calls = {}
+            for (spec, match_json), changed_ids in calls.items():
+                changed, added = self._send(spec, json.loads(match_json), changed_ids)
+                for call_key, ids in self._triggered_calls(changed, source=spec).items():
+                    next_calls.setdefault(call_key, []).extend(ids)
+                for call_key, ids in self._initial_calls(added).items():
+                    next_calls.setdefault(call_key, []).extend(ids)
+            calls = next_calls
+
+    def _resolve(self, spec_id, prop, match_values, with_value=True):
+        def entry(component):
+            item = {'id': component['id'], 'property': prop}
+            if with_value:
+                item['value'] = component['props'].get(prop.split('@')[0])
+            return item
+
+        if isinstance(spec_id, str):
+            component = self.components.get(spec_id)
+            if component is None:
+                raise _MissingComponent(spec_id)
+            return entry(component)
+        found = [c for c in self.components.values() if _matches(spec_id, c['id'], match_values)]
+        if any(_wildcard(v) in ('ALL', 'ALLSMALLER') for v in spec_id.values()):
+            return [entry(c) for c in found]
+        if not found:
+            raise _MissingComponent(_id_key(spec_id))
+        return entry(found[0])
+
+    def _send(self, spec, match_values, changed_ids):
+        """コールバックを1回送信して応答を反映し、(変更されたプロパティ, 新しく表示されたコンポーネント) を返す"""
+        try:
+            outputs = [self._resolve(i, p, match_values, with_value=False) for i, p in spec.outputs]
+            body = {
+                'output': spec.output,
+                'outputs': outputs if spec.multi else outputs[0],
+                'inputs': [self._resolve(i, p, match_values) for i, p in spec.inputs],
+                'state': [self._resolve(i, p, match_values) for i, p in spec.state],
+                'changedPropIds': changed_ids,
+            }
+        except _MissingComponent:
+            return [], set()
+
+        start = time.perf_counter()
+        try:
+            response = self.session.post(f"{self.base_url}{DASH_UPDATE_PATH}", json=body, timeout=self.timeout)
+        except requests.RequestException:
+            self.recorder.record_callback(spec.label, time.perf_counter() - start, 599, 0)
+            return [], set()
+        self.recorder.record_callback(spec.label, time.perf_counter() - start, response.status_code, len(response.content))
+        if response.status_code != 200:
+            return [], set()
+
+        payload = response.json()
+        changed, added = [], set()
+        for updates in (payload.get('response') or {}, payload.get('sideUpdate') or {}):
+            for key, props in updates.items():
+                key = _id_key(_parse_id(key))
+                component = self.components.get(key)
+                if component is None:
+                    continue
+                for prop, value in props.items():
+                    if _is_component(value) or (isinstance(value, list) and any(_is_component(v) for v in value)):
+                        self._remove_children((key, prop))
+                        self._register(value, (key, prop), added)
+                    component['props'][prop] = value
+                    changed.append((component['id'], prop))
+        return changed, added
+
+
+class VirtualInstructor:
+    """シナリオを繰り返す仮想の講師 (1スレッド)"""
+
+    def __init__(self, index, args, callbacks, recorder):
+        self.args = args
+        self.callbacks = callbacks
+        self.recorder = recorder
+        self.username = args.usernames[index % len(args.usernames)]
+        self.rng = random.Random(args.seed + index)
+
+    def _step(self, name, action):
+        start = time.perf_counter()
+        try:
+            performed = action() is not False
+        except _MissingComponent:
+            performed = False
+        self.recorder.record_step(name, time.perf_counter() - start, performed)
+        if self.args.think_time:
+            time.sleep(self.rng.uniform(0, 2 * self.args.think_time))
+
+    def run_scenario(self):
+        client = DashClient(self.args.url, self.callbacks, self.recorder)
+
+        def open_app():
+            client.load_layout()
+            client.set_props('url', pathname='/')
+
+        def login():
+            client.set_props('username-input', value=self.username)
+            client.set_props('password-input', value=self.args.password)
+            client.click('login-button')
+            return bool(client.get_prop('auth-store', 'data'))
+
+        def pick_student():
+            options = client.get_prop('student-dropdown', 'options') or []
+            if not options:
+                return False
+            client.set_props('student-dropdown', value=self.rng.choice(options)['value'])
+
+        def switch_tabs():
+            tabs = [t['props'].get('tab_id') for t in client.get_prop('subject-tabs', 'children') or [] if _is_component(t)]
+            subjects = [t for t in tabs if t and t != '総合']
+            if not subjects:
+                return False
+            for tab in self.rng.sample(subjects, min(self.args.max_tabs, len(subjects))):
+                client.set_props('subject-tabs', active_tab=tab)
+
+        def open_plan_modal():
+            buttons = client.find(lambda i: isinstance(i, dict) and i.get('type') == 'open-plan-modal')
+            if not buttons:
+                return False
+            client.click(buttons[0])
+            client.click('plan-cancel-btn')
+
+        def save_progress():
+            buttons = client.find(lambda i: isinstance(i, dict) and i.get('type') == 'save-subject-progress-btn')
+            if not buttons:
+                return False
+            client.click(buttons[0])
+
+        def open_past_exam_page():
+            client.set_props('url', pathname='/past-exam')
+
+        for name, action in [
+            ('ページを開く', open_app), ('ログイン', login), ('生徒を選択', pick_student),
+            ('科目タブの切替', switch_tabs), ('学習計画モーダル', open_plan_modal),
+            ('進捗の保存', save_progress), ('過去問ページ', open_past_exam_page),
+        ]:
+            self._step(name, action)
+        self.recorder.record_iteration()
+
+    def run(self, deadline, iterations):
+        done = 0
+        while time.monotonic() < deadline and (iterations is None or done < iterations):
+            try:
+                self.run_scenario()
+            except requests.RequestException as e:
+                print(f"[{self.username}] 通信エラー: {e}")
+                time.sleep(1)
+            done += 1
+
+
+def _percentile_ms(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))] * 1000
+
+
+def summarize(recorder, elapsed):
+    callbacks = {}
+    for label, stats in recorder.callbacks.items():
+        latencies = sorted(stats['latencies'])
+        count = len(latencies)
+        callbacks[label] = {
+            'count': count,
+            'errors': stats['errors'],
+            'error_rate': stats['errors'] / count if count else 0.0,
+            'total_ms': sum(latencies) * 1000,
+            'p50_ms': _percentile_ms(latencies, 0.50),
+            'p95_ms': _percentile_ms(latencies, 0.95),
+            'p99_ms': _percentile_ms(latencies, 0.99),
+            'max_ms': latencies[-1] * 1000 if latencies else 0.0,
+            'avg_bytes': stats['bytes'] / count if count else 0,
+        }
+    steps = {
+        name: {
+            'count': len(stats['latencies']),
+            'skipped': stats['skipped'],
+            'p50_ms': _percentile_ms(sorted(stats['latencies']), 0.50),
+            'p95_ms': _percentile_ms(sorted(stats['latencies']), 0.95),
+        }
+        for name, stats in recorder.steps.items()
+    }
+    total = sum(c['count'] for c in callbacks.values())
+    errors = sum(c['errors'] for c in callbacks.values())
+    return {
+        'elapsed_seconds': elapsed,
+        'scenario_iterations': recorder.iterations,
+        'callback_requests': total,
+        'throughput_rps': total / elapsed if elapsed else 0.0,
+        'error_rate': errors / total if total else 0.0,
+        'callbacks': dict(sorted(callbacks.items(), key=lambda item: item[1]['total_ms'], reverse=True)),
+        'steps': steps,
+    }
+
+
+def print_summary(summary, top):
+    print(f"\n経過 {summary['elapsed_seconds']:.1f}秒 / シナリオ {summary['scenario_iterations']} 回 / "
+          f"コールバック {summary['callback_requests']} 件 ({summary['throughput_rps']:.1f} 件/秒) / "
+          f"エラー率 {summary['error_rate']:.2%}")
+    print("\n--- シナリオの手順 ---")
+    for name, stats in summary['steps'].items():
+        print(f"  {name:<12} {stats['count']:6d} 回 (省略 {stats['skipped']})  p50 {stats['p50_ms']:8.1f}ms  p95 {stats['p95_ms']:8.1f}ms")
+    print(f"\n--- コールバック (合計時間の上位 {top} 件) ---")
+    for label, stats in list(summary['callbacks'].items())[:top]:
+        print(f"  {stats['count']:6d} 件  エラー {stats['error_rate']:6.1%}  p50 {stats['p50_ms']:8.1f}  p95 {stats['p95_ms']:8.1f}  "
+              f"p99 {stats['p99_ms']:8.1f}ms  {stats['avg_bytes'] / 1024:7.1f}KB  {label}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Dash コールバックを直接呼び出す負荷試験を実行します。")
+    parser.add_argument('--url', default='http://127.0.0.1:8051', help="試験対象のサーバー")
+    parser.add_argument('--concurrency', type=int, default=4, help="同時に動かす仮想の講師の数")
+    parser.add_argument('--duration', type=float, default=60, help="試験時間 (秒)")
+    parser.add_argument('--iterations', type=int, help="仮想の講師ごとのシナリオの回数 (指定時は --duration より優先して終了)")
+    parser.add_argument('--think-time', type=float, default=0.5, help="手順の間の平均待ち時間 (秒)")
+    parser.add_argument('--max-tabs', type=int, default=2, help="1回のシナリオで切り替える科目タブの数")
+    parser.add_argument('--usernames', type=lambda v: [u.strip() for u in v.split(',') if u.strip()],
+                        help="ログインするユーザー名 (カンマ区切り。省略時は合成データの各校舎の管理者 synth_NNN_01)")
+    parser.add_argument('--password', default='password')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--top', type=int, default=30, help="表示するコールバックの件数")
+    parser.add_argument('--output', help="結果を保存する JSON のパス")
+    args = parser.parse_args(argv)
+    if not args.usernames:
+        args.usernames = [f"synth_{i + 1:03d}_01" for i in range(args.concurrency)]
+    if args.iterations is not None:
+        args.duration = float('inf')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        response = requests.get(f"{args.url.rstrip('/')}/_dash-dependencies", timeout=30)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        print(f"サーバーに接続できません ({args.url}): {e}")
+        return 1
+    callbacks = [CallbackSpec(d) for d in response.json()]
+    print(f"--- 負荷試験を開始します ({args.url}, 仮想の講師 {args.concurrency} 人, コールバック {len(callbacks)} 件) ---")
+
+    recorder = Recorder()
+    started = time.monotonic()
+    deadline = started + args.duration
+    threads = [
+        threading.Thread(
+            target=VirtualInstructor(i, args, callbacks, recorder).run, args=(deadline, args.iterations), daemon=True
+        )
+        for i in range(args.concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        print("\n中断しました。ここまでの結果を表示します。")
+    summary = summarize(recorder, time.monotonic() - started)
+    print_summary(summary, args.top)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'created_at': datetime.now().isoformat(timespec='seconds'),
+                'settings': {k: v for k, v in vars(args).items() if k not in ('password',) and v != float('inf')},
+                **summary,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\n結果を保存しました: {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,7 @@
+# migrations/__init__.py
+
+"""
+スキーママイグレーション
+
+新しいマイグレーションは vNNNN_説明.py の名前で追加し、run_migrations.py で適用する。
+"""
@@ -0,0 +1,251 @@
+# migrations/runner.py
+
+"""
+バージョン管理されたスキーママイグレーションの実行エンジン
+
+migrations/ 配下の vNNNN_*.py を番号順に適用し、適用済みのバージョンを
+schema_migrations テーブルに記録する。各マイグレーションモジュールは以下を定義する。
+
+    VERSION        : 整数のバージョン番号 (ファイル名の番号と一致させる)
+    NAME           : 説明
+    TRANSACTIONAL  : False の場合はautocommitで実行する (CREATE INDEX CONCURRENTLY など)
+    upgrade(conn)  : スキーマ変更の本体
+    EXPLAIN_QUERIES: (任意) 適用前後で実行計画を比較するクエリの (ラベル, SQL) のリスト
+
+TRANSACTIONAL = False のマイグレーションは途中で失敗しても再実行できるよう冪等に書くこと。
+"""
+import importlib
+import pkgutil
+import re
+from datetime import datetime
+
+import psycopg2
+
+import migrations
+
+# 複数のプロセスが同時にマイグレーションを実行しないためのアドバイザリーロックのキー
+MIGRATION_LOCK_ID = 7_201_305_001
+
+_MODULE_PATTERN = re.compile(r'^v(\d{4})_\w+$')
+
+
+def discover_migrations():
+    """migrations パッケージ内のマイグレーションモジュールをバージョン順に返す"""
+    modules = []
+    for module_info in pkgutil.iter_modules(migrations.__path__):
+        match = _MODULE_PATTERN.match(module_info.name)
+        if not match:
+            continue
+        module = importlib.import_module(f"migrations.{module_info.name}")
+        if module.VERSION != int(match.group(1)):
+            raise ValueError(f"{module_info.name} の VERSION ({module.VERSION}) がファイル名と一致しません。")
+        modules.append(module)
+    modules.sort(key=lambda m: m.VERSION)
+    versions = [m.VERSION for m in modules]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f"マイグレーションのバージョンが重複しています: {versions}")
+    return modules
+
+
+def ensure_migrations_table(conn):
+    with conn.cursor() as cur:
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+    conn.commit()
+
+
+def get_applied_versions(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT version FROM schema_migrations")
+        versions = {row[0] for row in cur.fetchall()}
+    conn.commit()
+    return versions
+
+
+def get_pending_migrations(conn):
+    applied = get_applied_versions(conn)
+    return [m for m in discover_migrations() if m.VERSION not in applied]
+
+
+def _record(cur, migration):
+    cur.execute(
+        "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+        (migration.VERSION, migration.NAME)
+    )
+
+
+def apply_migration(conn, migration):
+    """1件のマイグレーションを適用し、schema_migrations に記録する"""
+    if getattr(migration, 'TRANSACTIONAL', True):
+        try:
+            migration.upgrade(conn)
+            with conn.cursor() as cur:
+                _record(cur, migration)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    else:
+        conn.autocommit = True
+        try:
+            migration.upgrade(conn)
+            with conn.cursor() as cur:
+                _record(cur, migration)
+        finally:
+            conn.autocommit = False
+
+
+def run_migrations(conn, target_version=None, dry_run=False):
+    """
+    未適用のマイグレーションを順に適用する。
+    適用した (dry_run の場合は適用予定の) マイグレーションモジュールのリストを返す。
+    """
+    ensure_migrations_table(conn)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+    conn.autocommit = False
+    try:
+        pending = get_pending_migrations(conn)
+        if target_version is not None:
+            pending = [m for m in pending if m.VERSION <= target_version]
+        for migration in pending:
+            print(f"  - v{migration.VERSION:04d} {migration.NAME}" + (" (dry-run)" if dry_run else ""))
+            if not dry_run:
+                apply_migration(conn, migration)
+        return pending
+    finally:
+        conn.rollback()
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+        conn.autocommit = False
+
+
+# --- マイグレーション内で使うヘルパー ---
+
+def table_exists(conn, table_name):
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL", (f"public.{table_name}",))
+        return cur.fetchone()[0]
+
+
+def column_type(conn, table_name, column_name):
+    """列のデータ型 (information_schema.columns.data_type) を返す。存在しなければ None。"""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT data_type FROM information_schema.columns
+            WHERE table_schema = 'public' AND table_name = %s AND column_name = %s
+            """,
+            (table_name, column_name)
+        )
+        row = cur.fetchone()
+        return row[0] if row else None
+
+
+def create_index_concurrently(conn, index_name, table_name, definition, unique=False, where=None):
+    """
+    テーブルをロックせずにインデックスを作成する (autocommit の接続で呼ぶこと)。
+    以前の CONCURRENTLY が失敗して INVALID なインデックスが残っている場合は作り直す。
+    テーブルが存在しない場合は何もせず False を返す。
+    """
+    if not table_exists(conn, table_name):
+        print(f"    - '{table_name}' テーブルが存在しないため {index_name} をスキップしました。")
+        return False
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT i.indisvalid
+            FROM pg_class c
+            JOIN pg_index i ON i.indexrelid = c.oid
+            WHERE c.relname = %s AND c.relnamespace = 'public'::regnamespace
+            """,
+            (index_name,)
+        )
+        row = cur.fetchone()
+        if row and row[0]:
+            print(f"    - {index_name} は既に存在します。")
+            return True
+        if row and not row[0]:
+            print(f"    - 無効な {index_name} が残っていたため削除して作り直します。")
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+        sql = f"CREATE {'UNIQUE ' if unique else ''}INDEX CONCURRENTLY {index_name} ON {table_name} ({definition})"
+        if where:
+            sql += f" WHERE {where}"
+        cur.execute(sql)
+        print(f"    - {index_name} を作成しました。")
+    return True
+
+
+# --- 実行計画レポート ---
+
+def get_sample_parameters(conn):
+    """EXPLAIN 用のクエリに渡す代表的なパラメータを既存データから選ぶ"""
+    params = {'student_id': 0, 'user_id': 0, 'school': ''}
+    with conn.cursor() as cur:
+        # 最もデータ量の多い生徒・講師を選ぶと実行計画の差が分かりやすい
+        cur.execute("""
+            SELECT s.id FROM students s LEFT JOIN progress p ON p.student_id = s.id
+            GROUP BY s.id ORDER BY COUNT(p.id) DESC, s.id LIMIT 1
+        """)
+        row = cur.fetchone()
+        if row:
+            params['student_id'] = row[0]
+        cur.execute("SELECT user_id FROM student_instructors GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1")
+        row = cur.fetchone()
+        if row:
+            params['user_id'] = row[0]
+        cur.execute("SELECT school FROM students GROUP BY school ORDER BY COUNT(*) DESC LIMIT 1")
+        row = cur.fetchone()
+        if row:
+            params['school'] = row[0]
+    conn.rollback()
+    return params
+
+
+def explain_queries(conn, queries, params):
+    """(ラベル, SQL) のリストを EXPLAIN ANALYZE し、{ラベル: 実行計画テキスト} を返す"""
+    plans = {}
+    for label, sql in queries:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, params)
+                plans[label] = "\n".join(row[0] for row in cur.fetchall())
+        except psycopg2.Error as e:
+            plans[label] = f"(EXPLAIN 失敗: {e})"
+        conn.rollback()
+    return plans
+
+
+def format_explain_report(migrations_applied, before, after, params):
+    """適用前後の実行計画を並べたMarkdownレポートを作成する"""
+    lines = [
+        "# マイグレーション 実行計画レポート",
+        "",
+        f"- 作成日時: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        "- 適用したマイグレーション: " + (", ".join(f"v{m.VERSION:04d} {m.NAME}" for m in migrations_applied) or "なし"),
+        f"- パラメータ: {params}",
+        "",
+    ]
+    for label in before:
+        lines += [
+            f"## {label}",
+            "",
+            "### 適用前",
+            "```",
+            before[label],
+            "```",
+            "",
+            "### 適用後",
+            "```",
+            after.get(label, ""),
+            "```",
+            "",
+        ]
+    return "\n".join(lines)
@@ -0,0 +1,64 @@
+# migrations/v0001_hot_path_indexes.py
+
+"""
+生徒ごと・講師ごとの取得で使われる列にインデックスを追加する
+
+initialize_database.py で作成される各テーブルには主キー・UNIQUE制約以外のインデックスがなく、
+student_id での絞り込みや student_instructors.user_id での絞り込みが全件走査になっていた。
+運用中のテーブルをロックしないよう CREATE INDEX CONCURRENTLY で作成する。
+
+progress (student_id, ...) と eiken_results (student_id, grade) は UNIQUE 制約のインデックスが
+先頭列 student_id で使えるため対象外。
+"""
+from migrations.runner import create_index_concurrently
+
+VERSION = 1
+NAME = 'hot_path_indexes'
+TRANSACTIONAL = False
+
+# (インデックス名, テーブル名, 列)
+INDEXES = [
+    ('idx_student_instructors_user_id', 'student_instructors', 'user_id'),
+    ('idx_homework_student_id_textbook_id', 'homework', 'student_id, master_textbook_id'),
+    ('idx_homework_master_textbook_id', 'homework', 'master_textbook_id'),
+    ('idx_past_exam_results_student_id', 'past_exam_results', 'student_id'),
+    ('idx_university_acceptance_student_id', 'university_acceptance', 'student_id'),
+    ('idx_mock_exam_results_student_id', 'mock_exam_results', 'student_id'),
+    ('idx_students_school', 'students', 'school'),
+    ('idx_users_school', 'users', 'school'),
+    ('idx_bulk_preset_books_preset_id', 'bulk_preset_books', 'preset_id'),
+]
+
+# run_migrations.py --explain で適用前後の実行計画を比較するクエリ
+EXPLAIN_QUERIES = [
+    ('get_students_for_user (講師の担当生徒)',
+     """
+     SELECT s.id, s.name FROM students s
+     JOIN student_instructors si ON s.id = si.student_id
+     WHERE si.user_id = %(user_id)s
+     """),
+    ('get_students_for_user (校舎の生徒)',
+     "SELECT id, name FROM students WHERE school = %(school)s"),
+    ('get_student_homework',
+     """
+     SELECT h.*, mt.book_name FROM homework h
+     JOIN master_textbooks mt ON h.master_textbook_id = mt.id
+     WHERE h.student_id = %(student_id)s
+     """),
+    ('get_past_exam_results_for_student',
+     "SELECT * FROM past_exam_results WHERE student_id = %(student_id)s"),
+    ('get_acceptance_results_for_student',
+     "SELECT * FROM university_acceptance WHERE student_id = %(student_id)s"),
+    ('get_mock_exam_results_for_student',
+     "SELECT * FROM mock_exam_results WHERE student_id = %(student_id)s"),
+    ('get_bulk_presets',
+     """
+     SELECT bp.id, bpb.book_name FROM bulk_presets bp
+     LEFT JOIN bulk_preset_books bpb ON bp.id = bpb.preset_id
+     """),
+]
+
+
+def upgrade(conn):
+    for index_name, table_name, columns in INDEXES:
+        create_index_concurrently(conn, index_name, table_name, columns)
@@ -0,0 +1,127 @@
+# migrations/v0002_native_date_columns.py
+
+"""
+TEXT で保存していた日付列を DATE 型へ変換する
+
+対象: past_exam_results.date, homework.task_date,
+      university_acceptance の application_deadline / exam_date / announcement_date / procedure_deadline
+
+日付として解釈できない値は date_migration_quarantine テーブルへ退避する。
+- NOT NULL 列 (past_exam_results.date, homework.task_date) は行全体を JSON で退避してから削除する
+- NULL 可の列 (合否の各期日) は元の値だけを退避し、列を NULL にする (行は残す)
+NULL 可の列の空文字列は退避せず NULL として扱う (NOT NULL 列の空文字列は退避対象)。
+"""
+from migrations.runner import column_type, table_exists
+
+VERSION = 2
+NAME = 'native_date_columns'
+TRANSACTIONAL = True
+
+# (テーブル名, 列名, NOT NULL か)
+DATE_COLUMNS = [
+    ('past_exam_results', 'date', True),
+    ('homework', 'task_date', True),
+    ('university_acceptance', 'application_deadline', False),
+    ('university_acceptance', 'exam_date', False),
+    ('university_acceptance', 'announcement_date', False),
+    ('university_acceptance', 'procedure_deadline', False),
+]
+
+EXPLAIN_QUERIES = [
+    ('get_past_exam_results_for_student',
+     """
+     SELECT * FROM past_exam_results WHERE student_id = %(student_id)s
+     ORDER BY date DESC, university_name, subject
+     """),
+    ('過去問の期間集計 (直近90日)',
+     """
+     SELECT COUNT(*), SUM(time_required) FROM past_exam_results
+     WHERE student_id = %(student_id)s AND date >= CURRENT_DATE - 90
+     """),
+    ('get_acceptance_results_for_student',
+     """
+     SELECT * FROM university_acceptance WHERE student_id = %(student_id)s
+     ORDER BY exam_date DESC NULLS LAST, application_deadline DESC NULLS LAST
+     """),
+]
+
+
+def _create_parse_function(cur):
+    # 解釈できない値は例外にせず NULL を返す (セッション終了時に消える一時関数)
+    cur.execute('''
+        CREATE OR REPLACE FUNCTION pg_temp.try_parse_date(value TEXT) RETURNS DATE AS $$
+        BEGIN
+            IF value IS NULL OR btrim(value) = '' THEN
+                RETURN NULL;
+            END IF;
+            RETURN btrim(value)::DATE;
+        EXCEPTION WHEN others THEN
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql IMMUTABLE
+    ''')
+
+
+def upgrade(conn):
+    with conn.cursor() as cur:
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS date_migration_quarantine (
+                id SERIAL PRIMARY KEY,
+                table_name TEXT NOT NULL,
+                column_name TEXT NOT NULL,
+                row_id INTEGER NOT NULL,
+                raw_value TEXT,
+                row_data JSONB,             -- 行ごと削除した場合のみ元の行を保存
+                quarantined_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        _create_parse_function(cur)
+
+        for table_name, column_name, not_null in DATE_COLUMNS:
+            if not table_exists(conn, table_name):
+                print(f"    - '{table_name}' テーブルが存在しないためスキップしました。")
+                continue
+            if column_type(conn, table_name, column_name) != 'text':
+                print(f"    - {table_name}.{column_name} は既に変換済みです。")
+                continue
+
+            invalid_condition = f"pg_temp.try_parse_date({column_name}) IS NULL AND btrim(COALESCE({column_name}, '')) <> ''"
+            if not_null:
+                cur.execute(f'''
+                    INSERT INTO date_migration_quarantine (table_name, column_name, row_id, raw_value, row_data)
+                    SELECT %s, %s, t.id, t.{column_name}, to_jsonb(t)
+                    FROM {table_name} t
+                    WHERE {invalid_condition} OR btrim({column_name}) = ''
+                ''', (table_name, column_name))
+                quarantined = cur.rowcount
+                cur.execute(f'''
+                    DELETE FROM {table_name}
+                    WHERE {invalid_condition} OR btrim({column_name}) = ''
+                ''')
+            else:
+                cur.execute(f'''
+                    INSERT INTO date_migration_quarantine (table_name, column_name, row_id, raw_value)
+                    SELECT %s, %s, id, {column_name}
+                    FROM {table_name}
+                    WHERE {invalid_condition}
+                ''', (table_name, column_name))
+                quarantined = cur.rowcount
+
+            cur.execute(f'''
+                ALTER TABLE {table_name}
+                ALTER COLUMN {column_name} TYPE DATE USING pg_temp.try_parse_date({column_name})
+            ''')
+            message = f"    - {table_name}.{column_name} を DATE 型に変換しました。"
+            if quarantined:
+                message += f" (解釈できない値 {quarantined} 件を date_migration_quarantine に退避)"
+            print(message)
+
+        # 生徒ごとの日付順の取得・期間での絞り込み用
+        # (ALTER で既にテーブルを書き換えているため CONCURRENTLY は使わない)
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_past_exam_results_student_id_date
+            ON past_exam_results (student_id, date)
+        ''')
+        # student_id 単独のインデックスは上記の複合インデックスで代替できる
+        cur.execute("DROP INDEX IF EXISTS idx_past_exam_results_student_id")
+        cur.execute("DROP FUNCTION IF EXISTS pg_temp.try_parse_date(TEXT)")
@@ -0,0 +1,83 @@
+# migrations/v0003_progress_master_textbook_id.py
+
+"""
+progress と bulk_preset_books に master_textbook_id を追加する
+
+これまでは (subject, level, book_name) の文字列一致で master_textbooks と結合していたため、
+参考書名やレベルを変更すると進捗・プリセットとの対応が切れていた。
+既存の行は文字列キーから master_textbook_id を埋める。マスターに無い参考書 (カスタム参考書) は NULL のまま。
+結合・UPSERT は master_textbook_id で行うため、マスターの名称変更時に進捗・プリセットを書き換える必要はない。
+"""
+VERSION = 3
+NAME = 'progress_master_textbook_id'
+TRANSACTIONAL = True
+
+EXPLAIN_QUERIES = [
+    ('get_student_progress_by_id',
+     """
+     SELECT COALESCE(m.subject, p.subject), COALESCE(m.level, p.level), COALESCE(m.book_name, p.book_name),
+            COALESCE(p.duration, m.duration, 0)
+     FROM progress p
+     LEFT JOIN master_textbooks m ON p.master_textbook_id = m.id
+     WHERE p.student_id = %(student_id)s
+     """),
+]
+
+
+def _constraint_exists(cur, name):
+    cur.execute("SELECT 1 FROM pg_constraint WHERE conname = %s", (name,))
+    return cur.fetchone() is not None
+
+
+def upgrade(conn):
+    with conn.cursor() as cur:
+        for table_name in ('progress', 'bulk_preset_books'):
+            cur.execute(f'''
+                ALTER TABLE {table_name}
+                ADD COLUMN IF NOT EXISTS master_textbook_id INTEGER
+                REFERENCES master_textbooks(id) ON DELETE SET NULL
+            ''')
+
+        cur.execute('''
+            UPDATE progress p
+            SET master_textbook_id = m.id
+            FROM master_textbooks m
+            WHERE p.master_textbook_id IS NULL
+              AND p.subject = m.subject AND p.level = m.level AND p.book_name = m.book_name
+        ''')
+        print(f"    - progress: {cur.rowcount} 件に master_textbook_id を設定しました。")
+
+        # プリセットにはレベルを保存していないため、科目と参考書名で対応付ける
+        # (同名の参考書が複数レベルにある場合は最も古いものを採用)
+        cur.execute('''
+            UPDATE bulk_preset_books pb
+            SET master_textbook_id = (
+                SELECT MIN(m.id) FROM master_textbooks m
+                WHERE m.subject = bp.subject AND m.book_name = pb.book_name
+            )
+            FROM bulk_presets bp
+            WHERE pb.preset_id = bp.id AND pb.master_textbook_id IS NULL
+              AND EXISTS (
+                  SELECT 1 FROM master_textbooks m
+                  WHERE m.subject = bp.subject AND m.book_name = pb.book_name
+              )
+        ''')
+        print(f"    - bulk_preset_books: {cur.rowcount} 件に master_textbook_id を設定しました。")
+
+        # 一意性はマスターの参考書なら (生徒, master_textbook_id)、カスタム参考書なら文字列キーで判定する。
+        # マスターの参考書の文字列列は名称変更後に古い値のまま残ることがあるため、文字列キーの一意制約から外す。
+        if not _constraint_exists(cur, 'progress_student_id_master_textbook_id_key'):
+            cur.execute('''
+                ALTER TABLE progress
+                ADD CONSTRAINT progress_student_id_master_textbook_id_key UNIQUE (student_id, master_textbook_id)
+            ''')
+        cur.execute("ALTER TABLE progress DROP CONSTRAINT IF EXISTS progress_student_id_subject_level_book_name_key")
+        cur.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS progress_custom_book_key
+            ON progress (student_id, subject, level, book_name)
+            WHERE master_textbook_id IS NULL
+        ''')
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_bulk_preset_books_master_textbook_id
+            ON bulk_preset_books (master_textbook_id)
+        ''')
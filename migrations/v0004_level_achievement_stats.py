@@ -0,0 +1,54 @@
+# migrations/v0004_level_achievement_stats.py
+
+"""
+レベル達成人数の集計テーブル level_achievement_stats を作成し、既存の進捗から集計する
+
+統計ページは progress 全体を集計していたが、このテーブルの (校舎, 学年) での参照に置き換える。
+以降は進捗・生徒情報の書き込み時に data/level_stats.py が同じトランザクション内で更新する。
+学年が未設定の生徒は grade = '' として集計する。
+"""
+VERSION = 4
+NAME = 'level_achievement_stats'
+TRANSACTIONAL = True
+
+EXPLAIN_QUERIES = [
+    ('get_student_level_statistics (校舎指定)',
+     """
+     SELECT subject, level, SUM(student_count) FROM level_achievement_stats
+     WHERE school = %(school)s
+     GROUP BY subject, level
+     """),
+]
+
+# 適用時点の集計レベル (data/level_stats.py の ACHIEVEMENT_LEVELS と同じ)
+ACHIEVEMENT_LEVELS = ('日大', 'MARCH', '早慶')
+
+
+def upgrade(conn):
+    with conn.cursor() as cur:
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS level_achievement_stats (
+                school TEXT NOT NULL,
+                grade TEXT NOT NULL DEFAULT '',
+                subject TEXT NOT NULL,
+                level TEXT NOT NULL,
+                student_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (school, grade, subject, level)
+            )
+        ''')
+        cur.execute("DELETE FROM level_achievement_stats")
+        cur.execute('''
+            INSERT INTO level_achievement_stats (school, grade, subject, level, student_count)
+            SELECT s.school, COALESCE(s.grade, ''), a.subject, a.level, COUNT(*)
+            FROM (
+                SELECT DISTINCT p.student_id,
+                       COALESCE(m.subject, p.subject) AS subject,
+                       COALESCE(m.level, p.level) AS level
+                FROM progress p
+                LEFT JOIN master_textbooks m ON p.master_textbook_id = m.id
+                WHERE p.is_done = true AND COALESCE(m.level, p.level) IN %s
+            ) a
+            JOIN students s ON s.id = a.student_id
+            GROUP BY s.school, COALESCE(s.grade, ''), a.subject, a.level
+        ''', (ACHIEVEMENT_LEVELS,))
+        print(f"    - level_achievement_stats: {cur.rowcount} 行を集計しました。")
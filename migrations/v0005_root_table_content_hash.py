@@ -0,0 +1,36 @@
+# migrations/v0005_root_table_content_hash.py
+
+"""
+ルート表 (PDF) の配信用に root_tables へ内容のハッシュとサイズを追加する
+
+- content_sha256: ファイル内容の SHA-256 (16進)。ダウンロードの ETag に使う
+- file_size     : バイト数。Content-Length と Range の範囲計算に使う
+file_content は STORAGE EXTERNAL (TOAST を圧縮しない) に変更し、substring() による部分読み出しで
+必要なチャンクだけを読めるようにする。既存の行は書き直して新しい格納方式にする。
+"""
+from migrations.runner import table_exists
+
+VERSION = 5
+NAME = 'root_table_content_hash'
+TRANSACTIONAL = True
+
+
+def upgrade(conn):
+    if not table_exists(conn, 'root_tables'):
+        print("    - 'root_tables' テーブルが存在しないためスキップしました。")
+        return
+    with conn.cursor() as cur:
+        cur.execute("ALTER TABLE root_tables ADD COLUMN IF NOT EXISTS content_sha256 TEXT")
+        cur.execute("ALTER TABLE root_tables ADD COLUMN IF NOT EXISTS file_size BIGINT")
+        cur.execute("ALTER TABLE root_tables ALTER COLUMN file_content SET STORAGE EXTERNAL")
+        # 連結で新しい値を作ることで、既存の行も非圧縮で格納し直す
+        cur.execute('''
+            UPDATE root_tables
+            SET content_sha256 = encode(sha256(file_content), 'hex'),
+                file_size = octet_length(file_content),
+                file_content = file_content || ''::bytea
+            WHERE content_sha256 IS NULL
+        ''')
+        print(f"    - root_tables: {cur.rowcount} 件のハッシュとサイズを設定しました。")
+        cur.execute("ALTER TABLE root_tables ALTER COLUMN content_sha256 SET NOT NULL")
+        cur.execute("ALTER TABLE root_tables ALTER COLUMN file_size SET NOT NULL")
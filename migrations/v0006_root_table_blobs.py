@@ -0,0 +1,61 @@
+# migrations/v0006_root_table_blobs.py
+
+"""
+ルート表のファイル本体を内容アドレス (SHA-256) のテーブル root_table_blobs へ分離する
+
+root_tables はメタデータ (ファイル名・科目・レベル・年度・content_sha256) だけを持ち、
+ファイル本体は root_table_blobs に1つだけ保存する。同じPDFを別の年度で登録し直しても本体は重複しない。
+ref_count は参照している root_tables の行数で、0 になった本体はデータ層が削除する。
+"""
+from migrations.runner import column_type, table_exists
+
+VERSION = 6
+NAME = 'root_table_blobs'
+TRANSACTIONAL = True
+
+
+def upgrade(conn):
+    with conn.cursor() as cur:
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS root_table_blobs (
+                content_sha256 TEXT PRIMARY KEY,
+                content BYTEA NOT NULL,
+                file_size BIGINT NOT NULL,
+                ref_count INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # substring() による分割読み出しで必要なチャンクだけを読めるよう、圧縮せずに格納する
+        cur.execute("ALTER TABLE root_table_blobs ALTER COLUMN content SET STORAGE EXTERNAL")
+
+        if not table_exists(conn, 'root_tables'):
+            print("    - 'root_tables' テーブルが存在しないため移行をスキップしました。")
+            return
+        if column_type(conn, 'root_tables', 'file_content') is None:
+            print("    - root_tables は既に移行済みです。")
+            return
+
+        cur.execute('''
+            INSERT INTO root_table_blobs (content_sha256, content, file_size, ref_count)
+            SELECT DISTINCT ON (content_sha256) content_sha256, file_content, file_size, 0
+            FROM root_tables
+            ORDER BY content_sha256, id
+            ON CONFLICT (content_sha256) DO NOTHING
+        ''')
+        print(f"    - root_table_blobs: {cur.rowcount} 件のファイルを移しました。")
+        cur.execute('''
+            UPDATE root_table_blobs b
+            SET ref_count = r.ref_count
+            FROM (
+                SELECT content_sha256, COUNT(*) AS ref_count FROM root_tables GROUP BY content_sha256
+            ) r
+            WHERE b.content_sha256 = r.content_sha256
+        ''')
+
+        cur.execute('''
+            ALTER TABLE root_tables
+            ADD CONSTRAINT root_tables_content_sha256_fkey
+            FOREIGN KEY (content_sha256) REFERENCES root_table_blobs (content_sha256)
+        ''')
+        cur.execute("ALTER TABLE root_tables DROP COLUMN file_content")
+        cur.execute("ALTER TABLE root_tables DROP COLUMN IF EXISTS file_size")
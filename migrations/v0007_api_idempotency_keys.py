@@ -0,0 +1,34 @@
+# migrations/v0007_api_idempotency_keys.py
+
+"""
+フォーム連携APIの再送による重複登録を防ぐ api_idempotency_keys テーブルを作成する
+
+Googleフォーム / Apps Script はタイムアウト時に同じ内容を再送するため、
+Idempotency-Key ヘッダー (無ければ正規化した本文のハッシュ) ごとに最初の応答を保存し、
+有効期限内の再送には登録せずに保存済みの応答を返す。
+"""
+VERSION = 7
+NAME = 'api_idempotency_keys'
+TRANSACTIONAL = True
+
+
+def upgrade(conn):
+    with conn.cursor() as cur:
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS api_idempotency_keys (
+                idempotency_key TEXT PRIMARY KEY,   -- エンドポイントとキー (またはハッシュ) から作る
+                endpoint TEXT NOT NULL,
+                request_hash TEXT NOT NULL,         -- 同じキーで別の内容が送られた場合の検出用
+                state TEXT NOT NULL DEFAULT 'processing', -- processing / completed
+                response_status INTEGER,
+                response_body JSONB,
+                locked_until TIMESTAMP WITH TIME ZONE NOT NULL, -- processing のまま処理が途絶えた場合に再実行を許す時刻
+                created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+            )
+        ''')
+        # 期限切れの行の削除用
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_api_idempotency_keys_expires_at
+            ON api_idempotency_keys (expires_at)
+        ''')
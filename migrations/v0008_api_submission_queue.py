@@ -0,0 +1,38 @@
+# migrations/v0008_api_submission_queue.py
+
+"""
+フォーム連携APIの非同期登録用のキュー api_submission_queue を作成する
+
+非同期モードのAPIは入力を検証してこのテーブルに積むだけで 202 を返し、
+バックグラウンドのワーカーが FOR UPDATE SKIP LOCKED で複数件ずつ取り出して登録する。
+state: queued (未処理) / done (登録済み) / failed (登録できなかった)
+"""
+VERSION = 8
+NAME = 'api_submission_queue'
+TRANSACTIONAL = True
+
+
+def upgrade(conn):
+    with conn.cursor() as cur:
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS api_submission_queue (
+                id BIGSERIAL PRIMARY KEY,
+                target TEXT NOT NULL,           -- past_exam / acceptance / mock_exam
+                payload JSONB NOT NULL,         -- 受け取った入力 (検証済み)
+                state TEXT NOT NULL DEFAULT 'queued',
+                result_id INTEGER,              -- 登録された行のID
+                error TEXT,
+                created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                processed_at TIMESTAMP WITH TIME ZONE
+            )
+        ''')
+        # ワーカーが未処理のジョブを古い順に取り出すための部分インデックス
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_api_submission_queue_queued
+            ON api_submission_queue (id) WHERE state = 'queued'
+        ''')
+        # 処理済みのジョブの削除用
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_api_submission_queue_processed_at
+            ON api_submission_queue (processed_at) WHERE state <> 'queued'
+        ''')
@@ -0,0 +1,41 @@
+# migrations/v0009_mock_exam_list_index.py
+
+"""
+校舎の模試結果一覧 (管理者) の絞り込み用に mock_exam_results (student_id, mock_exam_name, grade) の複合インデックスを追加する
+
+一覧は校舎の生徒ごとに mock_exam_results を引き、模試名・学年で絞り込む。
+student_id 単独のインデックス (v0001) は複合インデックスの先頭列で代替できるため、作成後に削除する。
+運用中のテーブルをロックしないよう CONCURRENTLY で作成・削除する。
+"""
+from migrations.runner import create_index_concurrently
+
+VERSION = 9
+NAME = 'mock_exam_list_index'
+TRANSACTIONAL = False
+
+# run_migrations.py --explain で適用前後の実行計画を比較するクエリ
+EXPLAIN_QUERIES = [
+    ('get_mock_exam_details_page (模試名・学年で絞り込み)',
+     """
+     SELECT s.name, mer.id, mer.mock_exam_name, mer.grade, mer.exam_date
+     FROM mock_exam_results mer
+     JOIN students s ON mer.student_id = s.id
+     WHERE s.school = %(school)s AND mer.mock_exam_format = 'マーク'
+       AND mer.mock_exam_name = (SELECT mock_exam_name FROM mock_exam_results GROUP BY 1 ORDER BY COUNT(*) DESC LIMIT 1)
+       AND mer.grade = '高3'
+     ORDER BY s.name, mer.exam_date DESC, mer.id DESC
+     LIMIT 101
+     """),
+    ('get_mock_exam_results_for_student',
+     "SELECT * FROM mock_exam_results WHERE student_id = %(student_id)s"),
+]
+
+
+def upgrade(conn):
+    if not create_index_concurrently(
+        conn, 'idx_mock_exam_results_student_name_grade', 'mock_exam_results', 'student_id, mock_exam_name, grade'
+    ):
+        return
+    with conn.cursor() as cur:
+        cur.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_mock_exam_results_student_id")
+    print("    - idx_mock_exam_results_student_id を削除しました (複合インデックスで代替)。")
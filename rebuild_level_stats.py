@@ -0,0 +1,45 @@
+# rebuild_level_stats.py
+import os
+import sys
+
+import psycopg2
+from dotenv import load_dotenv
+
+from data.level_stats import rebuild_level_achievement_stats
+
+# .envファイルから環境変数を読み込む
+load_dotenv()
+
+DATABASE_URL = os.getenv('DATABASE_URL')
+
+def get_db_connection():
+    """PostgreSQLデータベース接続を取得します。"""
+    if not DATABASE_URL:
+        raise ValueError("エラー: 環境変数 'DATABASE_URL' が設定されていません。")
+    return psycopg2.connect(DATABASE_URL)
+
+def rebuild():
+    """
+    レベル達成人数の集計テーブル (level_achievement_stats) を progress から作り直す。
+    統計ページの人数が実際の進捗とずれた場合の修復用。
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        row_count = rebuild_level_achievement_stats(conn)
+        conn.commit()
+        return True, f"level_achievement_stats を再集計しました ({row_count} 行)。"
+    except (Exception, psycopg2.Error) as e:
+        print(f"データベースエラー (rebuild_level_stats): {e}")
+        if conn:
+            conn.rollback()
+        return False, f"再集計中にエラーが発生しました: {e}"
+    finally:
+        if conn:
+            conn.close()
+
+if __name__ == '__main__':
+    print("--- レベル達成人数の再集計を開始します ---")
+    success, message = rebuild()
+    print(message)
+    sys.exit(0 if success else 1)
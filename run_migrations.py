@@ -0,0 +1,95 @@
+# run_migrations.py
+import os
+import argparse
+import psycopg2
+from dotenv import load_dotenv
+
+from migrations.runner import (
+    run_migrations, ensure_migrations_table, get_applied_versions, discover_migrations,
+    get_pending_migrations, get_sample_parameters, explain_queries, format_explain_report
+)
+
+# .envファイルを読み込んで環境変数を設定
+load_dotenv()
+
+# --- 設定 ---
+DATABASE_URL = os.getenv('DATABASE_URL')
+
+def get_db_connection():
+    """PostgreSQLデータベース接続を取得します。"""
+    if not DATABASE_URL:
+        print("エラー: 環境変数 'DATABASE_URL' が設定されていません。")
+        exit()
+    try:
+        conn = psycopg2.connect(DATABASE_URL)
+        return conn
+    except psycopg2.Error as e:
+        print(f"データベース接続エラー: {e}")
+        exit()
+
+def show_status(conn):
+    """各マイグレーションの適用状況を表示します。"""
+    ensure_migrations_table(conn)
+    applied = get_applied_versions(conn)
+    print("--- マイグレーションの適用状況 ---")
+    for migration in discover_migrations():
+        mark = "適用済み" if migration.VERSION in applied else "未適用"
+        print(f"  [{mark}] v{migration.VERSION:04d} {migration.NAME}")
+
+def analyze(conn):
+    """プランナーの統計情報を更新します。"""
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("ANALYZE")
+    conn.autocommit = False
+
+def migrate(conn, target_version=None, dry_run=False, explain_path=None):
+    """未適用のマイグレーションを適用します。explain_path を指定すると実行計画の比較レポートを書き出します。"""
+    print("--- マイグレーションを開始 ---")
+    before, params, queries = {}, {}, []
+    if explain_path:
+        ensure_migrations_table(conn)
+        pending = get_pending_migrations(conn)
+        if target_version is not None:
+            pending = [m for m in pending if m.VERSION <= target_version]
+        for migration in pending:
+            queries.extend(getattr(migration, 'EXPLAIN_QUERIES', []))
+        # 統計情報の有無で実行計画が変わらないよう、前後とも ANALYZE してから計測する
+        analyze(conn)
+        params = get_sample_parameters(conn)
+        before = explain_queries(conn, queries, params)
+
+    applied = run_migrations(conn, target_version=target_version, dry_run=dry_run)
+    if not applied:
+        print("  - 未適用のマイグレーションはありません。")
+
+    if explain_path:
+        analyze(conn)
+        after = explain_queries(conn, queries, params)
+        with open(explain_path, 'w', encoding='utf-8') as f:
+            f.write(format_explain_report(applied, before, after, params))
+        print(f"  - 実行計画レポートを '{explain_path}' に出力しました。")
+    print("--- マイグレーションが完了 ---")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="データベースのスキーママイグレーションを適用します。")
+    parser.add_argument('--status', action='store_true', help="適用状況を表示するだけで終了します。")
+    parser.add_argument('--target', type=int, default=None, help="指定したバージョンまで適用します。")
+    parser.add_argument('--dry-run', action='store_true', help="適用予定のマイグレーションを表示するだけで適用しません。")
+    parser.add_argument('--explain', metavar='PATH', nargs='?', const='migration_explain_report.md', default=None,
+                        help="適用前後の EXPLAIN ANALYZE を比較したレポートを出力します。")
+    args = parser.parse_args()
+
+    connection = get_db_connection()
+    try:
+        if args.status:
+            show_status(connection)
+        else:
+            migrate(connection, target_version=args.target, dry_run=args.dry_run, explain_path=args.explain)
+    except (Exception, psycopg2.Error) as e:
+        print(f"\n[エラー] マイグレーション中にエラーが発生しました: {e}")
+        connection.rollback()
+    finally:
+        connection.close()
+        print("データベース接続を閉じました。")
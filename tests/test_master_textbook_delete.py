@@ -0,0 +1,123 @@
+# tests/test_master_textbook_delete.py
+
+"""
+マスター参考書の削除で、紐付いた進捗がカスタム参考書の進捗と衝突しないことの確認
+
+名称変更後の進捗は文字列列が古い値のまま残るため、削除 (ON DELETE SET NULL) で
+progress_custom_book_key (カスタム参考書の文字列キーの一意制約) に違反しないかを検査する。
+DATABASE_URL のDBに書き込む。作成した生徒・参考書はテストの終了時に削除する。
+"""
+import os
+import sys
+import uuid
+
+import psycopg2
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from data.nested_json_processor import (
+    get_db_connection, add_master_textbook, update_master_textbook, delete_master_textbook,
+    add_or_update_student_progress
+)
+
+SUBJECT = '英語'
+
+
+def _connectable():
+    try:
+        conn = get_db_connection()
+    except psycopg2.Error:
+        return False
+    conn.close()
+    return True
+
+
+pytestmark = pytest.mark.skipif(not _connectable(), reason="DATABASE_URL のDBに接続できません")
+
+
+def _fetch(sql, params):
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            return cur.fetchall()
+    finally:
+        conn.close()
+
+
+def _execute(sql, params):
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            rows = cur.fetchall() if cur.description else None
+        conn.commit()
+        return rows
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def book():
+    """テスト用の生徒と、名称が一意なマスター参考書 (level はテスト専用の値) を作成する"""
+    suffix = uuid.uuid4().hex[:8]
+    level = f'テスト{suffix}'
+    student_id = _execute(
+        "INSERT INTO students (name, school) VALUES (%s, %s) RETURNING id", (f'テスト生徒{suffix}', 'テスト校舎')
+    )[0][0]
+    success, message = add_master_textbook(SUBJECT, level, f'旧名{suffix}', 1.0)
+    assert success, message
+    book_id = _fetch("SELECT id FROM master_textbooks WHERE level = %s", (level,))[0][0]
+    yield {'student_id': student_id, 'book_id': book_id, 'level': level,
+           'old_name': f'旧名{suffix}', 'new_name': f'新名{suffix}'}
+    _execute("DELETE FROM progress WHERE student_id = %s", (student_id,))
+    _execute("DELETE FROM students WHERE id = %s", (student_id,))
+    _execute("DELETE FROM master_textbooks WHERE id = %s", (book_id,))
+
+
+def _save(book, book_name, completed_units, total_units=10):
+    success, message = add_or_update_student_progress(book['student_id'], [{
+        'subject': SUBJECT, 'level': book['level'], 'book_name': book_name,
+        'completed_units': completed_units, 'total_units': total_units, 'is_planned': True,
+    }])
+    assert success, message
+
+
+def _progress(book):
+    return _fetch(
+        """
+        SELECT book_name, master_textbook_id, completed_units FROM progress
+        WHERE student_id = %s ORDER BY book_name
+        """,
+        (book['student_id'],)
+    )
+
+
+def test_delete_after_custom_row_saved_under_old_name(book):
+    _save(book, book['old_name'], 3)
+    assert update_master_textbook(book['book_id'], SUBJECT, book['level'], book['new_name'], 1.0)[0]
+    # 名称変更後に旧名で保存するとカスタム参考書の進捗になる (紐付いた進捗の文字列列も旧名のまま)
+    _save(book, book['old_name'], 5)
+
+    success, message = delete_master_textbook(book['book_id'])
+
+    assert success, message
+    # 紐付いていた進捗は削除時点のマスターの名称で残る
+    assert _progress(book) == [(book['new_name'], None, 3), (book['old_name'], None, 5)]
+
+
+def test_delete_merges_custom_row_with_current_name(book):
+    _save(book, book['old_name'], 3)
+    # マスターに無い名称 (変更後の名称) で保存したカスタム参考書の進捗
+    _save(book, book['new_name'], 7)
+    assert update_master_textbook(book['book_id'], SUBJECT, book['level'], book['new_name'], 1.0)[0]
+    # 生徒は既に紐付いた進捗を持つため、カスタム参考書の進捗は紐付かずに残る
+    # 新しい名称で保存すると紐付いた進捗の文字列列がカスタム参考書と同じになる
+    _save(book, book['new_name'], 4)
+
+    success, message = delete_master_textbook(book['book_id'])
+
+    assert success, message
+    # 同じ名称の進捗は1件に統合され、進んでいる方 (カスタム参考書の 7/10) が残る
+    assert _progress(book) == [(book['new_name'], None, 7)]
@@ -0,0 +1,135 @@
+# utils/callback_profiler.py
+
+"""
+Dash コールバックの所要時間と応答サイズの計測
+
+/_dash-update-component へのリクエストを Flask の before_request / after_request で計測し、
+コールバックの出力 (output ID) ごとに集計する。
+- 所要時間は Flask がリクエストを受け取ってから応答を返すまで (コールバック本体 + JSON 化)
+- 応答サイズは JSON のバイト数 (圧縮前)
+- パーセンタイルは出力ごとに直近 CALLBACK_PROFILE_WINDOW 件の所要時間から計算する
+- CALLBACK_PROFILE_LOG_SAMPLE_RATE (0〜1) の割合で1件ずつログにも出力する
+集計はワーカープロセスごと。管理者ページ /admin/callback-profile で上位を確認できる。
+"""
+import random
+import threading
+import time
+from collections import deque
+
+from flask import g, request
+
+from config.settings import APP_CONFIG
+
+CONFIG = APP_CONFIG['callback_profile']
+
+DASH_UPDATE_PATH = '/_dash-update-component'
+
+
+class CallbackStats:
+    """1つのコールバック (出力) の集計値"""
+
+    def __init__(self, output_id, window):
+        self.output_id = output_id
+        self.calls = 0
+        self.errors = 0
+        self.prevented = 0 # PreventUpdate (204) の件数
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.total_bytes = 0
+        self.max_bytes = 0
+        self.recent_seconds = deque(maxlen=window)
+
+    def add(self, seconds, size, status):
+        self.calls += 1
+        self.errors += int(status >= 500)
+        self.prevented += int(status == 204)
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.total_bytes += size
+        self.max_bytes = max(self.max_bytes, size)
+        self.recent_seconds.append(seconds)
+
+    def to_dict(self):
+        recent = sorted(self.recent_seconds)
+
+        def percentile_ms(fraction):
+            if not recent:
+                return 0.0
+            return recent[min(len(recent) - 1, int(fraction * len(recent)))] * 1000
+
+        return {
+            'output_id': self.output_id,
+            'calls': self.calls,
+            'errors': self.errors,
+            'prevented': self.prevented,
+            'total_ms': self.total_seconds * 1000,
+            'avg_ms': self.total_seconds * 1000 / self.calls if self.calls else 0.0,
+            'p50_ms': percentile_ms(0.50),
+            'p95_ms': percentile_ms(0.95),
+            'p99_ms': percentile_ms(0.99),
+            'max_ms': self.max_seconds * 1000,
+            'avg_bytes': self.total_bytes / self.calls if self.calls else 0,
+            'max_bytes': self.max_bytes,
+        }
+
+
+_lock = threading.Lock()
+_stats = {} # output ID -> CallbackStats
+
+
+def callback_output_id(payload):
+    """
+    リクエスト本文の output をそのまま集計キーにする。
+    複数出力のコールバックは "..page-content.children...navbar-container.children.." の形式になる。
+    """
+    if not isinstance(payload, dict):
+        return '(unknown)'
+    return str(payload.get('output') or '(unknown)')
+
+
+def _before_request():
+    if request.path != DASH_UPDATE_PATH or request.method != 'POST':
+        return
+    g.callback_profile = (time.perf_counter(), callback_output_id(request.get_json(silent=True)))
+
+
+def _after_request(response):
+    profile = g.pop('callback_profile', None)
+    if profile is None:
+        return response
+    start, output_id = profile
+    elapsed = time.perf_counter() - start
+    size = response.calculate_content_length()
+    if size is None:
+        size = len(response.get_data()) if not response.is_streamed else 0
+
+    with _lock:
+        stats = _stats.get(output_id)
+        if stats is None:
+            stats = _stats[output_id] = CallbackStats(output_id, CONFIG['window'])
+        stats.add(elapsed, size, response.status_code)
+
+    if CONFIG['log_sample_rate'] > 0 and random.random() < CONFIG['log_sample_rate']:
+        print(f"コールバック計測: {output_id} {elapsed * 1000:.1f}ms {size}B (status {response.status_code})")
+    return response
+
+
+def init_callback_profiler(server):
+    """Flask サーバーに計測用のフックを登録する (CALLBACK_PROFILE=false の場合は何もしない)"""
+    if not CONFIG['enabled']:
+        return
+    server.before_request(_before_request)
+    server.after_request(_after_request)
+
+
+def get_callback_stats(order_by='total_ms', limit=None):
+    """出力ごとの集計を order_by の大きい順に返す"""
+    with _lock:
+        stats = [s.to_dict() for s in _stats.values()]
+    stats.sort(key=lambda s: s[order_by], reverse=True)
+    return stats[:limit] if limit else stats
+
+
+def reset_callback_stats():
+    with _lock:
+        _stats.clear()
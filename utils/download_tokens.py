@@ -0,0 +1,35 @@
+# utils/download_tokens.py
+
+"""
+ファイルダウンロード用URLの署名
+
+ログイン状態はブラウザのセッションストレージで管理しており、Flaskのルートからは確認できない。
+そのため、ログイン後の画面でだけ生成される署名付きトークンをURLに含め、ルート側で検証する。
+"""
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+
+from config.settings import APP_CONFIG
+
+# トークンの有効期間 (秒)。一覧を開いたまま長時間置いてもダウンロードできるよう長めにする
+DOWNLOAD_TOKEN_MAX_AGE = 12 * 60 * 60
+
+_serializer = URLSafeTimedSerializer(APP_CONFIG['server']['secret_key'], salt='root-table-download')
+
+
+def make_root_table_token(table_id):
+    """ルート表のダウンロードURLに付けるトークンを作成する"""
+    return _serializer.dumps(int(table_id))
+
+
+def verify_root_table_token(token, table_id):
+    """トークンが有効期間内で、指定されたルート表のものであれば True"""
+    if not token:
+        return False
+    try:
+        return _serializer.loads(token, max_age=DOWNLOAD_TOKEN_MAX_AGE) == int(table_id)
+    except (BadSignature, SignatureExpired):
+        return False
+
+
+def root_table_download_url(table_id):
+    return f"/download/root-table/{int(table_id)}?token={make_root_table_token(table_id)}"
@@ -0,0 +1,179 @@
+# utils/metrics.py
+
+"""
+Prometheus 形式のメトリクス (/metrics)
+
+- HTTPリクエスト: ルートごとの件数・所要時間
+- Dash コールバック: 出力 (output ID) ごとの所要時間・応答サイズ
+- フォーム連携API: エンドポイントごとの結果 (created / queued / invalid / ...) と一括APIの行ごとの結果
+- コネクションプールの使用状況、キャッシュのヒット・ミス、ワーカーのRSS
+
+gunicorn では環境変数 PROMETHEUS_MULTIPROC_DIR (gunicorn.conf.py で設定) のディレクトリに
+各ワーカーが値を書き出し、/metrics はどのワーカーが応答しても全ワーカー分を集計して返す。
+環境変数が無い場合 (python app_main.py での開発時) はプロセス単体の値を返す。
+"""
+import os
+import resource
+import threading
+import time
+
+from flask import Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess
+)
+
+from config.settings import APP_CONFIG
+from data.cache import get_cache_stats
+from data.db_pool import get_pool
+from utils.callback_profiler import DASH_UPDATE_PATH, callback_output_id
+
+CONFIG = APP_CONFIG['metrics']
+MULTIPROCESS = bool(os.getenv('PROMETHEUS_MULTIPROC_DIR'))
+
+# プール・キャッシュ・RSS のゲージを更新する最短間隔 (秒)
+GAUGE_REFRESH_INTERVAL = 5
+
+HTTP_REQUESTS = Counter(
+    'app_http_requests_total', 'HTTPリクエスト数', ['route', 'method', 'status']
+)
+HTTP_LATENCY = Histogram(
+    'app_http_request_duration_seconds', 'HTTPリクエストの所要時間', ['route', 'method']
+)
+CALLBACK_LATENCY = Histogram(
+    'app_dash_callback_duration_seconds', 'Dash コールバックの所要時間', ['output']
+)
+CALLBACK_RESPONSE_BYTES = Histogram(
+    'app_dash_callback_response_bytes', 'Dash コールバックの応答サイズ', ['output'],
+    buckets=(1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, float('inf'))
+)
+API_SUBMISSIONS = Counter(
+    'app_api_submissions_total', 'フォーム連携APIのリクエスト数 (結果別)', ['endpoint', 'outcome']
+)
+API_BATCH_RECORDS = Counter(
+    'app_api_batch_records_total', 'フォーム連携の一括APIの行数 (結果別)', ['endpoint', 'status']
+)
+DB_POOL_CONNECTIONS = Gauge(
+    'app_db_pool_connections', 'コネクションプールの接続数 (全ワーカーの合計)', ['state'],
+    multiprocess_mode='livesum'
+)
+CACHE_HITS = Gauge(
+    'app_cache_hits', 'キャッシュのヒット数 (ワーカー起動からの累計、全ワーカーの合計)', ['cache'],
+    multiprocess_mode='livesum'
+)
+CACHE_MISSES = Gauge(
+    'app_cache_misses', 'キャッシュのミス数 (ワーカー起動からの累計、全ワーカーの合計)', ['cache'],
+    multiprocess_mode='livesum'
+)
+CACHE_ENTRIES = Gauge(
+    'app_cache_entries', 'キャッシュの件数 (全ワーカーの合計)', ['cache'],
+    multiprocess_mode='livesum'
+)
+WORKER_RSS = Gauge(
+    'app_worker_resident_memory_bytes', 'ワーカープロセスの常駐メモリ (RSS)',
+    multiprocess_mode='liveall' # 稼働中のワーカーの pid ごとに出力する (終了したワーカーの系列は child_exit で消える)
+)
+
+# ステータスコード -> フォーム連携APIの結果
+_SUBMISSION_OUTCOMES = {
+    200: 'created', 201: 'created', 202: 'queued', 400: 'invalid', 401: 'unauthorized',
+    404: 'not_found', 409: 'conflict', 422: 'mismatch',
+}
+
+_refresh_lock = threading.Lock()
+_last_refresh = 0.0
+
+
+def _read_rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # /proc が無い環境では最大RSS (Linux は KB 単位) で代用する
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _refresh_gauges(force=False):
+    """プール・キャッシュ・RSS のゲージを更新する (GAUGE_REFRESH_INTERVAL 秒に1回まで)"""
+    global _last_refresh
+    now = time.monotonic()
+    if not force and now - _last_refresh < GAUGE_REFRESH_INTERVAL:
+        return
+    if not _refresh_lock.acquire(blocking=False):
+        return
+    try:
+        _last_refresh = now
+        pool_stats = get_pool().stats()
+        for state in ('idle', 'in_use', 'size', 'max_size'):
+            DB_POOL_CONNECTIONS.labels(state=state).set(pool_stats[state])
+        for name, stats in get_cache_stats().items():
+            CACHE_HITS.labels(cache=name).set(stats['hits'])
+            CACHE_MISSES.labels(cache=name).set(stats['misses'])
+            CACHE_ENTRIES.labels(cache=name).set(stats['entries'])
+        WORKER_RSS.set(_read_rss_bytes())
+    except Exception as e:
+        print(f"メトリクスの更新エラー (_refresh_gauges): {e}")
+    finally:
+        _refresh_lock.release()
+
+
+def count_batch_records(endpoint, summary):
+    """一括APIの行ごとの結果 (summarize_batch_results の集計) を加算する"""
+    for status in ('created', 'queued', 'invalid', 'error'):
+        if summary.get(status):
+            API_BATCH_RECORDS.labels(endpoint=endpoint, status=status).inc(summary[status])
+
+
+def _before_request():
+    g.metrics_start = time.perf_counter()
+
+
+def _after_request(response):
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    route = request.url_rule.rule if request.url_rule is not None else '(unmatched)'
+    status = response.status_code
+
+    HTTP_REQUESTS.labels(route=route, method=request.method, status=str(status)).inc()
+    HTTP_LATENCY.labels(route=route, method=request.method).observe(elapsed)
+
+    if request.path == DASH_UPDATE_PATH and request.method == 'POST':
+        output = callback_output_id(request.get_json(silent=True))
+        CALLBACK_LATENCY.labels(output=output).observe(elapsed)
+        size = response.calculate_content_length()
+        if size is not None:
+            CALLBACK_RESPONSE_BYTES.labels(output=output).observe(size)
+    elif route.startswith('/api/submit-'):
+        if response.headers.get('Idempotent-Replayed'):
+            outcome = 'replayed'
+        elif status >= 500:
+            outcome = 'error'
+        else:
+            outcome = _SUBMISSION_OUTCOMES.get(status, str(status))
+        API_SUBMISSIONS.labels(endpoint=route, outcome=outcome).inc()
+
+    _refresh_gauges()
+    return response
+
+
+def _metrics_view():
+    token = CONFIG['auth_token']
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return Response("Unauthorized\n", status=401, mimetype='text/plain')
+    _refresh_gauges(force=True)
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_metrics(server):
+    """計測用のフックと /metrics を Flask サーバーに登録する (METRICS_ENABLED=false の場合は何もしない)"""
+    if not CONFIG['enabled']:
+        return
+    server.before_request(_before_request)
+    server.after_request(_after_request)
+    server.add_url_rule('/metrics', 'metrics', _metrics_view, methods=['GET'])
@@ -0,0 +1,40 @@
+# utils/pagination.py
+
+"""
+キーセット方式のページ送り (「前へ」「次へ」) の状態管理
+
+データ層の *_page 関数は after (前のページの最後の行の位置) から page_size 件と、次のページの位置を返す。
+ページの状態は dcc.Store に {'cursors': [各ページの先頭位置...], 'next': 次のページの位置} として保存し、
+「次へ」で next を積み、「前へ」で1つ戻す。先頭のページの位置は None。
+"""
+
+
+def first_page_state():
+    """先頭のページ (まだ読み込んでいない) の状態"""
+    return {'cursors': [None], 'next': None}
+
+
+def turn_page(state, direction=None):
+    """
+    ページ送り後の各ページの先頭位置のリストを返す。
+    direction が 'next' / 'prev' 以外 (絞り込みの変更など) の場合は先頭のページに戻る。
+    表示するページの位置はリストの最後の要素 (データ層の after に渡す)。
+    """
+    cursors = (state or {}).get('cursors') or [None]
+    if direction == 'next' and (state or {}).get('next'):
+        return cursors + [state['next']]
+    if direction == 'prev' and len(cursors) > 1:
+        return cursors[:-1]
+    if direction in ('next', 'prev'):
+        return cursors
+    return [None]
+
+
+def page_controls(cursors, row_count, next_cursor, page_size):
+    """
+    読み込んだページの (保存する状態, 「前へ」無効, 「次へ」無効, 件数表示) を返す。
+    件数表示は "51〜100 件目" の形式 (行が無ければ空文字)。
+    """
+    first = (len(cursors) - 1) * page_size + 1
+    page_info = f"{first}〜{first + row_count - 1} 件目" if row_count else ""
+    return {'cursors': cursors, 'next': next_cursor}, len(cursors) == 1, next_cursor is None, page_info